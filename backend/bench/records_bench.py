@@ -0,0 +1,64 @@
+﻿import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+from ..fabric_network.records import CertRecord
+
+
+def _sample_record(i: int, metadata: int) -> bytes:
+    return json.dumps({
+        "id": f"CERT{i:09d}",
+        "hash": f"{i:064x}",
+        "name": f"Maria Aparecida dos Santos {i}",
+        "dateOfBirth": "2024-03-15",
+        "timeOfBirth": "14:32",
+        "placeOfBirth": "Hospital Santa Casa de Misericórdia",
+        "fatherName": f"José Carlos de Oliveira {i}",
+        "motherName": f"Ana Paula dos Santos {i}",
+        "owner": "Cartório do 1º Ofício",
+        "timestamp": "2024-03-16T10:00:00Z",
+        "metadata": {f"campo{k:02d}": f"valor {i} {k}" for k in range(metadata)},
+        "source": "1234-5",
+    }, ensure_ascii=False).encode('utf-8')
+
+
+def _measure(raws: list, decode) -> tuple:
+    """(bytes retidos por registro, microssegundos por decodificação)"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [decode(raw) for raw in raws]
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+
+    started = time.perf_counter()
+    for raw in raws:
+        decode(raw)
+    elapsed = time.perf_counter() - started
+    return retained / len(raws), 1e6 * elapsed / len(raws)
+
+
+def benchmark(count: int, metadata: int) -> dict:
+    """Compara dict (json.loads) e CertRecord: memória retida e tempo de decodificação por registro"""
+    raws = [_sample_record(i, metadata) for i in range(count)]
+    results = {}
+    for label, decode in (("dict", json.loads), ("CertRecord", CertRecord.from_json)):
+        per_record, decode_us = _measure(raws, decode)
+        results[label] = {"bytesPerRecord": round(per_record), "decodeMicros": round(decode_us, 2)}
+    return {"records": count, "metadataEntries": metadata, "results": results}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark de memória/decodificação: dict x CertRecord")
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument("--metadata", type=int, action="append", help="Entradas de metadata (repetível)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    for metadata in args.metadata or [0, 8]:
+        json.dump(benchmark(args.records, metadata), sys.stdout, ensure_ascii=False)
+        sys.stdout.write("\n")
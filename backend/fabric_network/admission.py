@@ -0,0 +1,112 @@
+﻿import asyncio
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+
+# Limites padrão do controle de admissão (sobrescrevíveis por variáveis de ambiente)
+DEFAULT_MAX_INFLIGHT = 8
+DEFAULT_MAX_QUEUE = 64
+DEFAULT_QUEUE_TIMEOUT = 10.0
+
+
+class AdmissionRejected(Exception):
+    """Requisição recusada porque a fila de escrita está cheia"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"fila de escrita cheia, tente novamente em {retry_after}s")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Limita invokes simultâneos e recusa rapidamente quando a fila enche"""
+
+    def __init__(self, name: str, max_inflight: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_inflight)
+
+        # Métricas
+        self.inflight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.service_time_total = 0.0
+        self.completed = 0
+
+    @classmethod
+    def from_env(cls, name: str) -> "AdmissionController":
+        """Cria o controlador lendo ADMISSION_<NAME>_* do ambiente"""
+        prefix = f"ADMISSION_{name.upper()}_"
+        return cls(
+            name=name,
+            max_inflight=int(os.getenv(prefix + "MAX_INFLIGHT", DEFAULT_MAX_INFLIGHT)),
+            max_queue=int(os.getenv(prefix + "MAX_QUEUE", DEFAULT_MAX_QUEUE)),
+            queue_timeout=float(os.getenv(prefix + "QUEUE_TIMEOUT", DEFAULT_QUEUE_TIMEOUT)),
+        )
+
+    def retry_after(self) -> int:
+        """Estimativa (em segundos) de quando a fila terá espaço novamente"""
+        avg_service = self.service_time_total / self.completed if self.completed else 1.0
+        return max(1, math.ceil(avg_service * (self.waiting + 1) / self.max_inflight))
+
+    @asynccontextmanager
+    async def slot(self):
+        """Aguarda uma vaga de invoke; levanta AdmissionRejected se a fila estiver cheia"""
+        if self._semaphore.locked() and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise AdmissionRejected(self.retry_after())
+
+        start = time.monotonic()
+        if not self._semaphore.locked():
+            # Vaga livre: adquire sem ceder o event loop
+            await self._semaphore.acquire()
+        else:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                raise AdmissionRejected(self.retry_after())
+            finally:
+                self.waiting -= 1
+
+        waited = time.monotonic() - start
+        self.admitted += 1
+        self.wait_time_total += waited
+        self.wait_time_max = max(self.wait_time_max, waited)
+
+        self.inflight += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.inflight -= 1
+            self.completed += 1
+            self.service_time_total += time.monotonic() - started
+            self._semaphore.release()
+
+    def metrics(self) -> dict:
+        """Retorna um retrato das métricas de fila e tempo de espera"""
+        return {
+            "name": self.name,
+            "max_inflight": self.max_inflight,
+            "max_queue": self.max_queue,
+            "inflight": self.inflight,
+            "queue_depth": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "wait_time_avg": self.wait_time_total / self.admitted if self.admitted else 0.0,
+            "wait_time_max": self.wait_time_max,
+            "service_time_avg": self.service_time_total / self.completed if self.completed else 0.0,
+        }
+
+
+# Controlador compartilhado pelo caminho de escrita (register/update)
+write_admission = AdmissionController.from_env("write")
@@ -0,0 +1,43 @@
+﻿import hashlib
+import json
+
+# Versão usada pelo chaincode certcc em computeCertHash
+HASH_VERSION = "v1"
+# Campos essenciais na ordem fixa do hash canônico
+HASH_FIELDS = ("name", "dateOfBirth", "timeOfBirth", "placeOfBirth", "fatherName", "motherName")
+
+
+def normalize(value: str) -> str:
+    """Mesma normalização do chaincode: remove e colapsa espaços"""
+    return " ".join((value or "").split())
+
+
+def compute_cert_hash(record: dict, version: str = HASH_VERSION) -> str:
+    """Hash canônico SHA256 (Name|DateOfBirth|...|Version), idêntico ao computeCertHash em Go"""
+    parts = [normalize(record.get(field, "")) for field in HASH_FIELDS] + [normalize(version)]
+    return hashlib.sha256("|".join(parts).encode('utf-8')).hexdigest()
+
+
+def recompute_chunk(raw_records: list) -> list:
+    """Recalcula o hash de registros JSON crus; devolve (id, hash gravado, hash esperado) dos divergentes.
+
+    Registros off-ledger (private) não têm os dados pessoais no estado
+    público: voltam com hash esperado None, para o chaincode conferir.
+
+    Roda em processos separados da varredura de integridade, por isso este
+    módulo não importa nada da rede Fabric.
+    """
+    suspects = []
+    for raw in raw_records:
+        try:
+            record = json.loads(raw) if isinstance(raw, (str, bytes)) else raw
+            if record.get("private"):
+                suspects.append((record.get("id"), record.get("hash"), None))
+                continue
+            expected = compute_cert_hash(record)
+        except (TypeError, ValueError, AttributeError):
+            suspects.append((None, None, None))
+            continue
+        if expected != record.get("hash"):
+            suspects.append((record.get("id"), record.get("hash"), expected))
+    return suspects
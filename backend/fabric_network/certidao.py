@@ -1,83 +1,286 @@
-﻿from .network import fabric_client, admin, channel_name, peer0_org1, peer0_org2, channel
+﻿import asyncio
+import hashlib
+import json
+import os
+import secrets
 
-async def register_cert(cert_id: str, nome: str, data: str, hora: str, hospital: str, pai: str, mae: str, cartorio: str, cartorio_reg: str, metadata: str):
-    """Registra uma nova certidão na blockchain"""
-    print("[CHAINCODE] Registering cert on blockchain...")
-    args = [cert_id, nome, data, hora, hospital, pai, mae,
-            cartorio, cartorio_reg, metadata]
-    
+from .network import channel_name, get_network
+from .admission import AdmissionRejected, write_admission
+from .idempotency import WRITE_INVOKE_TIMEOUT, WRITE_RETRY_ATTEMPTS, retry_delay
+from .logs import get_logger
+
+logger = get_logger("chaincode")
+
+# "private": dados pessoais na coleção certPII e só id/hash/owner/source/timestamp no estado público
+PII_MODE = os.getenv("PII_MODE", "public").lower()
+# Trecho da mensagem de erro do chaincode quando a chave não existe no canal
+NOT_FOUND_MARKER = "não encontrado"
+
+
+class ChaincodeError(Exception):
+    """Query recusada pelo chaincode, com a mensagem já decodificada do ProposalResponse"""
+
+    def __init__(self, message: str, status: int = None):
+        super().__init__(message)
+        self.status = status
+
+
+class CertNotFound(ChaincodeError):
+    """O registro não existe no canal consultado"""
+
+
+class WriteRejected(ChaincodeError):
+    """Invoke sem txId: o hfc devolve falhas de endosso/orderer como texto em vez de levantar"""
+
+
+# Falhas que uma nova tentativa pode resolver; erros do chaincode (validação, registro existente) são determinísticos
+TRANSIENT_MARKERS = (
+    "timed out", "timeout", "deadline exceeded", "unavailable", "service_unavailable",
+    "mvcc_read_conflict", "phantom_read_conflict", "did not validate",
+)
+
+
+def is_transient(error: Exception) -> bool:
+    """Se vale repetir o invoke que falhou com este erro"""
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    text = str(error).lower()
+    return any(marker in text for marker in TRANSIENT_MARKERS)
+
+
+def proposal_error(error: Exception) -> Exception:
+    """Converte a exceção do hfc em ChaincodeError/CertNotFound.
+
+    chaincode_query levanta Exception([ProposalResponse, ...]) e str() dessa
+    exceção é o dump protobuf, com o texto escapado ("n\\303\\243o"); a
+    mensagem real está em response.message de cada resposta com falha.
+    Outras exceções (timeout, gRPC) são devolvidas sem alteração.
+    """
+    responses = error.args[0] if error.args and isinstance(error.args[0], (list, tuple)) else []
+    failed = [
+        item.response for item in responses
+        if getattr(getattr(item, "response", None), "status", 200) >= 400
+    ]
+    if not failed:
+        return error
+    messages = [response.message for response in failed]
+    cls = CertNotFound if any(NOT_FOUND_MARKER in message for message in messages) else ChaincodeError
+    return cls(messages[0], failed[0].status)
+
+
+def _tx_id(response):
+    """txId devolvido pelas funções de escrita do certcc, para correlacionar request_id e transação"""
     try:
-        response = await fabric_client.chaincode_invoke(
-            requestor=admin,
-            channel_name=channel_name,
-            peers=[peer0_org1, peer0_org2],
-            args=args,
-            cc_name='certcc',
-            fcn='RegisterCert',
-            wait_for_event=True
-        )
-        print(f"[SUCCESS] Certificate {cert_id} registered successfully!")
-        return response if response else "OK"
-    except Exception as e:
-        print(f"[ERROR] Failed to register cert: {e}")
-        raise
+        return json.loads(response).get("txId")
+    except (TypeError, ValueError, AttributeError):
+        return None
 
 
-async def verify_cert(cert_id: str):
-    """Verifica uma certidão e retorna seus dados"""
-    print(f"[CHAINCODE] Verifying cert {cert_id}...")
+def write_fingerprint(fcn: str, args: list, transient_map: dict = None) -> str:
+    """Impressão da escrita gravada no chaincode junto com a chave de idempotência.
+
+    Salts aleatórios ficam de fora: um reenvio da mesma requisição (que gera
+    um salt novo) continua reconhecido; outra requisição com a mesma chave não.
+    """
+    transient = {}
+    for name, value in (transient_map or {}).items():
+        if name in ("salt", "idempotencyKey", "idempotencyFingerprint"):
+            continue
+        value = value.decode('utf-8') if isinstance(value, bytes) else value
+        try:
+            data = json.loads(value)
+        except ValueError:
+            data = value
+        if isinstance(data, dict):
+            data.pop("salt", None)
+        transient[name] = data
+    body = json.dumps([fcn, args, transient], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+
+async def _invoke(fcn: str, cert_id: str, args: list, shard: str, cartorio: str = None, transient_map: dict = None,
+                  idempotency_key: str = None):
+    """Invoke; com chave de idempotência, falhas são repetidas com backoff exponencial.
+
+    Antes de cada reenvio a ledger é consultada (GetWriteResult): se a
+    tentativa anterior foi confirmada apesar do erro (ex.: timeout esperando
+    o evento), devolve o resultado original em vez de escrever de novo. O
+    chaincode guarda o resultado por (função, cert_id, chave) com a impressão
+    da requisição e recusa a mesma chave usada com outro conteúdo.
+    """
+    if not idempotency_key:
+        return await _invoke_once(fcn, cert_id, args, shard, cartorio, transient_map)
+
+    request_fingerprint = write_fingerprint(fcn, args, transient_map)
+    transient_map = dict(transient_map or {}, idempotencyKey=idempotency_key.encode('utf-8'),
+                         idempotencyFingerprint=request_fingerprint.encode('utf-8'))
+    for attempt in range(1, WRITE_RETRY_ATTEMPTS + 1):
+        try:
+            return await _invoke_once(fcn, cert_id, args, shard, cartorio, transient_map)
+        except AdmissionRejected:
+            raise
+        except Exception as e:
+            if attempt == WRITE_RETRY_ATTEMPTS or not is_transient(e):
+                raise
+            delay = retry_delay(attempt)
+            logger.warning("Retrying chaincode invoke", extra={
+                "fcn": fcn, "cert_id": cert_id, "channel": shard, "attempt": attempt,
+                "delay_s": round(delay, 3), "error": str(e),
+            })
+        await asyncio.sleep(delay)
+        landed = await _committed_write(fcn, cert_id, idempotency_key, request_fingerprint, shard)
+        if landed is not None:
+            logger.info("Write already committed, returning original outcome", extra={
+                "fcn": fcn, "cert_id": cert_id, "channel": shard, "tx_id": _tx_id(landed),
+            })
+            return landed
+
+
+async def _committed_write(fcn: str, cert_id: str, idempotency_key: str, request_fingerprint: str, shard: str):
+    """Resultado {txId, hash} gravado pela escrita com a chave, ou None se ela não foi confirmada"""
     try:
-        response = await fabric_client.chaincode_query(
-            requestor=admin,
-            channel_name=channel_name,
-            peers=[peer0_org1],
-            args=[cert_id],
-            cc_name='certcc',
-            fcn='VerifyCert'
-        )
-        print(f"[SUCCESS] Certificate {cert_id} verified!")
-        return response
+        response = await _query('GetWriteResult', cert_id, shard, [fcn, cert_id, idempotency_key, request_fingerprint])
+    except Exception:
+        # sem resposta segura: o reenvio é seguro, o chaincode repete o resultado se a chave já existir
+        return None
+    if isinstance(response, bytes):
+        response = response.decode('utf-8')
+    return response if _tx_id(response) else None
+
+
+async def _invoke_once(fcn: str, cert_id: str, args: list, shard: str, cartorio: str = None, transient_map: dict = None):
+    """Invoke com controle de admissão, assinado pela identidade do cartório; toda escrita registra request_id -> tx_id"""
+    logger.debug("Invoking chaincode", extra={"fcn": fcn, "cert_id": cert_id, "channel": shard})
+    net = get_network()
+    try:
+        async with write_admission.slot():
+            response = await net.fabric_client.chaincode_invoke(
+                requestor=net.identity_for(cartorio),
+                channel_name=shard,
+                peers=net.select_endorsers(shard),
+                args=args,
+                cc_name='certcc',
+                fcn=fcn,
+                transient_map=transient_map,
+                wait_for_event=True,
+                wait_for_event_timeout=WRITE_INVOKE_TIMEOUT
+            )
     except Exception as e:
-        print(f"[ERROR] Failed to verify cert: {e}")
+        logger.error("Chaincode invoke failed", extra={"fcn": fcn, "cert_id": cert_id, "channel": shard, "error": str(e)})
         raise
+    tx_id = _tx_id(response)
+    if tx_id is None:
+        # toda escrita do certcc devolve {txId, hash}; qualquer outra resposta é a mensagem de falha
+        logger.error("Chaincode invoke rejected", extra={"fcn": fcn, "cert_id": cert_id, "channel": shard, "error": response})
+        raise WriteRejected(response or "invoke sem resposta")
+    logger.info("Chaincode invoke committed", extra={"fcn": fcn, "cert_id": cert_id, "channel": shard, "tx_id": tx_id})
+    return response
 
 
-async def get_history(cert_id: str):
-    """Retorna o histórico de alterações de uma certidão"""
-    print(f"[CHAINCODE] Querying history for {cert_id}...")
+async def _query(fcn: str, cert_id: str, shard: str, args: list = None):
+    """Query em um peer de consulta do canal; sucessos são amostrados no log (por padrão cert_id é o único argumento)"""
+    logger.debug("Querying chaincode", extra={"fcn": fcn, "cert_id": cert_id, "channel": shard})
+    net = get_network()
     try:
-        response = await fabric_client.chaincode_query(
-            requestor=admin,
-            channel_name=channel_name,
-            peers=[peer0_org1],
-            args=[cert_id],
+        response = await net.fabric_client.chaincode_query(
+            requestor=net.admin,
+            channel_name=shard,
+            peers=[net.select_query_peer(shard)],
+            args=args or [cert_id],
             cc_name='certcc',
-            fcn='GetHistory'
+            fcn=fcn
         )
-        print(f"[SUCCESS] History retrieved for {cert_id}!")
-        return response
     except Exception as e:
-        print(f"[ERROR] Failed to get history: {e}")
-        raise
+        error = proposal_error(e)
+        logger.warning("Chaincode query failed", extra={"fcn": fcn, "cert_id": cert_id, "channel": shard, "error": str(error)})
+        if error is e:
+            raise
+        raise error from e
+    logger.info("Chaincode query succeeded", extra={"fcn": fcn, "cert_id": cert_id, "channel": shard, "sample": True})
+    return response
+
+
+async def register_cert(cert_id: str, nome: str, data: str, hora: str, hospital: str, pai: str, mae: str, cartorio: str, cartorio_reg: str, metadata: str, shard: str = channel_name, signer: str = None, idempotency_key: str = None):
+    """Registra uma nova certidão na blockchain; signer é o cartório cuja identidade assina (Admin se None)"""
+    if PII_MODE == "private":
+        pii = {
+            "name": nome, "dateOfBirth": data, "timeOfBirth": hora, "placeOfBirth": hospital,
+            "fatherName": pai, "motherName": mae, "metadata": json.loads(metadata or "{}"),
+            "salt": secrets.token_hex(16),
+        }
+        transient = {"pii": json.dumps(pii).encode('utf-8')}
+        return await _invoke('RegisterCertPrivate', cert_id, [cert_id, cartorio, cartorio_reg], shard, signer, transient, idempotency_key)
+    args = [cert_id, nome, data, hora, hospital, pai, mae,
+            cartorio, cartorio_reg, metadata]
+    return await _invoke('RegisterCert', cert_id, args, shard, signer, idempotency_key=idempotency_key)
+
+
+async def verify_cert(cert_id: str, shard: str = channel_name):
+    """Verifica uma certidão e retorna seus dados"""
+    return await _query('VerifyCert', cert_id, shard)
+
+
+async def get_history(cert_id: str, shard: str = channel_name):
+    """Retorna o histórico de alterações de uma certidão"""
+    return await _query('GetHistory', cert_id, shard)
 
 
-async def update_cert(cert_id: str, field_name: str, new_value: str):
+async def update_cert(cert_id: str, field_name: str, new_value: str, shard: str = channel_name, cartorio: str = None, idempotency_key: str = None):
     """Atualiza um campo específico de uma certidão"""
-    print(f"[CHAINCODE] Updating cert {cert_id}, field {field_name}...")
+    if PII_MODE == "private":
+        return await _update_private(cert_id, {field_name: new_value}, shard, cartorio, idempotency_key)
     args = [cert_id, field_name, new_value]
-    
-    try:
-        response = await fabric_client.chaincode_invoke(
-            requestor=admin,
-            channel_name=channel_name,
-            peers=[peer0_org1, peer0_org2],
-            args=args,
-            cc_name='certcc',
-            fcn='UpdateCert',
-            wait_for_event=True
-        )
-        print(f"[SUCCESS] Certificate {cert_id} updated successfully!")
-        return response if response else "OK"
-    except Exception as e:
-        print(f"[ERROR] Failed to update cert: {e}")
-        raise
\ No newline at end of file
+    return await _invoke('UpdateCert', cert_id, args, shard, cartorio, idempotency_key=idempotency_key)
+
+
+async def update_cert_batch(cert_id: str, updates: str, shard: str = channel_name, cartorio: str = None, idempotency_key: str = None):
+    """Atualiza vários campos de uma certidão em uma única transação"""
+    if PII_MODE == "private":
+        return await _update_private(cert_id, json.loads(updates), shard, cartorio, idempotency_key)
+    args = [cert_id, updates]
+    return await _invoke('UpdateCertBatch', cert_id, args, shard, cartorio, idempotency_key=idempotency_key)
+
+
+async def _update_private(cert_id: str, updates: dict, shard: str, cartorio: str = None, idempotency_key: str = None):
+    """Alteração off-ledger: os novos valores vão só no transient map; o salt é usado se o registro for migrado"""
+    transient = {
+        "updates": json.dumps(updates).encode('utf-8'),
+        "salt": secrets.token_hex(16).encode('utf-8'),
+    }
+    return await _invoke('UpdateCertPrivate', cert_id, [cert_id], shard, cartorio, transient, idempotency_key)
+
+
+async def get_cert_pii(cert_id: str, shard: str = channel_name):
+    """Registro completo com os dados pessoais (só peers membros da coleção certPII respondem)"""
+    return await _query('GetCertPII', cert_id, shard)
+
+
+async def list_certs(bookmark: str, page_size: int, shard: str = channel_name):
+    """Página de registros do canal em ordem de chave (usada pela varredura de integridade)"""
+    net = get_network()
+    return await net.fabric_client.chaincode_query(
+        requestor=net.admin,
+        channel_name=shard,
+        peers=[net.select_query_peer(shard)],
+        args=[bookmark, str(page_size)],
+        cc_name='certcc',
+        fcn='ListCerts'
+    )
+
+
+async def prune_changes(before: str, limit: int, shard: str = channel_name):
+    """Remove até limit entradas do índice de alterações anteriores à hora before (AAAAMMDDHH); assinado pelo Admin"""
+    return await _invoke_once('PruneChanges', before, [before, str(limit)], shard)
+
+
+async def list_changed_certs(bucket: str, bookmark: str, page_size: int, shard: str = channel_name):
+    """Página dos registros alterados numa hora UTC (AAAAMMDDHH), pelo índice gravado a cada escrita"""
+    net = get_network()
+    return await net.fabric_client.chaincode_query(
+        requestor=net.admin,
+        channel_name=shard,
+        peers=[net.select_query_peer(shard)],
+        args=[bucket, bookmark, str(page_size)],
+        cc_name='certcc',
+        fcn='ListChangedCerts'
+    )
@@ -0,0 +1,70 @@
+﻿import itertools
+import json
+import os
+import yaml
+
+from .logs import get_logger
+
+logger = get_logger("profile")
+
+# Perfil padrão: rede de teste com 2 orgs, 1 peer por org e 1 orderer
+DEFAULT_PROFILE_PATH = os.path.join(os.path.dirname(__file__), "profiles", "test-network.yaml")
+
+
+def load_profile(path: str) -> dict:
+    """Carrega um perfil de conexão em YAML ou JSON"""
+    logger.info("Loading connection profile", extra={"path": path})
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith(".json"):
+            profile = json.load(f)
+        else:
+            profile = yaml.safe_load(f)
+
+    for section in ("organizations", "peers", "orderers", "channels"):
+        if not profile.get(section):
+            raise ValueError(f"Perfil de conexão {path} sem a seção '{section}'")
+    return profile
+
+
+def endpoint_from_url(url: str) -> str:
+    """Converte 'grpcs://host:porta' em 'host:porta'"""
+    return url.split("://", 1)[-1]
+
+
+def ssl_target_name(node: dict, name: str) -> str:
+    """Nome TLS esperado pelo nó (grpcOptions.ssl-target-name-override ou o próprio nome)"""
+    return node.get("grpcOptions", {}).get("ssl-target-name-override", name)
+
+
+def tls_ca_path(node: dict) -> str:
+    """Caminho do certificado TLS CA do nó"""
+    return node["tlsCACerts"]["path"]
+
+
+class EndorsementSelector:
+    """Escolhe os peers endossantes de um canal conforme a política 'N de orgs'.
+
+    A política vem de channels.<canal>.endorsementPolicy no perfil:
+        endorsementPolicy:
+          orgs: [Org1MSP, Org2MSP]
+          required: 2
+    Sem política explícita, exige a maioria das orgs com peers endossantes
+    (equivalente ao padrão MAJORITY Endorsement do lifecycle do Fabric).
+    Entre os peers de uma mesma org a escolha é feita em rodízio.
+    """
+
+    def __init__(self, org_peers: dict, policy: dict = None):
+        policy = policy or {}
+        self.orgs = [org for org in policy.get("orgs", org_peers) if org_peers.get(org)]
+        self.required = policy.get("required", len(self.orgs) // 2 + 1)
+        if self.required > len(self.orgs):
+            raise ValueError(
+                f"Política exige {self.required} orgs mas apenas {len(self.orgs)} têm peers endossantes"
+            )
+        self._org_cycle = itertools.cycle(self.orgs)
+        self._peer_cycles = {org: itertools.cycle(org_peers[org]) for org in self.orgs}
+
+    def select(self) -> list:
+        """Retorna um peer de cada uma das 'required' orgs, alternando orgs e peers"""
+        orgs = [next(self._org_cycle) for _ in range(self.required)]
+        return [next(self._peer_cycles[org]) for org in orgs]
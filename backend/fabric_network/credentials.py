@@ -0,0 +1,198 @@
+﻿import asyncio
+import inspect
+import os
+import time
+
+from cryptography import x509
+from hfc.fabric.user import create_user
+
+from .logs import get_logger
+
+logger = get_logger("credentials")
+
+# Intervalo de verificação dos arquivos de identidade/TLS (segundos)
+CREDENTIALS_POLL_INTERVAL = float(os.getenv("CREDENTIALS_POLL_INTERVAL", "5"))
+# Tempo que um canal gRPC substituído continua aberto para as chamadas em andamento
+CHANNEL_CLOSE_GRACE = 30.0
+
+
+def _normalize(value: str) -> str:
+    return " ".join(value.split()).lower()
+
+
+def same_cartorio(a: str, b: str) -> bool:
+    """Compara nomes de cartório ignorando maiúsculas e espaços extras"""
+    return _normalize(a) == _normalize(b)
+
+
+def _signature(path: str):
+    """Identifica uma versão do arquivo (troca por rename/symlink muda o inode)"""
+    st = os.stat(path)
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class WatchedFile:
+    """Conteúdo de um arquivo de credencial, relido só quando o arquivo muda"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._signature = None
+        self.data = None
+        self.refresh()
+
+    def refresh(self) -> bool:
+        """Relê o arquivo se ele mudou; retorna True quando houve mudança"""
+        try:
+            signature = _signature(self.path)
+        except FileNotFoundError:
+            # durante a troca o arquivo pode sumir por um instante: mantém a versão atual
+            return False
+        if signature == self._signature:
+            return False
+        with open(self.path, 'rb') as f:
+            self.data = f.read()
+        changed = self._signature is not None
+        self._signature = signature
+        return changed
+
+
+class CredentialManager:
+    """Identidades de assinatura e certificados TLS com recarga a quente.
+
+    Cada identidade (usuário da organização do cliente) fica em cache já
+    carregada e só é refeita quando o certificado ou a chave mudam no disco.
+    Cartórios podem ter identidade própria (client.identities do perfil);
+    os demais usam o Admin. Para os CAs TLS, a mudança dispara a criação de
+    um novo canal gRPC em segundo plano, trocado no peer/orderer sem parar
+    as requisições; o canal antigo é fechado depois de CHANNEL_CLOSE_GRACE.
+    """
+
+    def __init__(self, state_store, org_name: str, msp_id: str, users: dict, identities: dict = None,
+                 poll_interval: float = CREDENTIALS_POLL_INTERVAL):
+        self.state_store = state_store
+        self.org_name = org_name
+        self.msp_id = msp_id
+        self.poll_interval = poll_interval
+        self.identity_map = {_normalize(cartorio): user for cartorio, user in (identities or {}).items()}
+        unknown = set(self.identity_map.values()) - set(users)
+        if unknown:
+            raise ValueError(f"Identidades sem usuário na organização do cliente: {sorted(unknown)}")
+
+        self._user_files = {
+            name: (WatchedFile(paths["cert"]), WatchedFile(paths["private_key"]))
+            for name, paths in users.items()
+        }
+        self._users = {name: self._load_user(name) for name in users}
+        self._tls = {}
+        self._pending = set()
+        self.reloads = 0
+        self.last_reload = None
+        self._task = None
+        self._task_pid = None
+
+    def _load_user(self, name: str):
+        cert, key = self._user_files[name]
+        user = create_user(
+            name=name,
+            org=self.org_name,
+            state_store=self.state_store,
+            msp_id=self.msp_id,
+            key_path=key.path,
+            cert_path=cert.path
+        )
+        # no meio de uma rotação o certificado novo pode chegar antes da chave nova
+        cert_key = x509.load_pem_x509_certificate(user.enrollment.cert).public_key()
+        if cert_key.public_numbers() != user.enrollment.private_key.public_key().public_numbers():
+            raise ValueError(f"Certificado e chave de {name} não formam um par")
+        return user
+
+    def user(self, name: str = "Admin"):
+        return self._users[name]
+
+    def has_identity(self, cartorio: str = None) -> bool:
+        """Se o cartório tem identidade própria no perfil"""
+        return bool(cartorio) and _normalize(cartorio) in self.identity_map
+
+    def user_for(self, cartorio: str = None):
+        """Identidade que assina em nome do cartório (Admin se não houver uma própria)"""
+        if cartorio:
+            name = self.identity_map.get(_normalize(cartorio))
+            if name:
+                return self._users[name]
+        return self._users["Admin"]
+
+    def tls_ca(self, path: str) -> bytes:
+        """Bytes do CA TLS em cache (lidos uma vez por versão do arquivo)"""
+        if path not in self._tls:
+            self._tls[path] = (WatchedFile(path), [])
+        return self._tls[path][0].data
+
+    def on_tls_change(self, path: str, reconnect):
+        """Registra reconnect(ca_bytes) -> canal antigo, chamado quando o CA em path muda"""
+        self.tls_ca(path)
+        self._tls[path][1].append(reconnect)
+
+    def start(self):
+        """Inicia a verificação periódica no event loop deste processo"""
+        if self._task_pid != os.getpid() or self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._watch())
+            self._task_pid = os.getpid()
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.reload()
+            except Exception as e:
+                logger.error("Credential reload failed", extra={"error": str(e)})
+
+    async def reload(self) -> list:
+        """Confere todos os arquivos e troca o que mudou; retorna os itens recarregados"""
+        loop = asyncio.get_running_loop()
+        changed = []
+
+        for name, (cert, key) in self._user_files.items():
+            cert_changed, key_changed = cert.refresh(), key.refresh()
+            if not (cert_changed or key_changed or name in self._pending):
+                continue
+            try:
+                # troca atômica: requisições já em andamento seguem com a identidade anterior
+                self._users[name] = await loop.run_in_executor(None, self._load_user, name)
+            except Exception as e:
+                # mantém a identidade atual e tenta de novo na próxima verificação
+                self._pending.add(name)
+                logger.warning("Identity not reloaded yet", extra={"identity": name, "error": str(e)})
+                continue
+            self._pending.discard(name)
+            changed.append(f"identity:{name}")
+
+        for path, (ca, reconnects) in self._tls.items():
+            if ca.refresh():
+                for reconnect in reconnects:
+                    old_channel = reconnect(ca.data)
+                    asyncio.ensure_future(self._close_later(old_channel))
+                changed.append(f"tls:{path}")
+
+        if changed:
+            self.reloads += 1
+            self.last_reload = time.time()
+            logger.info("Credentials reloaded", extra={"changed": changed})
+        return changed
+
+    async def _close_later(self, channel):
+        await asyncio.sleep(CHANNEL_CLOSE_GRACE)
+        close = getattr(channel, "close", None)
+        if close is None:
+            return
+        result = close()
+        if inspect.isawaitable(result):
+            await result
+
+    def metrics(self) -> dict:
+        return {
+            "identities": sorted(self._users),
+            "cartorios": sorted(self.identity_map),
+            "tlsFiles": len(self._tls),
+            "reloads": self.reloads,
+            "lastReload": self.last_reload,
+        }
@@ -0,0 +1,182 @@
+﻿import asyncio
+import json
+import os
+
+from hfc.protos.common.common_pb2 import BlockMetadataIndex
+from hfc.protos.peer.transaction_pb2 import TxValidationCode
+
+from .network import get_network
+from .logs import get_logger
+from .shared_cache import read_cache
+
+logger = get_logger("events")
+
+# Evento emitido pelo chaincode certcc em RegisterCert/UpdateCert/UpdateCertBatch
+CERT_EVENT_NAME = "CertChanged"
+CHAINCODE_NAME = "certcc"
+# Eventos pendentes por assinante antes de começar a descartar os mais antigos
+SUBSCRIBER_QUEUE_SIZE = 100
+# Espera entre tentativas de reconexão do listener (segundos)
+RECONNECT_DELAY = 2.0
+MAX_RECONNECT_DELAY = 30.0
+
+
+class Subscription:
+    """Assinante de eventos: cert_ids e/ou cartórios (source) observados"""
+
+    def __init__(self, cert_ids=None, sources=None):
+        self.cert_ids = set(cert_ids or [])
+        self.sources = set(sources or [])
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.dropped = 0
+
+    def matches(self, event: dict) -> bool:
+        if not self.cert_ids and not self.sources:
+            return True
+        return event.get("id") in self.cert_ids or event.get("source") in self.sources
+
+    def push(self, event: dict):
+        """Entrega sem bloquear; assinante lento perde os eventos mais antigos"""
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+
+class CertEventBroker:
+    """Um único listener de blocos por canal, repassado a todos os assinantes.
+
+    O listener é iniciado na primeira assinatura (por processo) e fica
+    reconectando com backoff se o peer cair; a reconexão retoma do bloco
+    seguinte ao último processado, sem perder os eventos do intervalo. Um
+    bloco ou transação que falhe é registrado no log e pulado, sem derrubar
+    o stream dos demais. Os eventos passam por uma fila única: a invalidação
+    do cache compartilhado (SQLite) roda fora do event loop e cada evento só
+    é repassado depois dela, na ordem dos blocos.
+    """
+
+    def __init__(self):
+        self.subscriptions = set()
+        self.published = 0
+        self._tasks = {}
+        self._tasks_pid = None
+        self._deliveries = None
+        self._delivery_task = None
+        # último bloco processado por canal (ponto de retomada na reconexão)
+        self._last_blocks = {}
+
+    def subscribe(self, channels: list, cert_ids=None, sources=None) -> Subscription:
+        self.ensure_listening(channels)
+        sub = Subscription(cert_ids, sources)
+        self.subscriptions.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        self.subscriptions.discard(sub)
+
+    def publish(self, event: dict):
+        self.published += 1
+        for sub in list(self.subscriptions):
+            try:
+                if sub.matches(event):
+                    sub.push(event)
+            except Exception as e:
+                logger.error("Event delivery failed", extra={"txId": event.get("txId"), "error": str(e)})
+
+    def ensure_listening(self, channels: list):
+        if self._tasks_pid != os.getpid():
+            self._tasks = {}
+            self._last_blocks = {}
+            self._deliveries = asyncio.Queue()
+            self._delivery_task = None
+            self._tasks_pid = os.getpid()
+        if self._delivery_task is None or self._delivery_task.done():
+            self._delivery_task = asyncio.ensure_future(self._deliver())
+        for ch in channels:
+            if ch not in self._tasks or self._tasks[ch].done():
+                self._tasks[ch] = asyncio.ensure_future(self._listen(ch))
+
+    async def _deliver(self):
+        """Invalida o cache de cada evento em outra thread (como invalidate_reads) e então o repassa"""
+        while True:
+            event = await self._deliveries.get()
+            try:
+                await asyncio.to_thread(read_cache.invalidate, event["id"])
+            except Exception as e:
+                logger.error("Cache invalidation failed", extra={"cert_id": event.get("id"), "error": str(e)})
+            self.publish(event)
+
+    async def _listen(self, ch: str):
+        delay = RECONNECT_DELAY
+        while True:
+            hub = None
+            try:
+                net = get_network()
+                hub = net.fabric_client.get_channel(ch).newChannelEventHub(net.select_query_peer(ch), net.admin)
+                hub.registerBlockEvent(unregister=False, onEvent=lambda block: self._on_block(ch, block))
+                last = self._last_blocks.get(ch)
+                start = None if last is None else last + 1
+                logger.info("Listening for chaincode events", extra={"event": CERT_EVENT_NAME, "channel": ch, "start": start})
+                await hub.connect(filtered=False, start=start)
+                delay = RECONNECT_DELAY
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Event listener failed", extra={"channel": ch, "error": str(e)})
+            finally:
+                if hub is not None and hub.connected:
+                    hub.disconnect()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+    def _on_block(self, ch: str, block: dict):
+        """Extrai os eventos CertChanged de transações válidas do bloco; erros não derrubam o listener"""
+        number = None
+        try:
+            number = int(block['header']['number'])
+            tx_filter = block['metadata']['metadata'][BlockMetadataIndex.Value('TRANSACTIONS_FILTER')]
+            for index, data in enumerate(block['data']['data']):
+                if tx_filter and tx_filter[index] != TxValidationCode.Value('VALID'):
+                    continue
+                try:
+                    self._on_transaction(ch, number, data)
+                except Exception as e:
+                    logger.error("Failed to process transaction events",
+                                 extra={"channel": ch, "blockNumber": number, "txIndex": index, "error": str(e)})
+        except Exception as e:
+            logger.error("Unreadable block", extra={"channel": ch, "blockNumber": number, "error": str(e)})
+        finally:
+            # o bloco com erro é pulado: retomar nele repetiria a falha a cada reconexão
+            if number is not None:
+                self._last_blocks[ch] = number
+
+    def _on_transaction(self, ch: str, number: int, data: dict):
+        payload = data['payload']
+        channel_header = payload['header']['channel_header']
+        # só ENDORSER_TRANSACTION carrega eventos de chaincode
+        if channel_header['type'] != 3:
+            return
+        for action in payload['data'].get('actions', []):
+            cc_event = action['payload']['action']['proposal_response_payload']['extension']['events']
+            if cc_event.get('chaincode_id') != CHAINCODE_NAME or cc_event.get('event_name') != CERT_EVENT_NAME:
+                continue
+            event = json.loads(cc_event['payload'])
+            event.update({
+                "channel": ch,
+                "txId": channel_header['tx_id'],
+                "blockNumber": number,
+            })
+            # escritas de outras instâncias também invalidam o cache local; o callback do hfc roda
+            # no event loop, então o SQLite fica para _deliver
+            self._deliveries.put_nowait(event)
+
+    def metrics(self) -> dict:
+        return {
+            "subscribers": len(self.subscriptions),
+            "published": self.published,
+            "dropped": sum(sub.dropped for sub in self.subscriptions),
+            "listeners": [ch for ch, task in self._tasks.items() if not task.done()],
+        }
+
+
+broker = CertEventBroker()
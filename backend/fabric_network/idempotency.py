@@ -0,0 +1,174 @@
+﻿import hashlib
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from .admission import write_admission
+from .logs import get_logger
+
+logger = get_logger("idempotency")
+
+# Tabela chave de idempotência -> resultado, em disco para sobreviver a reinícios e compartilhada entre workers
+IDEMPOTENCY_DB_PATH = os.getenv("IDEMPOTENCY_DB_PATH", "./backend/idempotency.sqlite3")
+# Máximo de chaves guardadas; as mais antigas são descartadas
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "100000"))
+# Tentativas de um invoke com chave de idempotência e espera base/máxima do backoff exponencial
+WRITE_RETRY_ATTEMPTS = int(os.getenv("WRITE_RETRY_ATTEMPTS", "4"))
+WRITE_RETRY_BASE_DELAY = float(os.getenv("WRITE_RETRY_BASE_DELAY", "0.5"))
+WRITE_RETRY_MAX_DELAY = float(os.getenv("WRITE_RETRY_MAX_DELAY", "8"))
+# Espera máxima pelo evento de commit de cada invoke (wait_for_event_timeout do hfc)
+WRITE_INVOKE_TIMEOUT = float(os.getenv("WRITE_INVOKE_TIMEOUT", "30"))
+# Folga sobre o pior caso das tentativas (endosso, envio ao orderer, GetWriteResult)
+PENDING_MARGIN = 30.0
+# A cada quantas chaves novas o limite de IDEMPOTENCY_MAX_KEYS é aplicado
+TRIM_EVERY = 100
+
+
+class IdempotencyConflict(Exception):
+    """Chave de idempotência reutilizada com outra requisição"""
+
+
+class IdempotencyInProgress(Exception):
+    """Outra requisição com a mesma chave ainda está em andamento"""
+
+
+def fingerprint(action: str, payload: dict) -> str:
+    """Identifica o conteúdo da requisição, para recusar a mesma chave com dados diferentes"""
+    body = json.dumps({"action": action, "payload": payload}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+
+def _max_delay(attempt: int) -> float:
+    return min(WRITE_RETRY_MAX_DELAY, WRITE_RETRY_BASE_DELAY * 2 ** (attempt - 1))
+
+
+def retry_delay(attempt: int) -> float:
+    """Backoff exponencial com jitter para a tentativa (1, 2, ...)"""
+    return _max_delay(attempt) * random.uniform(0.5, 1.0)
+
+
+def retry_budget() -> float:
+    """Pior caso (segundos) de uma escrita com retentativas: fila de admissão e invoke em cada tentativa, mais o backoff"""
+    per_attempt = write_admission.queue_timeout + WRITE_INVOKE_TIMEOUT
+    backoff = sum(_max_delay(attempt) for attempt in range(1, WRITE_RETRY_ATTEMPTS))
+    return WRITE_RETRY_ATTEMPTS * per_attempt + backoff
+
+
+# Depois deste tempo (segundos) uma chave "pending" é considerada abandonada (worker caiu) e pode ser retomada.
+# Nunca é menor que retry_budget() + PENDING_MARGIN: antes disso a escrita original ainda pode estar em andamento
+IDEMPOTENCY_PENDING_TIMEOUT = max(float(os.getenv("IDEMPOTENCY_PENDING_TIMEOUT", "0")), retry_budget() + PENDING_MARGIN)
+
+
+class IdempotencyStore:
+    """Tabela limitada chave -> (conteúdo da requisição, tx_id, resposta original).
+
+    Em SQLite (WAL), como o cache compartilhado: todos os workers do host
+    veem a mesma chave, então um reenvio que cai em outro worker recebe a
+    mesma resposta. Cada processo e cada thread abre a sua própria conexão
+    (uma transação BEGIN IMMEDIATE não pode ser compartilhada); as rotas
+    chamam os métodos via asyncio.to_thread, pois claim() pode esperar pelo
+    lock de outro worker.
+    """
+
+    def __init__(self, path: str, max_keys: int = IDEMPOTENCY_MAX_KEYS,
+                 pending_timeout: float = IDEMPOTENCY_PENDING_TIMEOUT):
+        self.path = path
+        self.max_keys = max_keys
+        self.pending_timeout = pending_timeout
+        self._local = threading.local()
+        self.claims = 0
+        self.replays = 0
+        self._inserts = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        local = self._local
+        if getattr(local, "conn", None) is None or local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS writes ("
+                " key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, cert_id TEXT NOT NULL,"
+                " status TEXT NOT NULL, tx_id TEXT, response TEXT, created REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS writes_created ON writes (created)")
+            local.conn = conn
+            local.pid = os.getpid()
+        return local.conn
+
+    def claim(self, key: str, request_fingerprint: str, cert_id: str) -> Optional[str]:
+        """Reserva a chave para esta requisição.
+
+        Retorna a resposta original se a escrita já foi concluída, ou None se
+        esta requisição deve executá-la.
+        """
+        conn = self._connection()
+        now = time.time()
+        replay = None
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT fingerprint, status, response, updated FROM writes WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                conn.execute(
+                    "INSERT INTO writes (key, fingerprint, cert_id, status, created, updated) VALUES (?, ?, ?, 'pending', ?, ?)",
+                    (key, request_fingerprint, cert_id, now, now)
+                )
+                self._inserts += 1
+            else:
+                stored_fingerprint, status, response, updated = row
+                if stored_fingerprint != request_fingerprint:
+                    raise IdempotencyConflict(f"Chave de idempotência {key} já usada com outra requisição")
+                if status == "committed":
+                    replay = response
+                elif now - updated < self.pending_timeout:
+                    raise IdempotencyInProgress(f"Requisição com a chave {key} ainda em andamento")
+                else:
+                    # o worker anterior caiu; o reenvio consulta a ledger antes de escrever de novo
+                    logger.warning("Resuming abandoned idempotency key", extra={"cert_id": cert_id, "key": key})
+                    conn.execute("UPDATE writes SET updated = ? WHERE key = ?", (now, key))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        if replay is not None:
+            self.replays += 1
+            return replay
+        self.claims += 1
+        if self._inserts and self._inserts % TRIM_EVERY == 0:
+            self.trim()
+        return None
+
+    def complete(self, key: str, tx_id: Optional[str], response: str):
+        """Guarda a resposta da escrita concluída, devolvida aos reenvios da mesma chave"""
+        self._connection().execute(
+            "UPDATE writes SET status = 'committed', tx_id = ?, response = ?, updated = ? WHERE key = ?",
+            (tx_id, response, time.time(), key)
+        )
+
+    def release(self, key: str):
+        """Libera a chave após uma falha, para que o cliente possa tentar de novo"""
+        self._connection().execute("DELETE FROM writes WHERE key = ? AND status = 'pending'", (key,))
+
+    def trim(self):
+        """Mantém só as IDEMPOTENCY_MAX_KEYS chaves mais recentes"""
+        self._connection().execute(
+            "DELETE FROM writes WHERE key IN (SELECT key FROM writes ORDER BY created DESC LIMIT -1 OFFSET ?)",
+            (self.max_keys,)
+        )
+
+    def metrics(self) -> dict:
+        """Reservas e respostas repetidas deste worker"""
+        return {"pid": os.getpid(), "path": self.path, "maxKeys": self.max_keys,
+                "claims": self.claims, "replays": self.replays}
+
+
+idempotency_store = IdempotencyStore(IDEMPOTENCY_DB_PATH)
@@ -0,0 +1,328 @@
+﻿import argparse
+import asyncio
+import functools
+import json
+import multiprocessing
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from . import certidao
+from .cert_hash import recompute_chunk
+from .logs import get_logger
+from .sharding import router
+
+logger = get_logger("integrity")
+
+INTEGRITY_SWEEP_DIR = os.getenv("INTEGRITY_SWEEP_DIR", "./backend/integrity")
+SWEEP_PAGE_SIZE = int(os.getenv("SWEEP_PAGE_SIZE", "1000"))
+SWEEP_WORKERS = int(os.getenv("SWEEP_WORKERS", str(os.cpu_count() or 2)))
+# Consultas VerifyCert simultâneas para confirmar suspeitos
+SUSPECT_CONCURRENCY = 16
+# Margem (segundos) antes do início da última varredura ao ler o índice de alterações:
+# timestamps de transação vêm do cliente e escritas em voo confirmam depois do início
+CHANGE_INDEX_SKEW = 300
+# Largura de cada hora do índice de alterações do chaincode (changed, AAAAMMDDHH, id, txId)
+CHANGE_BUCKET_SECONDS = 3600
+# Por quanto tempo (segundos) as horas já varridas ficam no índice de alterações; com elas somem os
+# resultados de idempotência do chaincode, então este é também o prazo para reenviar uma escrita
+CHANGE_INDEX_RETENTION = float(os.getenv("CHANGE_INDEX_RETENTION", str(7 * 24 * 3600)))
+# Entradas do índice removidas por transação PruneChanges
+PRUNE_BATCH = 500
+
+
+def change_buckets(since: float, until: float) -> list:
+    """Horas UTC (AAAAMMDDHH) do índice de alterações que cobrem o intervalo [since, until]"""
+    start = int(since // CHANGE_BUCKET_SECONDS) * CHANGE_BUCKET_SECONDS
+    return [time.strftime("%Y%m%d%H", time.gmtime(t)) for t in range(start, int(until) + 1, CHANGE_BUCKET_SECONDS)]
+
+
+def _fingerprint(record: dict) -> str:
+    """O que precisa mudar para um registro voltar a ser conferido numa varredura incremental"""
+    return f"{record.get('hash')}|{record.get('timestamp')}"
+
+
+class SweepCheckpoint:
+    """Progresso da varredura em SQLite: registros já conferidos e bookmark de cada canal.
+
+    swept guarda a impressão (hash + timestamp) dos registros íntegros; na
+    varredura incremental eles são pulados se nada mudou. progress guarda o
+    bookmark da última página concluída, para retomar uma varredura interrompida.
+    scans guarda o início da varredura em andamento e watermarks o início da
+    última concluída: a próxima incremental lê só o índice de alterações desde então.
+    """
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS swept ("
+            " shard TEXT NOT NULL, cert_id TEXT NOT NULL, fingerprint TEXT NOT NULL,"
+            " PRIMARY KEY (shard, cert_id))"
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS progress (shard TEXT PRIMARY KEY, bookmark TEXT NOT NULL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS scans (shard TEXT PRIMARY KEY, started REAL NOT NULL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS watermarks (shard TEXT PRIMARY KEY, started REAL NOT NULL)")
+
+    def known(self, shard: str, first_id: str, last_id: str) -> dict:
+        """Impressões conhecidas no intervalo de chaves de uma página (a varredura é ordenada por chave)"""
+        rows = self.conn.execute(
+            "SELECT cert_id, fingerprint FROM swept WHERE shard = ? AND cert_id BETWEEN ? AND ?",
+            (shard, first_id, last_id)
+        )
+        return dict(rows.fetchall())
+
+    def save_page(self, shard: str, ok: list, bad: list, bookmark: Optional[str]):
+        """Grava o resultado de uma página; bookmark None (páginas do índice de alterações) não mexe no progresso"""
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO swept (shard, cert_id, fingerprint) VALUES (?, ?, ?)",
+                [(shard, cert_id, fp) for cert_id, fp in ok]
+            )
+            self.conn.executemany("DELETE FROM swept WHERE shard = ? AND cert_id = ?", [(shard, cert_id) for cert_id in bad])
+            if bookmark is not None:
+                self.conn.execute("INSERT OR REPLACE INTO progress (shard, bookmark) VALUES (?, ?)", (shard, bookmark))
+
+    def resume_bookmark(self, shard: str) -> str:
+        row = self.conn.execute("SELECT bookmark FROM progress WHERE shard = ?", (shard,)).fetchone()
+        return row[0] if row else ""
+
+    def start_scan(self, shard: str, started: float, restart: bool) -> float:
+        """Início da varredura completa; ao retomar uma interrompida vale o início original"""
+        verb = "REPLACE" if restart else "IGNORE"
+        self.conn.execute(f"INSERT OR {verb} INTO scans (shard, started) VALUES (?, ?)", (shard, started))
+        return self.conn.execute("SELECT started FROM scans WHERE shard = ?", (shard,)).fetchone()[0]
+
+    def last_sweep(self, shard: str) -> Optional[float]:
+        """Início da última varredura concluída (None se nunca houve uma completa)"""
+        row = self.conn.execute("SELECT started FROM watermarks WHERE shard = ?", (shard,)).fetchone()
+        return row[0] if row else None
+
+    def finish(self, shard: str, started: float):
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.execute("DELETE FROM progress WHERE shard = ?", (shard,))
+            self.conn.execute("DELETE FROM scans WHERE shard = ?", (shard,))
+            self.conn.execute("INSERT OR REPLACE INTO watermarks (shard, started) VALUES (?, ?)", (shard, started))
+
+
+class IntegritySweeper:
+    """Varre as certidões de cada shard e acha registros com hash divergente.
+
+    Na varredura completa (a primeira, --full ou quando o chaincode não tem o
+    índice) as páginas vêm do ListCerts (range scan paginado). A incremental
+    lê só ListChangedCerts das horas desde a última varredura: o custo é
+    proporcional às alterações, não ao total de registros. Enquanto a próxima
+    página é buscada, a atual tem o hash canônico recalculado em processos
+    separados. Só os suspeitos são conferidos no chaincode (VerifyCert).
+    """
+
+    def __init__(self, pool: ProcessPoolExecutor, checkpoint: SweepCheckpoint, workers: int, page_size: int, full: bool):
+        self.pool = pool
+        self.checkpoint = checkpoint
+        self.workers = workers
+        self.page_size = page_size
+        self.full = full
+        self._verify_slots = asyncio.Semaphore(SUSPECT_CONCURRENCY)
+
+    async def _fetch(self, shard: str, bookmark: str) -> dict:
+        return json.loads(await certidao.list_certs(bookmark, self.page_size, shard=shard))
+
+    async def _fetch_changed(self, shard: str, bucket: str, bookmark: str) -> dict:
+        return json.loads(await certidao.list_changed_certs(bucket, bookmark, self.page_size, shard=shard))
+
+    async def _recompute(self, records: list) -> list:
+        """Divide a página entre os processos e junta os divergentes"""
+        loop = asyncio.get_running_loop()
+        size = max(1, -(-len(records) // self.workers))
+        chunks = [records[i:i + size] for i in range(0, len(records), size)]
+        results = await asyncio.gather(*[loop.run_in_executor(self.pool, recompute_chunk, chunk) for chunk in chunks])
+        return [suspect for result in results for suspect in result]
+
+    async def _confirm(self, shard: str, cert_id: str, stored: str, expected: str) -> dict:
+        """Consulta o VerifyCert (em outro peer, pelo rodízio) para confirmar o suspeito.
+
+        Registros off-ledger (expected None) só podem ser conferidos pelo
+        chaincode; se o hashMatch vier true retorna None (não é divergência).
+        """
+        mismatch = {"id": cert_id, "shard": shard, "storedHash": stored, "expectedHash": expected}
+        async with self._verify_slots:
+            try:
+                verify = json.loads(await certidao.verify_cert(cert_id, shard=shard))
+            except Exception as e:
+                return dict(mismatch, confirmed=None, error=str(e))
+        if expected is None and verify.get("hashMatch"):
+            return None
+        # hashMatch true aqui significa que o peer da varredura e o da verificação divergem
+        return dict(mismatch, confirmed=not verify.get("hashMatch", False), verifiedHash=verify.get("record", {}).get("hash"))
+
+    async def _pages(self, fetch, bookmark: str, stats: dict):
+        """Páginas em sequência; a próxima é buscada em paralelo com o processamento da atual"""
+        next_page = asyncio.ensure_future(fetch(bookmark))
+        while next_page is not None:
+            wait_started = time.perf_counter()
+            page = await next_page
+            stats["scanSeconds"] += time.perf_counter() - wait_started
+            records = page.get("records") or []
+            bookmark = page.get("bookmark", "")
+            # count são as chaves lidas; no índice de alterações pode ser maior que len(records)
+            more = bookmark and page.get("count", len(records)) >= self.page_size
+            next_page = asyncio.ensure_future(fetch(bookmark)) if more else None
+            stats["pages"] += 1
+            yield records, bookmark
+
+    async def _check_page(self, shard: str, records: list, bookmark: Optional[str], stats: dict, mismatches: list):
+        """Recalcula os registros novos/alterados da página, confirma os suspeitos e grava o checkpoint"""
+        stats["scanned"] += len(records)
+        if not records:
+            return
+
+        ids = sorted(r.get("id", "") for r in records)
+        known = {} if self.full else self.checkpoint.known(shard, ids[0], ids[-1])
+        pending = [r for r in records if known.get(r.get("id")) != _fingerprint(r)]
+        stats["skipped"] += len(records) - len(pending)
+        stats["recomputed"] += len(pending)
+
+        hash_started = time.perf_counter()
+        suspects = await self._recompute(pending)
+        stats["hashSeconds"] += time.perf_counter() - hash_started
+        off_ledger = sum(1 for cert_id, _, expected in suspects if cert_id is not None and expected is None)
+        stats["offLedger"] += off_ledger
+        stats["suspects"] += len(suspects) - off_ledger
+
+        verify_started = time.perf_counter()
+        confirmed = [m for m in await asyncio.gather(*[
+            self._confirm(shard, cert_id, stored, expected)
+            for cert_id, stored, expected in suspects if cert_id is not None
+        ]) if m is not None]
+        stats["verifySeconds"] += time.perf_counter() - verify_started
+        undecodable = sum(1 for cert_id, _, _ in suspects if cert_id is None)
+        if undecodable:
+            mismatches.append({"id": None, "shard": shard, "error": f"{undecodable} registro(s) ilegível(is)"})
+        mismatches.extend(confirmed)
+
+        bad = {m["id"] for m in confirmed}
+        ok = [(r["id"], _fingerprint(r)) for r in pending if r.get("id") and r["id"] not in bad]
+        self.checkpoint.save_page(shard, ok, sorted(bad), bookmark)
+
+    async def _sweep_changes(self, shard: str, since: float, until: float, stats: dict, mismatches: list):
+        """Confere só os registros do índice de alterações entre since (menos a margem) e until"""
+        for bucket in change_buckets(since - CHANGE_INDEX_SKEW, until):
+            fetch = functools.partial(self._fetch_changed, shard, bucket)
+            async for records, _ in self._pages(fetch, "", stats):
+                await self._check_page(shard, records, None, stats, mismatches)
+
+    async def _prune(self, shard: str, watermark: float) -> int:
+        """Remove do índice as horas que a próxima varredura incremental não relê e que passaram da retenção"""
+        cutoff = min(watermark - CHANGE_INDEX_SKEW, time.time() - CHANGE_INDEX_RETENTION)
+        before = change_buckets(cutoff, cutoff)[0]
+        pruned = 0
+        try:
+            while True:
+                result = json.loads(await certidao.prune_changes(before, PRUNE_BATCH, shard=shard))
+                pruned += result.get("pruned", 0)
+                if not result.get("more"):
+                    break
+        except Exception as e:
+            # chaincode sem PruneChanges ou peer indisponível: tenta de novo na próxima varredura
+            logger.warning("Change index pruning failed", extra={"channel": shard, "before": before, "error": str(e)})
+        return pruned
+
+    async def sweep_shard(self, shard: str) -> dict:
+        stats = {"mode": "full", "scanned": 0, "skipped": 0, "recomputed": 0, "suspects": 0, "offLedger": 0,
+                 "pages": 0, "scanSeconds": 0.0, "hashSeconds": 0.0, "verifySeconds": 0.0}
+        mismatches = []
+        started = time.perf_counter()
+        run_started = time.time()
+
+        since = None if self.full or self.checkpoint.resume_bookmark(shard) else self.checkpoint.last_sweep(shard)
+        if since is not None:
+            try:
+                await self._sweep_changes(shard, since, run_started, stats, mismatches)
+                stats["mode"] = "changes"
+            except Exception as e:
+                error = certidao.proposal_error(e)
+                if not isinstance(error, certidao.ChaincodeError) or "ListChangedCerts" not in str(error):
+                    raise
+                # chaincode sem o índice de alterações: varredura completa como antes
+                logger.warning("ListChangedCerts unavailable, running a full scan", extra={"channel": shard, "error": str(error)})
+
+        if stats["mode"] == "full":
+            run_started = self.checkpoint.start_scan(shard, run_started, restart=self.full)
+            bookmark = "" if self.full else self.checkpoint.resume_bookmark(shard)
+            async for records, bookmark in self._pages(functools.partial(self._fetch, shard), bookmark, stats):
+                await self._check_page(shard, records, bookmark, stats, mismatches)
+
+        self.checkpoint.finish(shard, run_started)
+        stats["pruned"] = await self._prune(shard, run_started)
+        stats["seconds"] = time.perf_counter() - started
+        return {"stats": stats, "mismatches": mismatches}
+
+
+async def run_sweep(workers: int = SWEEP_WORKERS, page_size: int = SWEEP_PAGE_SIZE, full: bool = False) -> dict:
+    """Executa uma varredura em todos os shards (em paralelo) e grava o relatório JSON"""
+    os.makedirs(os.path.join(INTEGRITY_SWEEP_DIR, "reports"), exist_ok=True)
+    checkpoint = SweepCheckpoint(os.path.join(INTEGRITY_SWEEP_DIR, "checkpoint.sqlite3"))
+    started_at = time.time()
+    started = time.perf_counter()
+
+    # spawn: os processos de hash não herdam os canais gRPC do processo principal
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        sweeper = IntegritySweeper(pool, checkpoint, workers, page_size, full)
+        results = await asyncio.gather(*[sweeper.sweep_shard(ch) for ch in router.channels])
+
+    shards = {ch: result["stats"] for ch, result in zip(router.channels, results)}
+    total = time.perf_counter() - started
+    scanned = sum(s["scanned"] for s in shards.values())
+    report = {
+        "mode": "full" if full else "incremental",
+        "startedAt": started_at,
+        "finishedAt": time.time(),
+        "workers": workers,
+        "pageSize": page_size,
+        "shards": shards,
+        "mismatches": [m for result in results for m in result["mismatches"]],
+        "timing": {
+            "totalSeconds": total,
+            "recordsPerSecond": scanned / total if total else 0.0,
+        },
+    }
+    report_path = os.path.join(INTEGRITY_SWEEP_DIR, "reports", f"sweep-{int(started_at)}.json")
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    logger.info("Integrity sweep finished", extra={
+        "mode": report["mode"],
+        "scanned": scanned,
+        "recomputed": sum(s["recomputed"] for s in shards.values()),
+        "confirmed_mismatches": sum(1 for m in report["mismatches"] if m.get("confirmed")),
+        "seconds": round(total, 3),
+        "records_per_second": round(report["timing"]["recordsPerSecond"]),
+        "report": report_path,
+    })
+    return report
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Varredura de integridade (hashMatch) de todas as certidões")
+    parser.add_argument("--full", action="store_true", help="Confere todos os registros, ignorando o checkpoint")
+    parser.add_argument("--workers", type=int, default=SWEEP_WORKERS, help="Processos para recalcular hashes")
+    parser.add_argument("--page-size", type=int, default=SWEEP_PAGE_SIZE, help="Registros por página do ListCerts")
+    parser.add_argument("--interval", type=float, default=0, help="Repete a cada N segundos (0 = executa uma vez)")
+    return parser.parse_args()
+
+
+async def main():
+    args = parse_args()
+    while True:
+        await run_sweep(args.workers, args.page_size, args.full)
+        if args.interval <= 0:
+            break
+        await asyncio.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
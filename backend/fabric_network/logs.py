@@ -0,0 +1,154 @@
+﻿import asyncio
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Fração das mensagens de sucesso (marcadas com sample=True) que são registradas
+LOG_SUCCESS_SAMPLE_RATE = float(os.getenv("LOG_SUCCESS_SAMPLE_RATE", "0.05"))
+# Intervalo de medição do atraso do event loop (segundos)
+LOOP_LAG_INTERVAL = 0.1
+
+# Id de correlação da requisição atual (definido pelo middleware HTTP)
+request_id_var = contextvars.ContextVar("request_id", default=None)
+
+# Atributos padrão de LogRecord; o resto (passado em extra=) vira campo do JSON
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "sample"}
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"certidao.{name}")
+
+
+class JsonFormatter(logging.Formatter):
+    """Uma linha JSON por registro: ts, level, logger, msg, request_id e campos extras"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "pid": record.process,
+        }
+        entry.update({k: v for k, v in vars(record).items() if k not in _RESERVED})
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ContextFilter(logging.Filter):
+    """Anexa o request_id e descarta parte das mensagens de sucesso (sample=True)"""
+
+    def __init__(self, sample_rate: float):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "sample", False) and record.levelno < logging.WARNING:
+            if random.random() >= self.sample_rate:
+                return False
+        record.request_id = request_id_var.get()
+        return True
+
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    """Enfileira o registro e volta; a escrita no stdout acontece numa thread à parte.
+
+    A thread (QueueListener) não sobrevive a um fork, então é recriada no
+    primeiro log de cada processo.
+    """
+
+    def __init__(self, target: logging.Handler):
+        super().__init__(queue.SimpleQueue())
+        self.target = target
+        self._listener = None
+        self._listener_pid = None
+
+    def _ensure_listener(self):
+        if self._listener_pid != os.getpid():
+            self.queue = queue.SimpleQueue()
+            self._listener = logging.handlers.QueueListener(self.queue, self.target)
+            self._listener.start()
+            self._listener_pid = os.getpid()
+
+    def enqueue(self, record: logging.LogRecord):
+        self._ensure_listener()
+        super().enqueue(record)
+
+    def stop(self):
+        """Esvazia a fila (chamado na saída do processo)"""
+        if self._listener is not None and self._listener_pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+            self._listener_pid = None
+
+
+_handler = None
+
+
+def configure_logging(level: str = LOG_LEVEL, sample_rate: float = LOG_SUCCESS_SAMPLE_RATE):
+    """Configura os loggers 'certidao.*' com saída JSON não bloqueante (idempotente)"""
+    global _handler
+    if _handler is not None:
+        return
+    target = logging.StreamHandler(sys.stdout)
+    target.setFormatter(JsonFormatter())
+    _handler = AsyncQueueHandler(target)
+    _handler.addFilter(ContextFilter(sample_rate))
+
+    root = logging.getLogger("certidao")
+    root.setLevel(level)
+    root.addHandler(_handler)
+    root.propagate = False
+    atexit.register(_handler.stop)
+
+
+class LoopLagMonitor:
+    """Mede quanto o event loop atrasa para acordar (bloqueios por I/O síncrono, CPU etc.)"""
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - expected)
+            self.samples += 1
+            self.total_lag += lag
+            self.max_lag = max(self.max_lag, lag)
+
+    def metrics(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "samples": self.samples,
+            "avgLagMs": 1000 * self.total_lag / self.samples if self.samples else 0.0,
+            "maxLagMs": 1000 * self.max_lag,
+        }
+
+
+loop_lag = LoopLagMonitor()
+
+
+# Configurado na importação: os módulos já registram logs ao serem importados (perfil, anel de shards)
+configure_logging()
@@ -1,32 +1,30 @@
-﻿import os
+﻿import asyncio
+import functools
+import itertools
+import os
 import grpc
 from aiogrpc import secure_channel
 from hfc.fabric import Client
-from hfc.fabric.user import create_user
 from hfc.fabric.peer import Peer
 from hfc.fabric.orderer import Orderer
 from hfc.util.keyvaluestore import FileKeyValueStore
 from hfc.protos.peer import peer_pb2_grpc, events_pb2_grpc
 from hfc.protos.discovery import protocol_pb2_grpc
 from hfc.protos.orderer import ab_pb2_grpc
+from .connection_profile import (DEFAULT_PROFILE_PATH, EndorsementSelector, endpoint_from_url,
+                      load_profile, ssl_target_name, tls_ca_path)
+from .credentials import CredentialManager
+from .orderer_pool import OrdererPool
+from .logs import get_logger
+
+logger = get_logger("network")
 
 # Configurações de ambiente para gRPC
 os.environ["GRPC_ENABLE_FORK_SUPPORT"] = "1"
 os.environ["GRPC_POLL_STRATEGY"] = "poll"
 
-# Caminhos dos certificados (dentro do container)
-ORG1_ADMIN_CERT = "/opt/organizations/peerOrganizations/org1.example.com/users/Admin@org1.example.com/msp/signcerts/Admin@org1.example.com-cert.pem"
-ORG1_ADMIN_KEY = "/opt/organizations/peerOrganizations/org1.example.com/users/Admin@org1.example.com/msp/keystore/priv_sk"
-
-# Caminhos dos certificados TLS
-PEER0_ORG1_TLS_CA = "/opt/organizations/peerOrganizations/org1.example.com/peers/peer0.org1.example.com/tls/ca.crt"
-PEER0_ORG2_TLS_CA = "/opt/organizations/peerOrganizations/org2.example.com/peers/peer0.org2.example.com/tls/ca.crt"
-ORDERER_TLS_CA = "/opt/organizations/ordererOrganizations/example.com/orderers/orderer.example.com/tls/ca.crt"
-
-# Endpoints (usando hostnames Docker)
-PEER0_ORG1_ENDPOINT = "peer0.org1.example.com:7051"
-PEER0_ORG2_ENDPOINT = "peer0.org2.example.com:9051"
-ORDERER_ENDPOINT = "orderer.example.com:7050"
+# Perfil de conexão (YAML/JSON) com peers, orgs, orderers e canais
+CONNECTION_PROFILE = os.getenv("FABRIC_CONNECTION_PROFILE", DEFAULT_PROFILE_PATH)
 
 # Caminho do armazenamento local das identidades
 STATE_STORE_PATH = "./backend/kvs"
@@ -35,31 +33,24 @@ STATE_STORE_PATH = "./backend/kvs"
 if not os.path.exists(STATE_STORE_PATH):
     os.makedirs(STATE_STORE_PATH)
 
-print("[INFO] Initializing Fabric Client...")
-
-# Inicializa o cliente SEM network profile
-fabric_client = Client()
-state_store = FileKeyValueStore(STATE_STORE_PATH)
+profile = load_profile(CONNECTION_PROFILE)
 
-print("[INFO] Creating admin user...")
+# Canal padrão usado pela API
+channel_name = profile.get("client", {}).get("defaultChannel", next(iter(profile["channels"])))
 
-# Cria o usuário admin manualmente
-admin = create_user(
-    name="Admin",
-    org="org1.example.com",
-    state_store=state_store,
-    msp_id="Org1MSP",
-    key_path=ORG1_ADMIN_KEY,
-    cert_path=ORG1_ADMIN_CERT
-)
+# Organização do cliente e sua identidade de administrador
+client_org_name = profile.get("client", {}).get("organization", next(iter(profile["organizations"])))
+client_org = profile["organizations"][client_org_name]
+admin_user = client_org["users"]["Admin"]
 
-def create_peer_with_tls(name, endpoint, tls_ca_path, ssl_target_name):
+def create_peer_with_tls(name, endpoint, tls_ca_path, ssl_target_name, tls_ca_cert=None):
     """Cria um peer com canal gRPC TLS configurado manualmente"""
-    print(f"[INFO] Creating peer {name} at {endpoint}...")
+    logger.debug("Creating peer", extra={"peer": name, "endpoint": endpoint})
     
-    # Lê o certificado TLS CA
-    with open(tls_ca_path, 'rb') as f:
-        tls_ca_cert = f.read()
+    # Lê o certificado TLS CA (se não vier já em cache)
+    if tls_ca_cert is None:
+        with open(tls_ca_path, 'rb') as f:
+            tls_ca_cert = f.read()
     
     # Opções gRPC
     grpc_opts = [
@@ -90,16 +81,17 @@ def create_peer_with_tls(name, endpoint, tls_ca_path, ssl_target_name):
     peer._discovery_client = protocol_pb2_grpc.DiscoveryStub(channel)
     peer._event_client = events_pb2_grpc.DeliverStub(channel)
     
-    print(f"[INFO] Peer {name} created successfully (endpoint: {endpoint})")
+    logger.info("Peer created", extra={"peer": name, "endpoint": endpoint})
     return peer
 
-def create_orderer_with_tls(name, endpoint, tls_ca_path, ssl_target_name):
+def create_orderer_with_tls(name, endpoint, tls_ca_path, ssl_target_name, tls_ca_cert=None):
     """Cria um orderer com canal gRPC TLS configurado manualmente"""
-    print(f"[INFO] Creating orderer {name} at {endpoint}...")
+    logger.debug("Creating orderer", extra={"orderer": name, "endpoint": endpoint})
     
-    # Lê o certificado TLS CA
-    with open(tls_ca_path, 'rb') as f:
-        tls_ca_cert = f.read()
+    # Lê o certificado TLS CA (se não vier já em cache)
+    if tls_ca_cert is None:
+        with open(tls_ca_path, 'rb') as f:
+            tls_ca_cert = f.read()
     
     # Opções gRPC
     grpc_opts = [
@@ -128,60 +120,158 @@ def create_orderer_with_tls(name, endpoint, tls_ca_path, ssl_target_name):
     # Cria o stub gRPC
     orderer._orderer_client = ab_pb2_grpc.AtomicBroadcastStub(channel)
     
-    print(f"[INFO] Orderer {name} created successfully (endpoint: {endpoint})")
+    logger.info("Orderer created", extra={"orderer": name, "endpoint": endpoint})
     return orderer
 
-# Nome do canal
-channel_name = "certchannel"
-
-print(f"[INFO] Creating channel '{channel_name}'...")
-
-# Cria o canal
-channel = fabric_client.new_channel(channel_name)
-
-# Cria os peers manualmente
-print("[INFO] Creating peers with TLS...")
-peer0_org1 = create_peer_with_tls(
-    name="peer0.org1.example.com",
-    endpoint=PEER0_ORG1_ENDPOINT,
-    tls_ca_path=PEER0_ORG1_TLS_CA,
-    ssl_target_name="peer0.org1.example.com"
-)
-
-peer0_org2 = create_peer_with_tls(
-    name="peer0.org2.example.com",
-    endpoint=PEER0_ORG2_ENDPOINT,
-    tls_ca_path=PEER0_ORG2_TLS_CA,
-    ssl_target_name="peer0.org2.example.com"
-)
-
-# Cria o orderer manualmente
-print("[INFO] Creating orderer with TLS...")
-orderer = create_orderer_with_tls(
-    name="orderer.example.com",
-    endpoint=ORDERER_ENDPOINT,
-    tls_ca_path=ORDERER_TLS_CA,
-    ssl_target_name="orderer.example.com"
-)
-
-# Adiciona ao canal
-channel.add_peer(peer0_org1)
-channel.add_peer(peer0_org2)
-channel.add_orderer(orderer)
-
-# Adiciona peers ao client para lookup por nome
-fabric_client._peers = {
-    'peer0.org1.example.com': peer0_org1,
-    'peer0.org2.example.com': peer0_org2
-}
-fabric_client._orderers = {
-    'orderer.example.com': orderer
-}
-fabric_client._channels = {
-    channel_name: channel
-}
-
-print("[INFO] Fabric network initialized successfully!")
-print(f"[DEBUG] Channel: {channel}")
-print(f"[DEBUG] Peers: {list(channel._peers.keys())}")
-print(f"[DEBUG] Orderers: {list(channel._orderers.keys())}")
\ No newline at end of file
+def _reconnect(node, tls_ca_cert):
+    """Novo canal gRPC com o CA TLS atualizado e as mesmas opções; retorna o canal antigo"""
+    creds = grpc.ssl_channel_credentials(root_certificates=tls_ca_cert)
+    old_channel = node._channel
+    node._channel = secure_channel(node._endpoint, creds, options=list(node._grpc_options.items()))
+    return old_channel
+
+def reconnect_peer(peer, tls_ca_cert):
+    """Troca o canal e os stubs do peer; chamadas em andamento terminam no canal antigo"""
+    old_channel = _reconnect(peer, tls_ca_cert)
+    peer._endorser_client = peer_pb2_grpc.EndorserStub(peer._channel)
+    peer._discovery_client = protocol_pb2_grpc.DiscoveryStub(peer._channel)
+    peer._event_client = events_pb2_grpc.DeliverStub(peer._channel)
+    logger.info("Peer reconnected with new TLS CA", extra={"peer": peer._name})
+    return old_channel
+
+def reconnect_orderer(orderer, tls_ca_cert):
+    """Troca o canal e o stub do orderer; broadcasts em andamento terminam no canal antigo"""
+    old_channel = _reconnect(orderer, tls_ca_cert)
+    orderer._orderer_client = ab_pb2_grpc.AtomicBroadcastStub(orderer._channel)
+    logger.info("Orderer reconnected with new TLS CA", extra={"orderer": orderer._name})
+    return old_channel
+
+class FabricNetwork:
+    """Cliente Fabric, identidade admin, peers, orderers e canais de um processo.
+
+    Os canais gRPC não sobrevivem a um fork, então cada worker do uvicorn
+    constrói a sua instância na primeira requisição (ver get_network).
+    """
+
+    def __init__(self, profile: dict):
+        logger.info("Initializing Fabric client")
+
+        # Inicializa o cliente SEM network profile (os nós são criados manualmente abaixo)
+        self.fabric_client = Client()
+        state_store = FileKeyValueStore(STATE_STORE_PATH)
+
+        # Identidades de assinatura (Admin + uma por cartório) e CAs TLS, com recarga a quente
+        self.credentials = CredentialManager(
+            state_store,
+            org_name=client_org.get("domain", client_org_name),
+            msp_id=client_org["mspid"],
+            users=client_org["users"],
+            identities=profile.get("client", {}).get("identities")
+        )
+
+        # Cria peers e orderers descritos no perfil
+        self.peers = {}
+        for name, node in profile["peers"].items():
+            ca_path = tls_ca_path(node)
+            self.peers[name] = create_peer_with_tls(
+                name=name,
+                endpoint=endpoint_from_url(node["url"]),
+                tls_ca_path=ca_path,
+                ssl_target_name=ssl_target_name(node, name),
+                tls_ca_cert=self.credentials.tls_ca(ca_path)
+            )
+            self.credentials.on_tls_change(ca_path, functools.partial(reconnect_peer, self.peers[name]))
+
+        self.orderers = {}
+        for name, node in profile["orderers"].items():
+            ca_path = tls_ca_path(node)
+            self.orderers[name] = create_orderer_with_tls(
+                name=name,
+                endpoint=endpoint_from_url(node["url"]),
+                tls_ca_path=ca_path,
+                ssl_target_name=ssl_target_name(node, name),
+                tls_ca_cert=self.credentials.tls_ca(ca_path)
+            )
+            self.credentials.on_tls_change(ca_path, functools.partial(reconnect_orderer, self.orderers[name]))
+
+        # MSP ID de cada peer, a partir das organizações do perfil
+        peer_msp = {
+            peer_name: org["mspid"]
+            for org in profile["organizations"].values()
+            for peer_name in org.get("peers", [])
+        }
+
+        # Adiciona peers ao client para lookup por nome
+        self.fabric_client._peers.update(self.peers)
+
+        # O SDK envia cada transação a um orderer de client.orderers; registrando só o
+        # pool, todo broadcast passa pelo failover/fanout entre os orderers do perfil
+        self.orderer_pool = OrdererPool.from_env(list(self.orderers.values()))
+        self.fabric_client._orderers[self.orderer_pool._name] = self.orderer_pool
+
+        # Cria os canais, com seletor de endossantes e peers de consulta por canal
+        self.endorsers = {}
+        self.query_peers = {}
+        for ch_name, ch_cfg in profile["channels"].items():
+            logger.debug("Creating channel", extra={"channel": ch_name})
+            ch = self.fabric_client.new_channel(ch_name)
+
+            org_peers = {}
+            ch_query_peers = []
+            for peer_name, roles in (ch_cfg.get("peers") or {}).items():
+                roles = roles or {}
+                ch.add_peer(self.peers[peer_name])
+                if roles.get("endorsingPeer", True):
+                    org_peers.setdefault(peer_msp[peer_name], []).append(self.peers[peer_name])
+                if roles.get("chaincodeQuery", True):
+                    ch_query_peers.append(self.peers[peer_name])
+            for orderer_name in ch_cfg.get("orderers", self.orderers):
+                ch.add_orderer(self.orderers[orderer_name])
+
+            self.endorsers[ch_name] = EndorsementSelector(org_peers, ch_cfg.get("endorsementPolicy"))
+            self.query_peers[ch_name] = itertools.cycle(
+                ch_query_peers or list(itertools.chain(*org_peers.values()))
+            )
+
+        self.channel = self.fabric_client.get_channel(channel_name)
+
+        logger.info("Fabric network initialized", extra={
+            "channels": list(self.endorsers),
+            "peers": list(self.peers),
+            "orderers": list(self.orderers),
+        })
+
+    @property
+    def admin(self):
+        """Identidade Admin atual (trocada pelo CredentialManager quando o arquivo muda)"""
+        return self.credentials.user()
+
+    def identity_for(self, cartorio: str = None):
+        """Identidade que assina transações do cartório"""
+        return self.credentials.user_for(cartorio)
+
+    def select_endorsers(self, ch_name: str) -> list:
+        """Peers que devem endossar um invoke no canal, segundo a política do perfil"""
+        return self.endorsers[ch_name].select()
+
+    def select_query_peer(self, ch_name: str):
+        """Próximo peer de consulta do canal (rodízio entre os peers com chaincodeQuery)"""
+        return next(self.query_peers[ch_name])
+
+
+_network = None
+_network_pid = None
+
+
+def get_network() -> FabricNetwork:
+    """Rede Fabric do processo atual, criada sob demanda (inclusive após fork)"""
+    global _network, _network_pid
+    if _network is None or _network_pid != os.getpid():
+        _network = FabricNetwork(profile)
+        _network_pid = os.getpid()
+        try:
+            asyncio.get_running_loop()
+            _network.credentials.start()
+        except RuntimeError:
+            pass  # fora de um event loop (scripts síncronos) não há recarga automática
+    return _network
@@ -0,0 +1,163 @@
+﻿import asyncio
+import os
+import time
+
+from .logs import get_logger
+
+logger = get_logger("orderers")
+
+# Status de BroadcastResponse que indicam erro do próprio envelope (não adianta trocar de orderer)
+NON_RETRYABLE_STATUS = {400, 403, 404, 413}
+
+# Peso da amostra mais recente na média móvel de latência
+LATENCY_EWMA_ALPHA = 0.3
+
+
+class OrdererState:
+    """Saúde e latência observadas de um orderer"""
+
+    def __init__(self, orderer):
+        self.orderer = orderer
+        self.name = orderer._name
+        self.latency_ewma = None
+        self.consecutive_failures = 0
+        self.last_failure = 0.0
+        self.last_error = None
+        self.successes = 0
+        self.failures = 0
+
+    def record_success(self, latency: float):
+        self.successes += 1
+        self.consecutive_failures = 0
+        if self.latency_ewma is None:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma = LATENCY_EWMA_ALPHA * latency + (1 - LATENCY_EWMA_ALPHA) * self.latency_ewma
+
+    def record_failure(self, error: str):
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.last_failure = time.monotonic()
+        self.last_error = error
+
+    def metrics(self) -> dict:
+        return {
+            "latency_ewma": self.latency_ewma,
+            "successes": self.successes,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+        }
+
+
+class OrdererPool:
+    """Conjunto de orderers com failover e broadcast opcional em paralelo.
+
+    Registrado no lugar dos orderers em fabric_client._orderers: o SDK escolhe
+    um orderer e chama broadcast(envelope), então o pool recebe o envelope e
+    decide para quem enviar. Orderers que falharam recentemente ficam em
+    quarentena por 'cooldown' segundos e vão para o fim da fila.
+    Com fanout > 1 o envelope é enviado a vários orderers ao mesmo tempo e o
+    primeiro sucesso é devolvido (reenvios do mesmo tx são descartados pelos peers).
+    """
+
+    def __init__(self, orderers: list, fanout: int = 1, timeout: float = 10.0, cooldown: float = 5.0):
+        self._name = "orderer-pool"
+        self.states = [OrdererState(o) for o in orderers]
+        self.fanout = max(1, min(fanout, len(self.states)))
+        self.timeout = timeout
+        self.cooldown = cooldown
+        self.failovers = 0
+        self._background = set()
+
+    @classmethod
+    def from_env(cls, orderers: list) -> "OrdererPool":
+        """Cria o pool lendo ORDERER_BROADCAST_FANOUT/ORDERER_TIMEOUT/ORDERER_COOLDOWN"""
+        return cls(
+            orderers,
+            fanout=int(os.getenv("ORDERER_BROADCAST_FANOUT", "1")),
+            timeout=float(os.getenv("ORDERER_TIMEOUT", "10")),
+            cooldown=float(os.getenv("ORDERER_COOLDOWN", "5")),
+        )
+
+    def ranked(self) -> list:
+        """Orderers saudáveis primeiro (menor latência), depois os em quarentena"""
+        now = time.monotonic()
+
+        def key(state):
+            quarantined = state.consecutive_failures > 0 and now - state.last_failure < self.cooldown
+            latency = state.latency_ewma if state.latency_ewma is not None else 0.0
+            return (quarantined, state.consecutive_failures, latency)
+
+        return sorted(self.states, key=key)
+
+    async def _send(self, state: OrdererState, envelope) -> list:
+        """Envia o envelope a um orderer e registra latência ou falha"""
+        start = time.monotonic()
+        try:
+            responses = await asyncio.wait_for(
+                self._collect(state.orderer.broadcast(envelope)), timeout=self.timeout
+            )
+        except asyncio.TimeoutError:
+            state.record_failure("timeout")
+            raise
+        except Exception as e:
+            state.record_failure(str(e))
+            raise
+
+        failed = [r for r in responses if r.status != 200]
+        if failed and failed[0].status not in NON_RETRYABLE_STATUS:
+            state.record_failure(f"status {failed[0].status}: {failed[0].info}")
+            raise RuntimeError(f"orderer {state.name} respondeu {failed[0].status}: {failed[0].info}")
+
+        state.record_success(time.monotonic() - start)
+        return responses
+
+    @staticmethod
+    async def _collect(stream) -> list:
+        return [response async for response in stream]
+
+    def broadcast(self, envelope):
+        """Mesma interface de Orderer.broadcast: devolve um stream de BroadcastResponse"""
+        return self._broadcast(envelope)
+
+    async def _broadcast(self, envelope):
+        candidates = self.ranked()
+        last_error = None
+
+        while candidates:
+            batch, candidates = candidates[:self.fanout], candidates[self.fanout:]
+            tasks = [asyncio.ensure_future(self._send(state, envelope)) for state in batch]
+            pending = set(tasks)
+
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        # Os demais envios seguem em segundo plano só para atualizar as métricas
+                        for other in pending:
+                            self._background.add(other)
+                            other.add_done_callback(self._discard_background)
+                        for response in task.result():
+                            yield response
+                        return
+                    last_error = task.exception()
+
+            if candidates:
+                self.failovers += 1
+                logger.warning("Orderer broadcast failed, failing over", extra={"error": str(last_error)})
+
+        raise RuntimeError(f"Nenhum orderer aceitou a transação: {last_error}")
+
+    def _discard_background(self, task):
+        self._background.discard(task)
+        if not task.cancelled():
+            task.exception()  # evita aviso de exceção não consumida
+
+    def metrics(self) -> dict:
+        """Contagem de failovers e saúde/latência de cada orderer"""
+        return {
+            "fanout": self.fanout,
+            "failovers": self.failovers,
+            "orderers": {state.name: state.metrics() for state in self.states},
+        }
@@ -0,0 +1,221 @@
+﻿import base64
+import hashlib
+import json
+import os
+import re
+import time
+import zlib
+from typing import Optional
+
+from cryptography import x509
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from .credentials import WatchedFile
+from .network import admin_user, client_org, get_network
+
+# v2: endossos só com o MSP (v1 trazia também a assinatura, que não era conferida)
+RECEIPT_VERSION = 2
+# Prefixo do payload em QR code (permite mudar o formato no futuro)
+QR_PREFIX = "CR1."
+# Certificados de todos os emissores já usados (<kid>.pem), para conferir recibos após reinício/rotação em qualquer worker
+RECEIPT_KEYS_DIR = os.getenv("RECEIPT_KEYS_DIR", "./backend/receipt-keys")
+_KID = re.compile(r"[0-9a-f]{16}")
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip("=")
+
+
+def _unb64(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def canonical(receipt: dict) -> bytes:
+    """Bytes assinados: JSON compacto, chaves ordenadas, sem o campo 'sig'"""
+    body = {k: v for k, v in receipt.items() if k != "sig"}
+    return json.dumps(body, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode('utf-8')
+
+
+def _kid(cert) -> str:
+    return hashlib.sha256(cert.public_bytes(serialization.Encoding.DER)).hexdigest()[:16]
+
+
+class ReceiptIssuer:
+    """Assina e confere recibos com a identidade admin da organização do cliente.
+
+    Chave e certificado são relidos quando os arquivos mudam (rotação). Cada
+    certificado usado é gravado em keys_dir/<kid>.pem: recibos emitidos antes
+    de uma rotação, de um reinício ou por outro worker continuam verificáveis.
+    """
+
+    def __init__(self, key_path: str, cert_path: str, msp_id: str, keys_dir: str = RECEIPT_KEYS_DIR):
+        self.key_path = key_path
+        self.cert_path = cert_path
+        self.msp_id = msp_id
+        self.keys_dir = keys_dir
+        self._key_file = None
+        self._cert_file = None
+        self._key = None
+        self._public_keys = {}
+        self.kid = None
+
+    def _load(self):
+        if self._key_file is None:
+            self._key_file, self._cert_file = WatchedFile(self.key_path), WatchedFile(self.cert_path)
+        elif not (self._key_file.refresh() | self._cert_file.refresh()) and self._key is not None:
+            return
+        key = serialization.load_pem_private_key(self._key_file.data, password=None)
+        cert = x509.load_pem_x509_certificate(self._cert_file.data)
+        if key.public_key().public_numbers() != cert.public_key().public_numbers():
+            # rotação pela metade: segue com o par anterior até os dois arquivos chegarem
+            if self._key is None:
+                raise ValueError("Chave e certificado do emissor de recibos não formam um par")
+            return
+        self._key = key
+        self.kid = _kid(cert)
+        self._public_keys[self.kid] = cert.public_key()
+        self._persist(cert)
+
+    def _key_path(self, kid: str) -> str:
+        return os.path.join(self.keys_dir, f"{kid}.pem")
+
+    def _persist(self, cert):
+        path = self._key_path(self.kid)
+        if os.path.exists(path):
+            return
+        os.makedirs(self.keys_dir, mode=0o700, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(cert.public_bytes(serialization.Encoding.PEM))
+        os.replace(tmp, path)
+
+    def _public_key(self, kid):
+        """Chave pública do emissor kid: em memória ou no certificado gravado em keys_dir"""
+        if not isinstance(kid, str) or not _KID.fullmatch(kid):
+            return None
+        if kid not in self._public_keys:
+            try:
+                with open(self._key_path(kid), "rb") as f:
+                    cert = x509.load_pem_x509_certificate(f.read())
+            except (OSError, ValueError):
+                return None
+            if _kid(cert) != kid:
+                return None
+            self._public_keys[kid] = cert.public_key()
+        return self._public_keys[kid]
+
+    def sign(self, receipt: dict) -> dict:
+        self._load()
+        receipt = dict(receipt, iss=self.msp_id, kid=self.kid)
+        receipt["sig"] = _b64(self._key.sign(canonical(receipt), ec.ECDSA(hashes.SHA256())))
+        return receipt
+
+    def verify(self, receipt: dict) -> bool:
+        self._load()
+        public_key = self._public_key(receipt.get("kid"))
+        if public_key is None or not isinstance(receipt.get("sig"), str):
+            return False
+        try:
+            public_key.verify(_unb64(receipt["sig"]), canonical(receipt), ec.ECDSA(hashes.SHA256()))
+            return True
+        except (InvalidSignature, ValueError, TypeError):
+            return False
+
+
+issuer = ReceiptIssuer(admin_user["private_key"], admin_user["cert"], client_org["mspid"])
+
+
+def _endorsements(block: dict, tx_id: str) -> list:
+    """MSPs que endossaram a transação tx_id dentro do bloco decodificado.
+
+    As assinaturas dos endossantes não entram no recibo: conferi-las offline
+    exigiria o payload assinado e o certificado de cada endossante. A lista é
+    uma declaração do emissor, protegida pela assinatura do recibo.
+    """
+    for data in block['data']['data']:
+        payload = data['payload']
+        if payload['header']['channel_header']['tx_id'] != tx_id:
+            continue
+        return [
+            {"msp": endorsement['endorser']['mspid']}
+            for action in payload['data'].get('actions', [])
+            for endorsement in action['payload']['action']['endorsements']
+        ]
+    return []
+
+
+async def issue(cert_id: str, shard: str, write_response) -> Optional[dict]:
+    """Emite o recibo de uma escrita confirmada (resposta {txId, hash} do chaincode)"""
+    if isinstance(write_response, bytes):
+        write_response = write_response.decode('utf-8')
+    try:
+        result = json.loads(write_response)
+        tx_id, record_hash = result["txId"], result["hash"]
+    except (TypeError, ValueError, KeyError):
+        # chaincode antigo (sem retorno) ou mensagem de erro: não há o que assinar
+        return None
+
+    net = get_network()
+    block = await net.fabric_client.query_block_by_txid(
+        requestor=net.admin,
+        channel_name=shard,
+        peers=[net.select_query_peer(shard)],
+        tx_id=tx_id
+    )
+    return issuer.sign({
+        "v": RECEIPT_VERSION,
+        "id": cert_id,
+        "hash": record_hash,
+        "tx": tx_id,
+        "blk": block['header']['number'],
+        "ch": shard,
+        "iat": int(time.time()),
+        "end": _endorsements(block, tx_id),
+    })
+
+
+def encode_qr(receipt: dict) -> str:
+    """Payload compacto para QR code: prefixo + base64url(zlib(JSON canônico + sig))"""
+    data = json.dumps(receipt, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode('utf-8')
+    return QR_PREFIX + _b64(zlib.compress(data, 9))
+
+
+def decode_qr(payload: str) -> dict:
+    if not payload.startswith(QR_PREFIX):
+        raise ValueError("Payload de recibo desconhecido")
+    receipt = json.loads(zlib.decompress(_unb64(payload[len(QR_PREFIX):])))
+    if not isinstance(receipt, dict):
+        raise ValueError("Recibo não é um objeto JSON")
+    return receipt
+
+
+def check(receipt: dict, current_hash: Optional[str] = None) -> dict:
+    """Confere o recibo localmente, sem consultar peers.
+
+    - signature: assinatura do emissor (identidade admin do backend); é a
+      única verificação criptográfica
+    - endorsements: os MSPs declarados pelo emissor satisfazem a política do
+      canal (as assinaturas dos endossantes não são conferidas)
+    - fresh: se current_hash (estado local já conhecido) for informado,
+      indica se o registro ainda tem o hash do recibo; None quando desconhecido
+    """
+    signature_ok = issuer.verify(receipt)
+
+    selector = get_network().endorsers.get(receipt.get("ch"))
+    endorsements = receipt.get("end")
+    msps = {e.get("msp") for e in endorsements if isinstance(e, dict)} if isinstance(endorsements, list) else set()
+    endorsements_ok = selector is not None and len(msps & set(selector.orgs)) >= selector.required
+
+    fresh = None if current_hash is None else current_hash == receipt.get("hash")
+    return {
+        "valid": signature_ok and endorsements_ok and fresh is not False,
+        "signature": signature_ok,
+        "endorsements": endorsements_ok,
+        "fresh": fresh,
+        "cert_id": receipt.get("id"),
+        "hash": receipt.get("hash"),
+        "tx": receipt.get("tx"),
+        "blk": receipt.get("blk"),
+    }
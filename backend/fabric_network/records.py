@@ -0,0 +1,206 @@
+﻿import hashlib
+import json
+import os
+from collections import OrderedDict
+
+# Entradas decodificadas (verify/history por certidão) mantidas em memória por worker
+RECORD_CACHE_ENTRIES = int(os.getenv("RECORD_CACHE_ENTRIES", "4096"))
+
+# Campo ausente no JSON (diferente de null): não volta na serialização
+_ABSENT = object()
+
+
+class CertRecord:
+    """Registro da certidão com os mesmos campos do CertRecord do chaincode.
+
+    Usa __slots__ em vez de dict: ocupa uma fração da memória quando milhares
+    de registros ficam em cache ou num histórico longo. to_dict() devolve
+    exatamente as chaves do JSON original (registros off-ledger não têm os
+    campos pessoais; chaves desconhecidas ficam em extra).
+    """
+
+    # (chave JSON, atributo), na ordem do struct Go
+    FIELDS = (
+        ("id", "id"),
+        ("hash", "hash"),
+        ("name", "name"),
+        ("dateOfBirth", "date_of_birth"),
+        ("timeOfBirth", "time_of_birth"),
+        ("placeOfBirth", "place_of_birth"),
+        ("fatherName", "father_name"),
+        ("motherName", "mother_name"),
+        ("owner", "owner"),
+        ("timestamp", "timestamp"),
+        ("metadata", "metadata"),
+        ("source", "source"),
+        ("private", "private"),
+    )
+    __slots__ = tuple(attr for _, attr in FIELDS) + ("extra",)
+
+    def __init__(self, **values):
+        for _, attr in self.FIELDS:
+            setattr(self, attr, values.get(attr, _ABSENT))
+        self.extra = values.get("extra")
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "CertRecord":
+        # atribuições explícitas: ~2x mais rápido que setattr em laço sobre FIELDS
+        record = cls.__new__(cls)
+        get = data.get
+        record.id = get("id", _ABSENT)
+        record.hash = get("hash", _ABSENT)
+        record.name = get("name", _ABSENT)
+        record.date_of_birth = get("dateOfBirth", _ABSENT)
+        record.time_of_birth = get("timeOfBirth", _ABSENT)
+        record.place_of_birth = get("placeOfBirth", _ABSENT)
+        record.father_name = get("fatherName", _ABSENT)
+        record.mother_name = get("motherName", _ABSENT)
+        record.owner = get("owner", _ABSENT)
+        record.timestamp = get("timestamp", _ABSENT)
+        record.metadata = get("metadata", _ABSENT)
+        record.source = get("source", _ABSENT)
+        record.private = get("private", _ABSENT)
+        record.extra = None
+        if not _KNOWN_KEYS.issuperset(data):
+            record.extra = {key: value for key, value in data.items() if key not in _KNOWN_KEYS}
+        return record
+
+    @classmethod
+    def from_json(cls, raw) -> "CertRecord":
+        """Decodifica o valor gravado pelo chaincode (bytes ou str)"""
+        return cls.from_dict(json.loads(raw))
+
+    def to_dict(self) -> dict:
+        data = {}
+        for key, attr in self.FIELDS:
+            value = getattr(self, attr)
+            if value is not _ABSENT:
+                data[key] = value
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False)
+
+    def __reduce__(self):
+        return CertRecord.from_dict, (self.to_dict(),)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, CertRecord) and self.to_dict() == other.to_dict()
+
+    def __repr__(self) -> str:
+        return f"CertRecord(id={self.id!r}, hash={self.hash!r})"
+
+
+_KNOWN_KEYS = frozenset(key for key, _ in CertRecord.FIELDS)
+
+
+class HistoryEntry:
+    """Uma transação do GetHistory: txId, timestamp, isDelete e o registro naquele momento"""
+
+    __slots__ = ("tx_id", "timestamp", "is_delete", "value")
+
+    def __init__(self, tx_id: str, timestamp: str, is_delete: bool, value):
+        self.tx_id = tx_id
+        self.timestamp = timestamp
+        self.is_delete = is_delete
+        self.value = value
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "HistoryEntry":
+        value = data.get("value")
+        if isinstance(value, dict):
+            value = CertRecord.from_dict(value)
+        return cls(data.get("txId"), data.get("timestamp"), data.get("isDelete", False), value)
+
+    def summary(self, index: int) -> dict:
+        """Resumo usado na linha do tempo paginada (sem o valor do registro)"""
+        return {"index": index, "txId": self.tx_id, "timestamp": self.timestamp, "isDelete": self.is_delete}
+
+    def to_dict(self) -> dict:
+        value = self.value.to_dict() if isinstance(self.value, CertRecord) else self.value
+        return {"txId": self.tx_id, "timestamp": self.timestamp, "value": value, "isDelete": self.is_delete}
+
+
+def _loads(raw):
+    if isinstance(raw, (str, bytes)):
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return raw
+    return raw
+
+
+def decode_history(raw) -> list:
+    """Histórico do chaincode (JSON) em HistoryEntry; resposta vazia ou inválida vira lista vazia"""
+    data = _loads(raw)
+    if not isinstance(data, list):
+        return []
+    return [HistoryEntry.from_dict(item) for item in data if isinstance(item, dict)]
+
+
+def decode_verify(raw):
+    """Resposta do VerifyCert com o registro em CertRecord (o envelope continua dict)"""
+    data = _loads(raw)
+    if isinstance(data, dict) and isinstance(data.get("record"), dict):
+        data["record"] = CertRecord.from_dict(data["record"])
+    return data
+
+
+def to_jsonable(value):
+    """default= do json.dumps: serializa CertRecord/HistoryEntry direto dos slots"""
+    if isinstance(value, (CertRecord, HistoryEntry)):
+        return value.to_dict()
+    raise TypeError(f"{type(value).__name__} não é serializável em JSON")
+
+
+def _digest(raw) -> bytes:
+    """SHA-256 do JSON bruto (str ou bytes): hash() pode colidir e devolver o objeto de outro valor"""
+    return hashlib.sha256(raw.encode('utf-8') if isinstance(raw, str) else raw).digest()
+
+
+class DecodedCache:
+    """LRU por worker das leituras já decodificadas.
+
+    Cada entrada guarda o SHA-256 do JSON bruto vindo do cache compartilhado:
+    se outro worker gravou ou invalidou a certidão, o valor bruto muda e o
+    objeto antigo deixa de ser usado. Os objetos são compartilhados entre
+    requisições e não devem ser alterados.
+    """
+
+    def __init__(self, max_entries: int = RECORD_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind: str, cert_id: str, raw, decode):
+        if self.max_entries <= 0:
+            return decode(raw)
+        fingerprint = _digest(raw)
+        key = (kind, cert_id)
+        cached = self._entries.get(key)
+        if cached is not None and cached[0] == fingerprint:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return cached[1]
+        self.misses += 1
+        value = decode(raw)
+        self._entries[key] = (fingerprint, value)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, cert_id: str):
+        for key in [key for key in self._entries if key[1] == cert_id]:
+            del self._entries[key]
+
+    def metrics(self) -> dict:
+        return {"pid": os.getpid(), "entries": len(self._entries), "maxEntries": self.max_entries,
+                "hits": self.hits, "misses": self.misses}
+
+
+decoded_reads = DecodedCache()
+
@@ -0,0 +1,231 @@
+﻿import asyncio
+import bisect
+import hashlib
+from collections import OrderedDict
+from typing import Optional
+
+from . import certidao
+from .network import channel_name, profile
+from .logs import get_logger
+
+logger = get_logger("sharding")
+
+# Pontos virtuais por canal no anel de hash consistente
+DEFAULT_VNODES = 64
+# Quantidade de cert_ids cuja localização (canal) fica memorizada
+LOCATION_CACHE_SIZE = 100_000
+
+
+class CertAlreadyRegistered(Exception):
+    """O cert_id já está registrado em outro canal (o "já existe" do chaincode só vê o próprio canal)"""
+
+    def __init__(self, cert_id: str, channel: str):
+        super().__init__(f"registro com id {cert_id} já existe no canal {channel}")
+        self.channel = channel
+
+
+def _ring_hash(key: str) -> int:
+    return int.from_bytes(hashlib.sha1(key.encode('utf-8')).digest()[:8], 'big')
+
+
+def _normalize(value: str) -> str:
+    return " ".join(value.split()).lower()
+
+
+class ShardRouter:
+    """Mapeia certidões para canais (shards) com o mesmo chaincode certcc.
+
+    Ordem de decisão para registrar:
+      1. prefixo do cert_id (ex.: "SP-" -> certchannel-sp)
+      2. cartório de origem
+      3. anel de hash consistente sobre os canais configurados
+    Para ler/atualizar só o cert_id é conhecido: usa a localização memorizada,
+    o prefixo ou o anel e, se o registro não estiver lá, procura nos demais
+    canais em paralelo. Assim, ao incluir um canal (rebalance), apenas ~1/N
+    dos novos ids muda de destino e os registros antigos continuam localizáveis.
+    """
+
+    def __init__(self, channels: list, prefixes: dict = None, cartorios: dict = None, vnodes: int = DEFAULT_VNODES):
+        self.vnodes = vnodes
+        self.prefixes = sorted((prefixes or {}).items(), key=lambda rule: -len(rule[0]))
+        self.cartorios = {_normalize(name): ch for name, ch in (cartorios or {}).items()}
+        self.channels = []
+        self._ring = []
+        self._located = OrderedDict()
+        self.rebalance(channels)
+
+    def rebalance(self, channels: list):
+        """Reconstrói o anel com uma nova lista de canais"""
+        self.channels = list(dict.fromkeys(channels))
+        self._ring = sorted(
+            (_ring_hash(f"{ch}#{i}"), ch) for ch in self.channels for i in range(self.vnodes)
+        )
+        logger.info("Shard ring rebuilt", extra={"channels": self.channels})
+
+    def _ring_channel(self, cert_id: str) -> str:
+        idx = bisect.bisect(self._ring, (_ring_hash(cert_id),)) % len(self._ring)
+        return self._ring[idx][1]
+
+    def _prefix_channel(self, cert_id: str) -> Optional[str]:
+        for prefix, ch in self.prefixes:
+            if cert_id.startswith(prefix):
+                return ch
+        return None
+
+    def route(self, cert_id: str, cartorio: str = None) -> str:
+        """Canal onde uma nova certidão deve ser registrada"""
+        return (
+            self._prefix_channel(cert_id)
+            or (cartorio and self.cartorios.get(_normalize(cartorio)))
+            or self._ring_channel(cert_id)
+        )
+
+    def owner(self, cert_id: str) -> Optional[str]:
+        """Canal conhecido com certeza (memorizado ou por prefixo), se houver"""
+        if len(self.channels) == 1:
+            return self.channels[0]
+        return self._located.get(cert_id) or self._prefix_channel(cert_id)
+
+    def candidates(self, cert_id: str) -> list:
+        """Canais a consultar, do mais provável ao menos provável"""
+        first = self.owner(cert_id) or self._ring_channel(cert_id)
+        return [first] + [ch for ch in self.channels if ch != first]
+
+    def remember(self, cert_id: str, ch: str):
+        self._located[cert_id] = ch
+        self._located.move_to_end(cert_id)
+        if len(self._located) > LOCATION_CACHE_SIZE:
+            self._located.popitem(last=False)
+
+
+def _router_from_profile() -> ShardRouter:
+    """Lê a seção 'sharding' do perfil de conexão (sem ela, um único shard)"""
+    cfg = profile.get("sharding") or {}
+    channels = cfg.get("channels") or [channel_name]
+    unknown = [ch for ch in channels if ch not in profile["channels"]]
+    if unknown:
+        raise ValueError(f"Canais de sharding ausentes do perfil: {unknown}")
+    return ShardRouter(
+        channels,
+        prefixes=cfg.get("prefixes"),
+        cartorios=cfg.get("cartorios"),
+        vnodes=cfg.get("vnodes", DEFAULT_VNODES),
+    )
+
+
+router = _router_from_profile()
+
+
+def _is_empty_history(response) -> bool:
+    if isinstance(response, bytes):
+        response = response.decode('utf-8')
+    return not response or response.strip() in ("null", "[]")
+
+
+async def _locate(cert_id: str):
+    """Encontra o canal dono do cert_id; retorna (canal, resposta do VerifyCert)"""
+    candidates = router.candidates(cert_id)
+    try:
+        response = await certidao.verify_cert(cert_id, shard=candidates[0])
+        router.remember(cert_id, candidates[0])
+        return candidates[0], response
+    except Exception as e:
+        if not isinstance(e, certidao.CertNotFound) or len(candidates) == 1:
+            raise
+        first_error = e
+
+    # Busca entre shards em paralelo
+    results = await asyncio.gather(
+        *[certidao.verify_cert(cert_id, shard=ch) for ch in candidates[1:]],
+        return_exceptions=True
+    )
+    for ch, result in zip(candidates[1:], results):
+        if not isinstance(result, Exception):
+            router.remember(cert_id, ch)
+            return ch, result
+    # um shard fora do ar não é "não encontrado": a certidão pode estar nele
+    for result in results:
+        if not isinstance(result, certidao.CertNotFound):
+            raise result
+    raise first_error
+
+
+async def _registered_elsewhere(cert_id: str, shard: str) -> Optional[str]:
+    """Outro canal onde o cert_id já está registrado (None se não estiver em nenhum)"""
+    others = [ch for ch in router.channels if ch != shard]
+    results = await asyncio.gather(*[certidao.verify_cert(cert_id, shard=ch) for ch in others], return_exceptions=True)
+    for ch, result in zip(others, results):
+        if not isinstance(result, Exception):
+            router.remember(cert_id, ch)
+            return ch
+    # sem a resposta de todos os shards não dá para garantir que o id é novo
+    for result in results:
+        if not isinstance(result, certidao.CertNotFound):
+            raise result
+    return None
+
+
+async def _owner(cert_id: str) -> str:
+    return router.owner(cert_id) or (await _locate(cert_id))[0]
+
+
+async def register_cert(cert_id: str, nome: str, data: str, hora: str, hospital: str, pai: str, mae: str, cartorio: str, cartorio_reg: str, metadata: str, signer: str = None, idempotency_key: str = None):
+    """Registra a certidão no shard dono do cert_id/cartório; recusa ids já registrados em outro shard.
+
+    O próprio shard de destino é conferido pelo chaincode ("já existe"), que
+    também reconhece o reenvio de um registro idempotente já confirmado.
+    """
+    shard = router.route(cert_id, cartorio)
+    existing = await _registered_elsewhere(cert_id, shard)
+    if existing is not None:
+        raise CertAlreadyRegistered(cert_id, existing)
+    response = await certidao.register_cert(
+        cert_id, nome, data, hora, hospital, pai, mae, cartorio, cartorio_reg, metadata, shard=shard,
+        signer=signer, idempotency_key=idempotency_key
+    )
+    router.remember(cert_id, shard)
+    return response
+
+
+async def verify_cert(cert_id: str):
+    """Verifica a certidão no shard onde ela está registrada"""
+    return (await _locate(cert_id))[1]
+
+
+async def get_history(cert_id: str):
+    """Histórico da certidão; sem dono conhecido, consulta os shards em paralelo"""
+    owner = router.owner(cert_id)
+    if owner:
+        return await certidao.get_history(cert_id, shard=owner)
+
+    candidates = router.candidates(cert_id)
+    response = await certidao.get_history(cert_id, shard=candidates[0])
+    if not _is_empty_history(response) or len(candidates) == 1:
+        return response
+
+    results = await asyncio.gather(
+        *[certidao.get_history(cert_id, shard=ch) for ch in candidates[1:]],
+        return_exceptions=True
+    )
+    for ch, result in zip(candidates[1:], results):
+        if not isinstance(result, Exception) and not _is_empty_history(result):
+            router.remember(cert_id, ch)
+            return result
+    return response
+
+
+async def update_cert(cert_id: str, field_name: str, new_value: str, cartorio: str = None, idempotency_key: str = None):
+    """Atualiza um campo da certidão no shard dono"""
+    return await certidao.update_cert(cert_id, field_name, new_value, shard=await _owner(cert_id), cartorio=cartorio,
+                                      idempotency_key=idempotency_key)
+
+
+async def update_cert_batch(cert_id: str, updates: str, cartorio: str = None, idempotency_key: str = None):
+    """Atualiza vários campos da certidão no shard dono, em uma única transação"""
+    return await certidao.update_cert_batch(cert_id, updates, shard=await _owner(cert_id), cartorio=cartorio,
+                                            idempotency_key=idempotency_key)
+
+
+async def get_cert_pii(cert_id: str):
+    """Dados pessoais da certidão, lidos da coleção privada no shard dono"""
+    return await certidao.get_cert_pii(cert_id, shard=await _owner(cert_id))
@@ -0,0 +1,152 @@
+﻿import os
+import sqlite3
+import stat
+import tempfile
+import threading
+import time
+from typing import Optional, Tuple
+
+
+def _default_cache_dir() -> str:
+    """Diretório privado do usuário: $XDG_RUNTIME_DIR/certidao ou /dev/shm/certidao-<uid> (tmpfs no Linux)"""
+    runtime = os.getenv("XDG_RUNTIME_DIR")
+    if runtime and os.path.isdir(runtime):
+        return os.path.join(runtime, "certidao")
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, f"certidao-{os.getuid()}")
+
+
+DEFAULT_CACHE_DIR = _default_cache_dir()
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", os.path.join(DEFAULT_CACHE_DIR, "cache.sqlite3"))
+SHARED_CACHE_TTL = float(os.getenv("SHARED_CACHE_TTL", "30"))
+# A cada quantas gravações as entradas expiradas são removidas
+PURGE_EVERY = 1000
+# Por quanto tempo (segundos) a geração de uma certidão invalidada é lembrada; muito acima de qualquer consulta ao peer
+GENERATION_RETENTION = 600
+
+
+def _private_file(path: str):
+    """Cria o arquivo do cache com modo 0600; o diretório padrão precisa ser do usuário e 0700"""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if os.path.abspath(directory) == os.path.abspath(DEFAULT_CACHE_DIR):
+        info = os.lstat(directory)
+        if stat.S_ISLNK(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+            raise RuntimeError(f"Diretório do cache {directory} precisa pertencer ao usuário e ter modo 0700")
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, "O_NOFOLLOW", 0), 0o600)
+    os.close(fd)
+
+
+class SharedCache:
+    """Cache de leituras (verify/history) compartilhado entre os workers do host.
+
+    Usa um SQLite em modo WAL: leituras concorrentes não bloqueiam e uma
+    escrita/invalidação feita por um worker é vista imediatamente pelos
+    demais, o que serve de broadcast de invalidação. Cada processo e cada
+    thread abre a sua própria conexão (conexões SQLite não podem atravessar
+    um fork); as rotas chamam os métodos via asyncio.to_thread.
+
+    invalidate() incrementa a geração da certidão e set() só grava se a
+    geração lida antes da consulta ao peer ainda for a atual: um leitor que
+    buscou o valor antes de uma escrita não o devolve ao cache depois dela.
+    """
+
+    def __init__(self, path: str, ttl: float):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.stale_sets = 0
+        self._writes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def _connection(self) -> sqlite3.Connection:
+        local = self._local
+        if getattr(local, "conn", None) is None or local.pid != os.getpid():
+            _private_file(self.path)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS reads ("
+                " kind TEXT NOT NULL, cert_id TEXT NOT NULL, value TEXT NOT NULL, expires REAL NOT NULL,"
+                " PRIMARY KEY (kind, cert_id))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS generations ("
+                " cert_id TEXT PRIMARY KEY, gen INTEGER NOT NULL, updated REAL NOT NULL)"
+            )
+            local.conn = conn
+            local.pid = os.getpid()
+        return local.conn
+
+    def lookup(self, kind: str, cert_id: str) -> Tuple[Optional[str], int]:
+        """(valor em cache ainda válido ou None, geração atual da certidão para passar ao set)"""
+        if not self.enabled:
+            return None, 0
+        value, generation = self._connection().execute(
+            "SELECT (SELECT value FROM reads WHERE kind = ? AND cert_id = ? AND expires > ?),"
+            " COALESCE((SELECT gen FROM generations WHERE cert_id = ?), 0)",
+            (kind, cert_id, time.time(), cert_id)
+        ).fetchone()
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value, generation
+
+    def get(self, kind: str, cert_id: str) -> Optional[str]:
+        """Valor em cache ainda válido, ou None"""
+        return self.lookup(kind, cert_id)[0]
+
+    def set(self, kind: str, cert_id: str, value: str, generation: int):
+        """Grava o valor lido na geração informada; descarta se a certidão foi invalidada nesse meio tempo"""
+        if not self.enabled:
+            return
+        cursor = self._connection().execute(
+            "INSERT OR REPLACE INTO reads (kind, cert_id, value, expires)"
+            " SELECT ?, ?, ?, ? WHERE COALESCE((SELECT gen FROM generations WHERE cert_id = ?), 0) = ?",
+            (kind, cert_id, value, time.time() + self.ttl, cert_id, generation)
+        )
+        if cursor.rowcount == 0:
+            self.stale_sets += 1
+        self._writes += 1
+        if self._writes % PURGE_EVERY == 0:
+            self.purge_expired()
+
+    def invalidate(self, cert_id: str):
+        """Remove todas as leituras de uma certidão e avança sua geração (chamado após escritas)"""
+        if not self.enabled:
+            return
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO generations (cert_id, gen, updated) VALUES (?, 1, ?)"
+                " ON CONFLICT(cert_id) DO UPDATE SET gen = gen + 1, updated = excluded.updated",
+                (cert_id, time.time())
+            )
+            conn.execute("DELETE FROM reads WHERE cert_id = ?", (cert_id,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def purge_expired(self):
+        if self.enabled:
+            now = time.time()
+            conn = self._connection()
+            conn.execute("DELETE FROM reads WHERE expires <= ?", (now,))
+            conn.execute("DELETE FROM generations WHERE updated <= ?", (now - GENERATION_RETENTION,))
+
+    def metrics(self) -> dict:
+        """Acertos/falhas deste worker e gravações descartadas por invalidação concorrente"""
+        return {"pid": os.getpid(), "path": self.path, "ttl": self.ttl, "hits": self.hits, "misses": self.misses,
+                "staleSets": self.stale_sets}
+
+
+read_cache = SharedCache(SHARED_CACHE_PATH, SHARED_CACHE_TTL)
@@ -0,0 +1,99 @@
+﻿import gzip
+import hashlib
+import json
+import os
+
+from fastapi import Request, Response
+
+from .fabric_network.records import to_jsonable
+
+try:
+    import brotli
+except ImportError:  # brotli é opcional; sem ele usamos só gzip
+    brotli = None
+
+# Tempo que navegadores/proxies/CDNs podem reaproveitar uma resposta sem revalidar
+HTTP_CACHE_MAX_AGE = int(os.getenv("HTTP_CACHE_MAX_AGE", "60"))
+# Corpos menores que isso não compensam compressão
+COMPRESS_MIN_SIZE = 1024
+
+CACHE_CONTROL = f"public, max-age={HTTP_CACHE_MAX_AGE}, stale-while-revalidate={HTTP_CACHE_MAX_AGE}"
+
+
+def make_etag(kind: str, version: str, history: list) -> str:
+    """ETag fraca a partir da versão do registro e dos txIds extremos do histórico.
+
+    Usa o primeiro e o último txId (e o tamanho) para não depender da ordem
+    em que o peer devolve o histórico. history é uma lista de HistoryEntry.
+    É fraca (W/) porque a mesma ETag vale para o corpo em identity, gzip e br.
+    """
+    history = history or []
+    first_tx = (history[0].tx_id or "") if history else ""
+    last_tx = (history[-1].tx_id or "") if history else ""
+    seed = f"{kind}|{version}|{len(history)}|{first_tx}|{last_tx}"
+    return 'W/"' + hashlib.sha256(seed.encode('utf-8')).hexdigest()[:32] + '"'
+
+
+def _opaque_tag(tag: str) -> str:
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Compara If-None-Match com a ETag atual (comparação fraca, como manda a RFC 9110)"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in header.split(",")]
+    return any(_opaque_tag(tag) == _opaque_tag(etag) for tag in candidates)
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL, "Vary": "Accept-Encoding"})
+
+
+def accepted_encodings(header: str) -> dict:
+    """Codificações do Accept-Encoding com seus q-values (q=0 significa "não aceito")"""
+    accepted = {}
+    for item in header.lower().split(","):
+        coding, _, params = item.strip().partition(";")
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding.strip()] = quality
+    return accepted
+
+
+def choose_encoding(header: str):
+    """br ou gzip, o de maior q-value aceito (br no empate); None para enviar sem compressão"""
+    accepted = accepted_encodings(header)
+    wildcard = accepted.get("*", 0.0)
+    options = [("br", 2), ("gzip", 1)] if brotli is not None else [("gzip", 1)]
+    ranked = [(accepted.get(coding, wildcard), preference, coding) for coding, preference in options]
+    quality, _, coding = max(ranked)
+    return coding if quality > 0 else None
+
+
+def cacheable_json(request: Request, payload, etag: str) -> Response:
+    """Resposta JSON com ETag, Cache-Control e compressão br/gzip conforme Accept-Encoding"""
+    body = json.dumps(payload, ensure_ascii=False, default=to_jsonable).encode('utf-8')
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL, "Vary": "Accept-Encoding"}
+
+    if len(body) >= COMPRESS_MIN_SIZE:
+        encoding = choose_encoding(request.headers.get("accept-encoding", ""))
+        if encoding == "br":
+            body = brotli.compress(body)
+            headers["Content-Encoding"] = "br"
+        elif encoding == "gzip":
+            body = gzip.compress(body, compresslevel=6)
+            headers["Content-Encoding"] = "gzip"
+
+    return Response(content=body, media_type="application/json", headers=headers)
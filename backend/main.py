@@ -1,11 +1,45 @@
-﻿import json
-from fastapi import FastAPI, HTTPException
+﻿import asyncio
+import json
+import os
+import secrets
+import time
+from fastapi import FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from .fabric_network import certidao
-from typing import Dict, Optional
+from .fabric_network import receipts, sharding
+from .fabric_network.admission import AdmissionRejected, write_admission
+from .fabric_network.certidao import CertNotFound, WriteRejected, is_transient
+from .fabric_network.credentials import same_cartorio
+from .fabric_network.events import broker
+from .fabric_network.idempotency import IdempotencyConflict, IdempotencyInProgress, fingerprint, idempotency_store
+from .fabric_network.logs import get_logger, loop_lag, new_request_id, request_id_var
+from .fabric_network.network import get_network
+from .fabric_network.records import CertRecord, decode_history, decode_verify, decoded_reads
+from .fabric_network.shared_cache import read_cache
+from .http_cache import cacheable_json, etag_matches, make_etag, not_modified
+from typing import Any, Dict, List, Optional
 
 app = FastAPI(title="Blockchain Certidão API")
 
+logger = get_logger("api")
+
+# Tamanho padrão e máximo de uma página de /certidao/{cert_id}/history/page
+HISTORY_PAGE_LIMIT = 20
+HISTORY_PAGE_MAX = 200
+
+# Chaves (X-API-Key) autorizadas a ler os dados pessoais de registros off-ledger, separadas por vírgula
+PII_API_KEYS = [key.strip() for key in os.getenv("PII_API_KEYS", "").split(",") if key.strip()]
+
+# Chave (X-API-Key) de cada cartório que assina as próprias escritas: "chave:Cartorio A,chave2:Cartorio B"
+CARTORIO_API_KEYS = {
+    key.strip(): name.strip()
+    for key, _, name in (item.partition(":") for item in os.getenv("CARTORIO_API_KEYS", "").split(","))
+    if key.strip() and name.strip()
+}
+
+# Intervalo de comentários keep-alive no stream SSE (evita timeout de proxies)
+SSE_KEEPALIVE_SECONDS = 15
+
 # ============== Models ==============
 
 class CertCreate(BaseModel):
@@ -27,15 +61,211 @@ class CertUpdate(BaseModel):
     cert_id: str
     field_name: str  # name, dateOfBirth, timeOfBirth, placeOfBirth, fatherName, motherName, owner, source
     new_value: str
+    cartorio: Optional[str] = None  # se informado, precisa ser o cartório da X-API-Key
+
+class CertBatchUpdate(BaseModel):
+    cert_id: str
+    updates: Dict[str, str]  # field_name -> new_value, aplicados atomicamente
+    cartorio: Optional[str] = None  # se informado, precisa ser o cartório da X-API-Key
+
+class ReceiptCheck(BaseModel):
+    receipt: Optional[Dict[str, Any]] = None  # recibo em JSON
+    qr: Optional[str] = None  # ou o payload lido do QR code
+    check_freshness: bool = True  # compara com o estado já conhecido localmente (sem consultar peers)
+
+# ============== Helpers ==============
+
+def signing_cartorio(api_key: Optional[str], cartorio: Optional[str]) -> Optional[str]:
+    """Cartório cuja identidade assina a escrita, dado pela X-API-Key (None assina com o Admin).
+
+    O corpo nunca escolhe a identidade: um cartório diferente do da chave dá
+    403. Com CARTORIO_API_KEYS configurado, toda escrita exige uma chave (401
+    sem ela); o Admin só assina escritas sem chave quando nenhuma está
+    configurada, e mesmo assim não em nome de um cartório com identidade própria.
+    """
+    if api_key:
+        given = api_key.encode('utf-8')
+        owners = [name for key, name in CARTORIO_API_KEYS.items() if secrets.compare_digest(key.encode('utf-8'), given)]
+        if not owners:
+            raise HTTPException(status_code=401, detail="X-API-Key inválida")
+        if cartorio and not same_cartorio(cartorio, owners[0]):
+            raise HTTPException(status_code=403, detail=f"A X-API-Key não pertence ao cartório {cartorio}")
+        return owners[0]
+    if CARTORIO_API_KEYS:
+        raise HTTPException(status_code=401, detail="Escritas exigem a X-API-Key de um cartório")
+    if get_network().credentials.has_identity(cartorio):
+        raise HTTPException(status_code=401, detail=f"Escritas do cartório {cartorio} exigem a X-API-Key do cartório")
+    return None
+
+
+async def cached_chaincode_read(kind: str, cert_id: str, fetch):
+    """Leitura via cache compartilhado entre workers; em falta consulta o chaincode.
+
+    O SQLite roda fora do event loop (to_thread): com outro worker gravando,
+    uma operação pode esperar pelo lock do banco.
+    """
+    response, generation = await asyncio.to_thread(read_cache.lookup, kind, cert_id)
+    if response is None:
+        response = await fetch(cert_id)
+        if isinstance(response, bytes):
+            response = response.decode('utf-8')
+        await asyncio.to_thread(read_cache.set, kind, cert_id, response, generation)
+    return response
+
+
+def parse_chaincode_json(response):
+    """Tenta parsear como JSON se for string"""
+    if isinstance(response, (str, bytes)):
+        if isinstance(response, bytes):
+            response = response.decode('utf-8')
+        try:
+            response = json.loads(response)
+        except json.JSONDecodeError:
+            pass
+    return response
+
+
+async def load_verify(cert_id: str):
+    """Só a verificação (via cache), para a rota GET /certidao/{cert_id}"""
+    try:
+        verify_raw = await cached_chaincode_read("verify", cert_id, sharding.verify_cert)
+    except Exception as e:
+        status = 404 if isinstance(e, CertNotFound) else 500
+        raise HTTPException(status_code=status, detail=str(e))
+    return decoded_reads.get("verify", cert_id, verify_raw, decode_verify)
+
+
+async def load_cert_state(cert_id: str):
+    """Verificação e histórico (em paralelo, via cache) usados nas rotas GET cacheáveis do histórico.
+
+    O JSON bruto do cache compartilhado é decodificado uma vez por worker em
+    CertRecord/HistoryEntry (decoded_reads) e reaproveitado enquanto não mudar.
+    """
+    try:
+        verify_raw, history_raw = await asyncio.gather(
+            cached_chaincode_read("verify", cert_id, sharding.verify_cert),
+            cached_chaincode_read("history", cert_id, sharding.get_history)
+        )
+    except Exception as e:
+        status = 404 if isinstance(e, CertNotFound) else 500
+        raise HTTPException(status_code=status, detail=str(e))
+    verify = decoded_reads.get("verify", cert_id, verify_raw, decode_verify)
+    history = decoded_reads.get("history", cert_id, history_raw, decode_history)
+    return verify, history, _record_hash(verify)
+
+
+def _record(verify):
+    record = verify.get("record") if isinstance(verify, dict) else None
+    return record if isinstance(record, CertRecord) else None
+
+
+def _record_hash(verify) -> str:
+    record = _record(verify)
+    return record.hash if record is not None and isinstance(record.hash, str) else ""
+
+
+def _record_version(verify) -> str:
+    """Hash on-chain e timestamp da última escrita: mudam a cada alteração do registro"""
+    record = _record(verify)
+    timestamp = record.timestamp if record is not None and isinstance(record.timestamp, str) else ""
+    return f"{_record_hash(verify)}|{timestamp}"
+
+
+async def invalidate_reads(cert_id: str):
+    """Descarta a certidão do cache compartilhado e das leituras decodificadas deste worker"""
+    await asyncio.to_thread(read_cache.invalidate, cert_id)
+    decoded_reads.invalidate(cert_id)
+
+
+async def issue_receipt(cert_id: str, response):
+    """Recibo de verificação da escrita; uma falha aqui não invalida a escrita"""
+    shard = sharding.router.owner(cert_id) or sharding.router.route(cert_id)
+    try:
+        receipt = await receipts.issue(cert_id, shard, response)
+    except Exception as e:
+        logger.warning("Failed to issue receipt", extra={"cert_id": cert_id, "error": str(e)})
+        return None
+    if receipt is None:
+        return None
+    return {"receipt": receipt, "qr": receipts.encode_qr(receipt)}
+
+async def idempotent_write(idempotency_key: Optional[str], action: str, payload: dict, cert_id: str, write):
+    """Executa write(idempotency_key) uma vez por chave; reenvios da mesma chave recebem a resposta original.
+
+    A tabela de chaves é SQLite com lock entre workers: as chamadas rodam fora do event loop (to_thread).
+    """
+    if idempotency_key:
+        try:
+            stored = await asyncio.to_thread(idempotency_store.claim, idempotency_key, fingerprint(action, payload), cert_id)
+        except IdempotencyConflict as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        except IdempotencyInProgress as e:
+            raise HTTPException(status_code=409, detail=str(e), headers={"Retry-After": "1"})
+        if stored is not None:
+            return json.loads(stored)
+
+    try:
+        body = await write(idempotency_key)
+    except Exception as e:
+        if idempotency_key:
+            await asyncio.to_thread(idempotency_store.release, idempotency_key)
+        if isinstance(e, AdmissionRejected):
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+        if is_transient(e):
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+        if isinstance(e, sharding.CertAlreadyRegistered):
+            raise HTTPException(status_code=409, detail=str(e))
+        if isinstance(e, WriteRejected):
+            raise HTTPException(status_code=422, detail=str(e))
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if idempotency_key:
+        result = parse_chaincode_json(body["response"])
+        tx_id = result.get("txId") if isinstance(result, dict) else None
+        if tx_id is None:
+            # só uma escrita confirmada (com txId) pode ser repetida para os reenvios da chave
+            await asyncio.to_thread(idempotency_store.release, idempotency_key)
+            raise HTTPException(status_code=502, detail=f"Escrita sem txId confirmado: {body['response']}")
+        await asyncio.to_thread(idempotency_store.complete, idempotency_key, tx_id, json.dumps(body))
+    return body
+
+# ============== Middleware ==============
+
+@app.middleware("http")
+async def correlate_request(request: Request, call_next):
+    """Id de correlação (X-Request-ID) propagado aos logs, inclusive ao log com o tx_id das escritas"""
+    loop_lag.start()
+    request_id = request.headers.get("x-request-id") or new_request_id()
+    token = request_id_var.set(request_id)
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+        response.headers["X-Request-ID"] = request_id
+        fields = {
+            "method": request.method,
+            "path": request.url.path,
+            "status": response.status_code,
+            "duration_ms": round(1000 * (time.perf_counter() - started), 2),
+        }
+        if response.status_code < 400:
+            logger.info("Request handled", extra=dict(fields, sample=True))
+        else:
+            logger.warning("Request failed", extra=fields)
+        return response
+    finally:
+        request_id_var.reset(token)
 
 # ============== Endpoints ==============
 
 @app.post("/certidao/register")
-async def register_cert(cert: CertCreate):
-    """Registra uma nova certidão na blockchain"""
-    try:
+async def register_cert(cert: CertCreate, idempotency_key: Optional[str] = Header(default=None),
+                        x_api_key: Optional[str] = Header(default=None)):
+    """Registra uma nova certidão na blockchain (com Idempotency-Key, reenvios são seguros)"""
+    signer = signing_cartorio(x_api_key, cert.cartorio)
+
+    async def write(key):
         metadata_json = json.dumps(cert.metadata)
-        response = await certidao.register_cert(
+        response = await sharding.register_cert(
             cert.cert_id,
             cert.nome,
             cert.data,
@@ -45,26 +275,23 @@ async def register_cert(cert: CertCreate):
             cert.mae,
             cert.cartorio,
             cert.cartorio_reg,
-            metadata_json
+            metadata_json,
+            signer=signer,
+            idempotency_key=key
         )
-        return {"status": "success", "response": response}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        await invalidate_reads(cert.cert_id)
+        receipt = await issue_receipt(cert.cert_id, response)
+        return {"status": "success", "response": response, "receipt": receipt}
+
+    return await idempotent_write(idempotency_key, "register", dict(cert.model_dump(), signer=signer), cert.cert_id, write)
 
 
 @app.post("/certidao/verify")
 async def verify_cert(query: CertQuery):
     """Verifica uma certidão e retorna seus dados com validação de hash"""
     try:
-        response = await certidao.verify_cert(query.cert_id)
-        # Tenta parsear como JSON se for string
-        if isinstance(response, (str, bytes)):
-            if isinstance(response, bytes):
-                response = response.decode('utf-8')
-            try:
-                response = json.loads(response)
-            except json.JSONDecodeError:
-                pass
+        response = await cached_chaincode_read("verify", query.cert_id, sharding.verify_cert)
+        response = parse_chaincode_json(response)
         return {"status": "success", "data": response}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -74,35 +301,216 @@ async def verify_cert(query: CertQuery):
 async def get_cert_history(query: CertQuery):
     """Retorna o histórico de alterações de uma certidão"""
     try:
-        response = await certidao.get_history(query.cert_id)
-        # Tenta parsear como JSON se for string
-        if isinstance(response, (str, bytes)):
-            if isinstance(response, bytes):
-                response = response.decode('utf-8')
-            try:
-                response = json.loads(response)
-            except json.JSONDecodeError:
-                pass
+        response = await cached_chaincode_read("history", query.cert_id, sharding.get_history)
+        response = parse_chaincode_json(response)
         return {"status": "success", "history": response}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/certidao/pii")
+async def get_cert_pii(query: CertQuery, x_api_key: Optional[str] = Header(default=None)):
+    """Registro completo com os dados pessoais; só para chaves em PII_API_KEYS e sem passar pelo cache"""
+    if not PII_API_KEYS:
+        raise HTTPException(status_code=403, detail="Leitura de dados pessoais desabilitada (PII_API_KEYS vazio)")
+    if not x_api_key or not any(secrets.compare_digest(x_api_key, key) for key in PII_API_KEYS):
+        raise HTTPException(status_code=401, detail="X-API-Key ausente ou inválida")
+    try:
+        response = parse_chaincode_json(await sharding.get_cert_pii(query.cert_id))
+    except Exception as e:
+        status = 404 if isinstance(e, CertNotFound) else 500
+        raise HTTPException(status_code=status, detail=str(e))
+    logger.info("PII read", extra={"cert_id": query.cert_id})
+    return JSONResponse({"status": "success", "data": response}, headers={"Cache-Control": "no-store"})
+
+
+@app.post("/certidao/verify/receipt")
+async def verify_receipt(check: ReceiptCheck):
+    """Confere um recibo de verificação apenas com criptografia local, sem consultar peers"""
+    try:
+        receipt = check.receipt if check.receipt is not None else receipts.decode_qr(check.qr or "")
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Recibo inválido: {e}")
+    if not isinstance(receipt, dict):
+        raise HTTPException(status_code=400, detail="Recibo inválido: esperado um objeto JSON")
+
+    current_hash = None
+    if check.check_freshness and isinstance(receipt.get("id"), str) and receipt["id"]:
+        cached = await asyncio.to_thread(read_cache.get, "verify", receipt["id"])
+        if cached is not None:
+            current_hash = _record_hash(decoded_reads.get("verify", receipt["id"], cached, decode_verify)) or None
+    return {"status": "success", "result": receipts.check(receipt, current_hash)}
+
+
+# Declarada antes de /certidao/{cert_id} para não ser capturada por ela
+@app.get("/certidao/events")
+async def subscribe_cert_events(
+    request: Request,
+    cert_id: List[str] = Query(default=[]),
+    source: List[str] = Query(default=[])
+):
+    """Server-Sent Events com registros/atualizações dos cert_ids ou cartórios (source) observados"""
+    sub = broker.subscribe(sharding.router.channels, cert_ids=cert_id, sources=source)
+
+    async def stream():
+        try:
+            yield ": connected\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(sub.queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {event['action']}\nid: {event['txId']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        finally:
+            broker.unsubscribe(sub)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.get("/certidao/{cert_id}")
+async def get_cert(cert_id: str, request: Request):
+    """Verificação via GET com ETag/Cache-Control, cacheável por navegadores, proxies e CDNs"""
+    verify = await load_verify(cert_id)
+    etag = make_etag("verify", _record_version(verify), [])
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    return cacheable_json(request, {"status": "success", "data": verify}, etag)
+
+
+@app.get("/certidao/{cert_id}/history")
+async def get_cert_history_cacheable(cert_id: str, request: Request):
+    """Histórico via GET com ETag/Cache-Control e compressão de corpos grandes"""
+    verify, history, record_hash = await load_cert_state(cert_id)
+    etag = make_etag("history", record_hash, history)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    return cacheable_json(request, {"status": "success", "history": history}, etag)
+
+
+@app.get("/certidao/{cert_id}/history/page")
+async def get_cert_history_page(
+    cert_id: str,
+    request: Request,
+    offset: int = Query(default=0, ge=0),
+    limit: int = Query(default=HISTORY_PAGE_LIMIT, ge=1, le=HISTORY_PAGE_MAX)
+):
+    """Janela do histórico só com o resumo de cada transação (detalhes em /history/tx/{tx_id})"""
+    verify, history, record_hash = await load_cert_state(cert_id)
+    etag = make_etag(f"history-page:{offset}:{limit}", record_hash, history)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    entries = [item.summary(index) for index, item in enumerate(history[offset:offset + limit], start=offset)]
+    payload = {"status": "success", "total": len(history), "offset": offset, "limit": limit, "entries": entries}
+    return cacheable_json(request, payload, etag)
+
+
+@app.get("/certidao/{cert_id}/history/tx/{tx_id}")
+async def get_cert_history_entry(cert_id: str, tx_id: str, request: Request):
+    """Uma transação do histórico, com o valor completo do registro naquele momento"""
+    verify, history, record_hash = await load_cert_state(cert_id)
+    entry = next((item for item in history if item.tx_id == tx_id), None)
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"Transação {tx_id} não encontrada no histórico de {cert_id}")
+    # uma transação confirmada não muda: a ETag depende só dela
+    etag = make_etag(f"history-tx:{tx_id}", "", [])
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    return cacheable_json(request, {"status": "success", "entry": entry}, etag)
+
+
 @app.post("/certidao/update")
-async def update_cert(update: CertUpdate):
+async def update_cert(update: CertUpdate, idempotency_key: Optional[str] = Header(default=None),
+                      x_api_key: Optional[str] = Header(default=None)):
     """Atualiza um campo específico de uma certidão"""
-    try:
-        response = await certidao.update_cert(
+    signer = signing_cartorio(x_api_key, update.cartorio)
+
+    async def write(key):
+        response = await sharding.update_cert(
             update.cert_id,
             update.field_name,
-            update.new_value
+            update.new_value,
+            cartorio=signer,
+            idempotency_key=key
         )
-        return {"status": "success", "response": response}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        await invalidate_reads(update.cert_id)
+        receipt = await issue_receipt(update.cert_id, response)
+        return {"status": "success", "response": response, "receipt": receipt}
+
+    return await idempotent_write(idempotency_key, "update", dict(update.model_dump(), signer=signer), update.cert_id, write)
+
+
+@app.post("/certidao/update/batch")
+async def update_cert_batch(update: CertBatchUpdate, idempotency_key: Optional[str] = Header(default=None),
+                            x_api_key: Optional[str] = Header(default=None)):
+    """Atualiza vários campos de uma certidão em uma única transação"""
+    if not update.updates:
+        raise HTTPException(status_code=400, detail="Nenhum campo informado para atualização")
+    signer = signing_cartorio(x_api_key, update.cartorio)
+
+    async def write(key):
+        response = await sharding.update_cert_batch(
+            update.cert_id,
+            json.dumps(update.updates),
+            cartorio=signer,
+            idempotency_key=key
+        )
+        await invalidate_reads(update.cert_id)
+        receipt = await issue_receipt(update.cert_id, response)
+        return {"status": "success", "response": response, "receipt": receipt}
+
+    return await idempotent_write(idempotency_key, "update/batch", dict(update.model_dump(), signer=signer), update.cert_id, write)
 
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy"}
\ No newline at end of file
+    return {"status": "healthy"}
+
+
+@app.get("/metrics/admission")
+async def admission_metrics():
+    """Métricas de fila e tempo de espera do caminho de escrita"""
+    return write_admission.metrics()
+
+
+@app.get("/metrics/orderers")
+async def orderer_metrics():
+    """Failovers e latência/saúde de cada orderer"""
+    return get_network().orderer_pool.metrics()
+
+
+@app.get("/metrics/events")
+async def event_metrics():
+    """Assinantes e eventos repassados pelo listener deste worker"""
+    return broker.metrics()
+
+
+@app.get("/metrics/loop")
+async def loop_metrics():
+    """Atraso médio/máximo do event loop deste worker (bloqueios síncronos)"""
+    return loop_lag.metrics()
+
+
+@app.get("/metrics/credentials")
+async def credential_metrics():
+    """Identidades carregadas e recargas de credenciais deste worker"""
+    return get_network().credentials.metrics()
+
+
+@app.get("/metrics/idempotency")
+async def idempotency_metrics():
+    """Chaves de idempotência reservadas e respostas repetidas neste worker"""
+    return idempotency_store.metrics()
+
+
+@app.get("/metrics/cache")
+async def cache_metrics():
+    """Acertos/falhas do cache de leituras compartilhado (por worker)"""
+    return read_cache.metrics()
+
+
+@app.get("/metrics/records")
+async def record_metrics():
+    """Leituras decodificadas (CertRecord/HistoryEntry) mantidas em memória por este worker"""
+    return decoded_reads.metrics()
\ No newline at end of file
@@ -0,0 +1,135 @@
+﻿import asyncio
+
+import pytest
+
+pytest.importorskip("hfc")
+
+from hfc.protos.peer.proposal_response_pb2 import ProposalResponse  # noqa: E402
+
+from backend.fabric_network import certidao, sharding  # noqa: E402
+
+RECORD = '{"record": {"id": "CERT1", "hash": "abc"}, "hashMatch": true}'
+
+
+def _rejected(message: str, status: int = 500) -> Exception:
+    """Exceção como a do hfc chaincode_query quando o chaincode devolve erro"""
+    response = ProposalResponse()
+    response.response.status = status
+    response.response.message = message
+    return Exception([response])
+
+
+class _FakeClient:
+    def __init__(self, by_channel: dict):
+        self.by_channel = by_channel
+        self.calls = []
+
+    async def chaincode_query(self, requestor, channel_name, peers, args, cc_name, fcn):
+        self.calls.append(channel_name)
+        result = self.by_channel[channel_name]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+class _FakeNetwork:
+    admin = None
+
+    def __init__(self, client):
+        self.fabric_client = client
+
+    def select_query_peer(self, shard):
+        return shard
+
+
+@pytest.fixture
+def two_shards(monkeypatch):
+    router = sharding.ShardRouter(["certchannel-a", "certchannel-b"])
+    monkeypatch.setattr(sharding, "router", router)
+    return router
+
+
+def _use_client(monkeypatch, client):
+    monkeypatch.setattr(certidao, "get_network", lambda: _FakeNetwork(client))
+
+
+def test_proposal_error_decodes_not_found():
+    error = _rejected("registro CERT1 não encontrado")
+    # str() da exceção do hfc não contém o texto legível
+    assert certidao.NOT_FOUND_MARKER not in str(error)
+
+    decoded = certidao.proposal_error(error)
+    assert isinstance(decoded, certidao.CertNotFound)
+    assert str(decoded) == "registro CERT1 não encontrado"
+    assert decoded.status == 500
+
+
+def test_proposal_error_other_chaincode_error():
+    decoded = certidao.proposal_error(_rejected("metadata JSON inválido: x"))
+    assert type(decoded) is certidao.ChaincodeError
+
+
+def test_proposal_error_keeps_transport_errors():
+    error = TimeoutError("deadline exceeded")
+    assert certidao.proposal_error(error) is error
+
+
+def test_locate_falls_back_to_other_shard(monkeypatch, two_shards):
+    first, second = two_shards.candidates("CERT1")
+    client = _FakeClient({first: _rejected("registro CERT1 não encontrado"), second: RECORD})
+    _use_client(monkeypatch, client)
+
+    assert asyncio.run(sharding.verify_cert("CERT1")) == RECORD
+    assert client.calls == [first, second]
+    assert two_shards.owner("CERT1") == second
+
+
+def test_locate_missing_everywhere_raises_not_found(monkeypatch, two_shards):
+    first, second = two_shards.candidates("CERT1")
+    client = _FakeClient({ch: _rejected("registro CERT1 não encontrado") for ch in (first, second)})
+    _use_client(monkeypatch, client)
+
+    with pytest.raises(certidao.CertNotFound):
+        asyncio.run(sharding.verify_cert("CERT1"))
+
+
+def test_locate_reports_unreachable_shard(monkeypatch, two_shards):
+    first, second = two_shards.candidates("CERT1")
+    client = _FakeClient({first: _rejected("registro CERT1 não encontrado"), second: TimeoutError("deadline exceeded")})
+    _use_client(monkeypatch, client)
+
+    # com um shard sem resposta a certidão pode estar nele: não é 404
+    with pytest.raises(TimeoutError):
+        asyncio.run(sharding.verify_cert("CERT1"))
+
+
+def _register(cartorio: str = "Cartorio A"):
+    return sharding.register_cert("CERT1", "n", "2000-01-01", "10:00", "h", "p", "m", cartorio, cartorio, "{}")
+
+
+def test_register_rejects_id_on_other_shard(monkeypatch, two_shards):
+    target = two_shards.route("CERT1")
+    other = next(ch for ch in two_shards.channels if ch != target)
+    client = _FakeClient({other: RECORD})
+    _use_client(monkeypatch, client)
+
+    with pytest.raises(sharding.CertAlreadyRegistered) as info:
+        asyncio.run(_register())
+    assert info.value.channel == other
+    assert client.calls == [other]
+
+
+def test_register_new_id_invokes_target_shard(monkeypatch, two_shards):
+    target = two_shards.route("CERT1")
+    other = next(ch for ch in two_shards.channels if ch != target)
+    _use_client(monkeypatch, _FakeClient({other: _rejected("registro CERT1 não encontrado")}))
+    invoked = []
+
+    async def fake_register(*args, shard, **kwargs):
+        invoked.append(shard)
+        return '{"txId": "tx1", "hash": "abc"}'
+
+    monkeypatch.setattr(certidao, "register_cert", fake_register)
+    asyncio.run(_register())
+    assert invoked == [target]
+    assert two_shards.owner("CERT1") == target
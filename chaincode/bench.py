@@ -0,0 +1,166 @@
+﻿"""Roda os microbenchmarks do certcc e compara resumos entre versões.
+
+    python bench.py run --label v1.2            # grava bench-results/v1.2/
+    python bench.py compare bench-results/v1.1/summary.json bench-results/v1.2/summary.json
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+CHAINCODE_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(CHAINCODE_DIR, "bench-results")
+# Métricas do resumo, na ordem da tabela de comparação
+METRICS = ("ns/op", "B/op", "allocs/op")
+
+# BenchmarkVerifyCert/size=small-8   200   20468 ns/op   20.13 MB/s   4584 B/op   65 allocs/op
+_BENCH_LINE = re.compile(r"^(Benchmark\S+?)(?:-\d+)?\s+(\d+)\s+(.*)$")
+_METRIC = re.compile(r"([\d.]+)\s+(\S+)")
+
+
+def parse_bench_output(text: str) -> dict:
+    """Amostras por benchmark ({nome: {métrica: [valores]}}) da saída do go test -bench"""
+    samples = {}
+    for line in text.splitlines():
+        match = _BENCH_LINE.match(line.strip())
+        if not match:
+            continue
+        name, _, rest = match.groups()
+        entry = samples.setdefault(name, {})
+        for value, unit in _METRIC.findall(rest):
+            entry.setdefault(unit, []).append(float(value))
+    return samples
+
+
+def summarize(samples: dict) -> dict:
+    """Mediana de cada métrica (robusta a execuções ruidosas) e o número de amostras"""
+    return {
+        name: dict({unit: statistics.median(values) for unit, values in metrics.items()},
+                   samples=len(metrics.get("ns/op", [])))
+        for name, metrics in samples.items()
+    }
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=CHAINCODE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def _pprof_top(binary: str, profile: str, extra: list) -> str:
+    result = subprocess.run(["go", "tool", "pprof", "-top", "-nodecount=25", *extra, binary, profile],
+                            cwd=CHAINCODE_DIR, capture_output=True, text=True)
+    return result.stdout if result.returncode == 0 else result.stderr
+
+
+def run(args) -> int:
+    out_dir = os.path.join(args.results_dir, args.label)
+    os.makedirs(out_dir, exist_ok=True)
+    binary = os.path.join(out_dir, "certcc.test")
+    cpu_profile = os.path.join(out_dir, "cpu.pprof")
+    mem_profile = os.path.join(out_dir, "mem.pprof")
+    command = [
+        "go", "test", "-run", "^$", "-bench", args.bench, "-benchmem",
+        "-count", str(args.count), "-benchtime", args.benchtime,
+        "-o", binary, "-cpuprofile", cpu_profile, "-memprofile", mem_profile,
+    ]
+    print(" ".join(command))
+    started = time.time()
+    result = subprocess.run(command, cwd=CHAINCODE_DIR, capture_output=True, text=True)
+    with open(os.path.join(out_dir, "bench.txt"), "w", encoding="utf-8") as f:
+        f.write(result.stdout)
+    if result.returncode != 0:
+        sys.stderr.write(result.stdout + result.stderr)
+        return result.returncode
+
+    summary = {
+        "label": args.label,
+        "revision": _git_revision(),
+        "startedAt": started,
+        "command": command,
+        "benchmarks": summarize(parse_bench_output(result.stdout)),
+    }
+    with open(os.path.join(out_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+    # funções mais caras em CPU e em bytes alocados, para ver onde o endosso gasta
+    with open(os.path.join(out_dir, "cpu_top.txt"), "w", encoding="utf-8") as f:
+        f.write(_pprof_top(binary, cpu_profile, []))
+    with open(os.path.join(out_dir, "alloc_top.txt"), "w", encoding="utf-8") as f:
+        f.write(_pprof_top(binary, mem_profile, ["-sample_index=alloc_space"]))
+
+    print(f"{len(summary['benchmarks'])} benchmarks -> {out_dir}")
+    return 0
+
+
+def _delta(base: float, new: float) -> float:
+    if base == 0:
+        return 0.0 if new == 0 else float("inf")
+    return 100.0 * (new - base) / base
+
+
+def compare(args) -> int:
+    with open(args.base, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+
+    print(f"base: {base['label']} ({base.get('revision') or '?'})  new: {new['label']} ({new.get('revision') or '?'})")
+    width = max((len(name) for name in new["benchmarks"]), default=10)
+    header = f"{'benchmark':<{width}}" + "".join(f"  {metric:>24}" for metric in METRICS)
+    print(header)
+    print("-" * len(header))
+
+    regressions = []
+    for name in sorted(set(base["benchmarks"]) | set(new["benchmarks"])):
+        before, after = base["benchmarks"].get(name), new["benchmarks"].get(name)
+        if before is None or after is None:
+            print(f"{name:<{width}}  {'(só em ' + ('new' if before is None else 'base') + ')':>24}")
+            continue
+        cells = []
+        for metric in METRICS:
+            if metric not in before or metric not in after:
+                cells.append(f"{'-':>24}")
+                continue
+            delta = _delta(before[metric], after[metric])
+            cells.append(f"{after[metric]:.0f} ({delta:+.1f}%)".rjust(24))
+            if delta > args.threshold:
+                regressions.append((name, metric, delta))
+        print(f"{name:<{width}}" + "".join(f"  {cell}" for cell in cells))
+
+    if regressions:
+        print(f"\n{len(regressions)} regressão(ões) acima de {args.threshold}%:")
+        for name, metric, delta in regressions:
+            print(f"  {name} {metric} {delta:+.1f}%")
+        return 1
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Microbenchmarks e perfis de CPU/alocação do certcc")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="Roda os benchmarks e grava resumo, saída crua e perfis")
+    run_parser.add_argument("--label", required=True, help="Nome da versão (subdiretório do resultado)")
+    run_parser.add_argument("--bench", default=".", help="Regex de benchmarks (go test -bench)")
+    run_parser.add_argument("--count", type=int, default=5, help="Repetições de cada benchmark (mediana no resumo)")
+    run_parser.add_argument("--benchtime", default="1s", help="Duração ou iterações (ex.: 1s, 500x)")
+    run_parser.add_argument("--results-dir", default=RESULTS_DIR)
+    run_parser.set_defaults(func=run)
+
+    compare_parser = sub.add_parser("compare", help="Compara dois summary.json; sai com 1 se houver regressão")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=5.0, help="Piora máxima tolerada (%%)")
+    compare_parser.set_defaults(func=compare)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    sys.exit(args.func(args))
@@ -1,10 +1,12 @@
 ﻿package main
 
 import (
+	"bytes"
 	"crypto/sha256"
 	"encoding/hex"
 	"encoding/json"
 	"fmt"
+	"io"
 	"strings"
 	"time"
 
@@ -27,6 +29,58 @@ type CertRecord struct {
 	Source    string            `json:"source"` // ex: "Cartorio X"
 }
 
+// CertChangedEventName é o nome do evento de chaincode emitido a cada registro/atualização
+const CertChangedEventName = "CertChanged"
+
+// certChangedEvent é o payload do evento CertChanged (apenas dados públicos)
+type certChangedEvent struct {
+	ID     string `json:"id"`
+	Source string `json:"source"`
+	Action string `json:"action"` // "register" ou "update"
+	Hash   string `json:"hash"`
+}
+
+// IdempotencyObjectType prefixa as chaves compostas com o resultado das escritas idempotentes
+// (fora do intervalo de chaves simples lido por ListCerts)
+const IdempotencyObjectType = "idem"
+
+// ChangeObjectType prefixa o índice de alterações (changed, hora, id) gravado a cada escrita;
+// ListChangedCerts o lê para a varredura incremental de integridade não percorrer todos os registros
+// e PruneChanges remove as horas antigas, junto com os resultados de idempotência listados nelas
+const ChangeObjectType = "changed"
+
+// changeBucketLayout agrupa o índice de alterações por hora (UTC) do timestamp da transação
+const changeBucketLayout = "2006010215"
+
+// PIICollection é a coleção de dados privados com os dados pessoais dos registros off-ledger
+const PIICollection = "certPII"
+
+// privateHashVersion identifica o hash canônico com salt dos registros off-ledger
+const privateHashVersion = "v2"
+
+// CertPublic é o que fica no estado público de um registro off-ledger
+type CertPublic struct {
+	ID        string `json:"id"`
+	Hash      string `json:"hash"`
+	Owner     string `json:"owner"`
+	Timestamp string `json:"timestamp"`
+	Source    string `json:"source"`
+	Private   bool   `json:"private"`
+}
+
+// CertPII são os dados pessoais de um registro off-ledger, guardados em PIICollection.
+// O salt entra no hash canônico para que o hash público não permita adivinhar os dados.
+type CertPII struct {
+	Name         string            `json:"name"`
+	DateOfBirth  string            `json:"dateOfBirth"`
+	TimeOfBirth  string            `json:"timeOfBirth"`
+	PlaceOfBirth string            `json:"placeOfBirth"`
+	FatherName   string            `json:"fatherName"`
+	MotherName   string            `json:"motherName"`
+	Metadata     map[string]string `json:"metadata"`
+	Salt         string            `json:"salt"`
+}
+
 // SmartContract fornece o contrato
 type SmartContract struct {
 	contractapi.Contract
@@ -69,20 +123,23 @@ func (s *SmartContract) RegisterCert(
 	owner string,
 	source string,
 	metadataJSON string,
-) error {
+) (string, error) {
+	if out, found, err := replayWrite(ctx); err != nil || found {
+		return out, err
+	}
 
 	exists, err := ctx.GetStub().GetState(id)
 	if err != nil {
-		return fmt.Errorf("falha ao checar estado: %v", err)
+		return "", fmt.Errorf("falha ao checar estado: %v", err)
 	}
 	if exists != nil {
-		return fmt.Errorf("registro com id %s já existe", id)
+		return "", fmt.Errorf("registro com id %s já existe", id)
 	}
 
 	var metadata map[string]string
 	if len(metadataJSON) > 0 {
 		if err := json.Unmarshal([]byte(metadataJSON), &metadata); err != nil {
-			return fmt.Errorf("metadata JSON inválido: %v", err)
+			return "", fmt.Errorf("metadata JSON inválido: %v", err)
 		}
 	} else {
 		metadata = map[string]string{}
@@ -109,10 +166,13 @@ func (s *SmartContract) RegisterCert(
 
 	b, err := json.Marshal(rec)
 	if err != nil {
-		return err
+		return "", err
 	}
 
-	return ctx.GetStub().PutState(id, b)
+	if err := ctx.GetStub().PutState(id, b); err != nil {
+		return "", err
+	}
+	return finishWrite(ctx, "register", &rec)
 }
 
 // VerifyCert retorna o registro e compara o hash canônico
@@ -132,6 +192,9 @@ func (s *SmartContract) VerifyCert(
 	if err := json.Unmarshal(b, &rec); err != nil {
 		return "", err
 	}
+	if isPrivateRecord(b) {
+		return verifyPrivateCert(ctx, &rec)
+	}
 
 	// recalcula hash canônico a partir dos campos on-chain
 	version := "v1"
@@ -187,6 +250,85 @@ func (s *SmartContract) GetHistory(ctx contractapi.TransactionContextInterface,
 	return string(out), nil
 }
 
+// ListCerts devolve uma página de registros em ordem de chave (varredura de integridade).
+// args: bookmark (vazio na primeira página), pageSize
+func (s *SmartContract) ListCerts(ctx contractapi.TransactionContextInterface, bookmark string, pageSize int32) (string, error) {
+	if pageSize <= 0 {
+		return "", fmt.Errorf("pageSize deve ser positivo")
+	}
+	resultsIterator, meta, err := ctx.GetStub().GetStateByRangeWithPagination("", "", pageSize, bookmark)
+	if err != nil {
+		return "", err
+	}
+	defer resultsIterator.Close()
+
+	page := certPage{Records: []json.RawMessage{}}
+	for resultsIterator.HasNext() {
+		kv, err := resultsIterator.Next()
+		if err != nil {
+			return "", err
+		}
+		page.Records = append(page.Records, json.RawMessage(kv.Value))
+	}
+	page.Bookmark = meta.Bookmark
+	page.Count = meta.FetchedRecordsCount
+
+	out, err := json.Marshal(page)
+	if err != nil {
+		return "", err
+	}
+	return string(out), nil
+}
+
+// certPage é a página devolvida por ListCerts e ListChangedCerts
+type certPage struct {
+	Records  []json.RawMessage `json:"records"`
+	Bookmark string            `json:"bookmark"`
+	Count    int32             `json:"count"`
+}
+
+// ListChangedCerts lista, paginado, o estado atual dos registros alterados numa hora (UTC, AAAAMMDDHH).
+// Cada registro aparece uma vez por hora (entradas antigas, com txId na chave, podem repetir entre páginas).
+func (s *SmartContract) ListChangedCerts(ctx contractapi.TransactionContextInterface, bucket string, bookmark string, pageSize int32) (string, error) {
+	if pageSize <= 0 {
+		return "", fmt.Errorf("pageSize deve ser positivo")
+	}
+	resultsIterator, meta, err := ctx.GetStub().GetStateByPartialCompositeKeyWithPagination(ChangeObjectType, []string{bucket}, pageSize, bookmark)
+	if err != nil {
+		return "", err
+	}
+	defer resultsIterator.Close()
+
+	page := certPage{Records: []json.RawMessage{}}
+	seen := map[string]bool{}
+	for resultsIterator.HasNext() {
+		kv, err := resultsIterator.Next()
+		if err != nil {
+			return "", err
+		}
+		_, attrs, err := ctx.GetStub().SplitCompositeKey(kv.Key)
+		if err != nil || len(attrs) < 2 || seen[attrs[1]] {
+			continue
+		}
+		seen[attrs[1]] = true
+		b, err := ctx.GetStub().GetState(attrs[1])
+		if err != nil {
+			return "", fmt.Errorf("erro GetState: %v", err)
+		}
+		if b != nil {
+			page.Records = append(page.Records, json.RawMessage(b))
+		}
+	}
+	page.Bookmark = meta.Bookmark
+	page.Count = meta.FetchedRecordsCount
+
+	out, err := json.Marshal(page)
+	if err != nil {
+		return "", err
+	}
+	return string(out), nil
+}
+
 func main() {
 	chaincode, err := contractapi.NewChaincode(new(SmartContract))
 	if err != nil {
@@ -202,21 +344,127 @@ func main() {
 // re-calcula o hash canônico após a alteração.
 // args: id, fieldName, newValue
 // fieldName aceitáveis: name, dateOfBirth, timeOfBirth, placeOfBirth, fatherName, motherName, owner, source
-func (s *SmartContract) UpdateCert(ctx contractapi.TransactionContextInterface, id string, fieldName string, newValue string) error {
+func (s *SmartContract) UpdateCert(ctx contractapi.TransactionContextInterface, id string, fieldName string, newValue string) (string, error) {
+	if out, found, err := replayWrite(ctx); err != nil || found {
+		return out, err
+	}
+
 	b, err := ctx.GetStub().GetState(id)
 	if err != nil {
-		return fmt.Errorf("erro GetState: %v", err)
+		return "", fmt.Errorf("erro GetState: %v", err)
 	}
 	if b == nil {
-		return fmt.Errorf("registro %s não encontrado", id)
+		return "", fmt.Errorf("registro %s não encontrado", id)
+	}
+
+	if isPrivateRecord(b) {
+		return "", fmt.Errorf("registro %s é off-ledger: use UpdateCertPrivate", id)
 	}
 
 	var rec CertRecord
 	if err := json.Unmarshal(b, &rec); err != nil {
-		return err
+		return "", err
+	}
+
+	if err := applyCertField(&rec, fieldName, newValue); err != nil {
+		return "", err
+	}
+
+	return putUpdatedCert(ctx, id, &rec)
+}
+
+// UpdateCertBatch aplica várias alterações de campo em uma única transação,
+// com um só recálculo do hash canônico e uma só entrada no histórico.
+// args: id, updatesJSON (objeto {"fieldName": "newValue", ...})
+// Se qualquer campo for inválido nenhuma alteração é gravada.
+func (s *SmartContract) UpdateCertBatch(ctx contractapi.TransactionContextInterface, id string, updatesJSON string) (string, error) {
+	if out, found, err := replayWrite(ctx); err != nil || found {
+		return out, err
+	}
+
+	updates, err := parseUpdates([]byte(updatesJSON))
+	if err != nil {
+		return "", err
+	}
+
+	b, err := ctx.GetStub().GetState(id)
+	if err != nil {
+		return "", fmt.Errorf("erro GetState: %v", err)
+	}
+	if b == nil {
+		return "", fmt.Errorf("registro %s não encontrado", id)
 	}
 
-	switch strings.ToLower(strings.TrimSpace(fieldName)) {
+	if isPrivateRecord(b) {
+		return "", fmt.Errorf("registro %s é off-ledger: use UpdateCertPrivate", id)
+	}
+
+	var rec CertRecord
+	if err := json.Unmarshal(b, &rec); err != nil {
+		return "", err
+	}
+
+	for _, update := range updates {
+		if err := applyCertField(&rec, update.Field, update.Value); err != nil {
+			return "", err
+		}
+	}
+
+	return putUpdatedCert(ctx, id, &rec)
+}
+
+// fieldUpdate é uma alteração de campo, na ordem em que aparece no JSON
+type fieldUpdate struct {
+	Field string
+	Value string
+}
+
+// fieldKey é o nome do campo como applyCertField o compara
+func fieldKey(fieldName string) string {
+	return strings.ToLower(strings.TrimSpace(fieldName))
+}
+
+// parseUpdates decodifica {"campo": "valor", ...} preservando a ordem e recusa campos repetidos,
+// inclusive nomes que só diferem em maiúsculas/espaços ("name" e "Name"). Num map Go a ordem de
+// aplicação variaria entre endossantes e o valor final do campo também.
+func parseUpdates(raw []byte) ([]fieldUpdate, error) {
+	dec := json.NewDecoder(bytes.NewReader(raw))
+	if tok, err := dec.Token(); err != nil || tok != json.Delim('{') {
+		return nil, fmt.Errorf("updates JSON inválido: esperado um objeto")
+	}
+	var updates []fieldUpdate
+	seen := map[string]bool{}
+	for dec.More() {
+		tok, err := dec.Token()
+		if err != nil {
+			return nil, fmt.Errorf("updates JSON inválido: %v", err)
+		}
+		fieldName, _ := tok.(string)
+		var newValue string
+		if err := dec.Decode(&newValue); err != nil {
+			return nil, fmt.Errorf("updates JSON inválido: %v", err)
+		}
+		if seen[fieldKey(fieldName)] {
+			return nil, fmt.Errorf("campo %s informado mais de uma vez", fieldName)
+		}
+		seen[fieldKey(fieldName)] = true
+		updates = append(updates, fieldUpdate{Field: fieldName, Value: newValue})
+	}
+	if _, err := dec.Token(); err != nil {
+		return nil, fmt.Errorf("updates JSON inválido: %v", err)
+	}
+	if _, err := dec.Token(); err != io.EOF {
+		return nil, fmt.Errorf("updates JSON inválido: conteúdo após o objeto")
+	}
+	if len(updates) == 0 {
+		return nil, fmt.Errorf("nenhum campo informado para atualização")
+	}
+	return updates, nil
+}
+
+// applyCertField altera um campo atualizável do registro em memória
+func applyCertField(rec *CertRecord, fieldName string, newValue string) error {
+	switch fieldKey(fieldName) {
 	case "name":
 		rec.Name = newValue
 	case "dateofbirth":
@@ -236,14 +484,512 @@ func (s *SmartContract) UpdateCert(ctx contractapi.TransactionContextInterface,
 	default:
 		return fmt.Errorf("campo %s não pode ser atualizado", fieldName)
 	}
+	return nil
+}
 
-	// recomputa hash canônico (mantendo versão v1)
+// putUpdatedCert recomputa o hash canônico (mantendo versão v1) e grava o registro
+func putUpdatedCert(ctx contractapi.TransactionContextInterface, id string, rec *CertRecord) (string, error) {
 	rec.Hash = computeCertHash(rec.Name, rec.DateOfBirth, rec.TimeOfBirth, rec.PlaceOfBirth, rec.FatherName, rec.MotherName, "v1")
 	rec.Timestamp = time.Now().UTC().Format(time.RFC3339)
 
 	updated, err := json.Marshal(rec)
+	if err != nil {
+		return "", err
+	}
+	if err := ctx.GetStub().PutState(id, updated); err != nil {
+		return "", err
+	}
+	return finishWrite(ctx, "update", rec)
+}
+
+// writeResult é o retorno das funções de escrita; o backend o usa para emitir recibos de verificação
+type writeResult struct {
+	TxID string `json:"txId"`
+	Hash string `json:"hash"`
+}
+
+// finishWrite emite o evento CertChanged, indexa a alteração e devolve txId e hash canônico gravados.
+// Com chave de idempotência, o resultado também fica gravado para reenvios e consultas.
+func finishWrite(ctx contractapi.TransactionContextInterface, action string, rec *CertRecord) (string, error) {
+	if err := emitCertChanged(ctx, action, rec); err != nil {
+		return "", err
+	}
+	out, err := json.Marshal(writeResult{TxID: ctx.GetStub().GetTxID(), Hash: rec.Hash})
+	if err != nil {
+		return "", err
+	}
+	key, fingerprint, err := currentIdempotency(ctx)
+	if err != nil {
+		return "", err
+	}
+	if err := indexChange(ctx, rec.ID, key); err != nil {
+		return "", err
+	}
+	if key != "" {
+		stored, err := json.Marshal(idempotencyRecord{Result: out, Fingerprint: fingerprint})
+		if err != nil {
+			return "", err
+		}
+		if err := ctx.GetStub().PutState(key, stored); err != nil {
+			return "", err
+		}
+	}
+	return string(out), nil
+}
+
+// idempotencyRecord é o que fica gravado para uma chave de idempotência: o resultado da escrita
+// e a impressão da requisição, para recusar a mesma chave usada com outro conteúdo
+type idempotencyRecord struct {
+	Result      json.RawMessage `json:"result"`
+	Fingerprint string          `json:"fingerprint"`
+}
+
+// idempotencyStateKey é a chave composta (idem, função, id, chave de idempotência) do resultado
+func idempotencyStateKey(ctx contractapi.TransactionContextInterface, fcn string, id string, idempotencyKey string) (string, error) {
+	return ctx.GetStub().CreateCompositeKey(IdempotencyObjectType, []string{fcn, id, idempotencyKey})
+}
+
+// currentIdempotency devolve a chave composta e a impressão da escrita em andamento ("" sem o campo
+// transiente "idempotencyKey"). A impressão vem do campo transiente "idempotencyFingerprint" (o backend
+// a calcula sem os salts aleatórios) ou, se ausente, é o SHA-256 da função e dos argumentos.
+func currentIdempotency(ctx contractapi.TransactionContextInterface) (string, string, error) {
+	transient, err := ctx.GetStub().GetTransient()
+	if err != nil {
+		return "", "", fmt.Errorf("erro GetTransient: %v", err)
+	}
+	idempotencyKey := string(transient["idempotencyKey"])
+	if idempotencyKey == "" {
+		return "", "", nil
+	}
+	fcn, params := ctx.GetStub().GetFunctionAndParameters()
+	if len(params) == 0 {
+		return "", "", fmt.Errorf("escrita idempotente sem id")
+	}
+	fingerprint := string(transient["idempotencyFingerprint"])
+	if fingerprint == "" {
+		args, err := json.Marshal(append([]string{fcn}, params...))
+		if err != nil {
+			return "", "", err
+		}
+		sum := sha256.Sum256(args)
+		fingerprint = hex.EncodeToString(sum[:])
+	}
+	key, err := idempotencyStateKey(ctx, fcn, params[0], idempotencyKey)
+	return key, fingerprint, err
+}
+
+// storedWrite lê o resultado gravado em key; erro se a chave foi usada por outra requisição
+func storedWrite(ctx contractapi.TransactionContextInterface, key string, fingerprint string) (string, bool, error) {
+	b, err := ctx.GetStub().GetState(key)
+	if err != nil {
+		return "", false, fmt.Errorf("erro GetState: %v", err)
+	}
+	if b == nil {
+		return "", false, nil
+	}
+	var rec idempotencyRecord
+	if err := json.Unmarshal(b, &rec); err != nil {
+		return "", false, fmt.Errorf("resultado de idempotência inválido: %v", err)
+	}
+	if rec.Fingerprint != fingerprint {
+		return "", false, fmt.Errorf("chave de idempotência já usada com outra requisição")
+	}
+	return string(rec.Result), true, nil
+}
+
+// replayWrite devolve o resultado gravado quando a chave de idempotência já foi usada numa escrita
+// confirmada da mesma função, do mesmo id e com a mesma impressão; assim um reenvio não escreve de
+// novo nem falha com "já existe". A mesma chave com outro conteúdo é recusada.
+func replayWrite(ctx contractapi.TransactionContextInterface) (string, bool, error) {
+	key, fingerprint, err := currentIdempotency(ctx)
+	if err != nil || key == "" {
+		return "", false, err
+	}
+	return storedWrite(ctx, key, fingerprint)
+}
+
+// GetWriteResult devolve {txId, hash} da escrita fcn(id) feita com a chave de idempotência, se confirmada;
+// erro se a chave foi usada com outra impressão
+func (s *SmartContract) GetWriteResult(ctx contractapi.TransactionContextInterface, fcn string, id string, idempotencyKey string, fingerprint string) (string, error) {
+	if idempotencyKey == "" {
+		return "", fmt.Errorf("chave de idempotência vazia")
+	}
+	key, err := idempotencyStateKey(ctx, fcn, id, idempotencyKey)
+	if err != nil {
+		return "", err
+	}
+	out, found, err := storedWrite(ctx, key, fingerprint)
+	if err != nil {
+		return "", err
+	}
+	if !found {
+		return "", fmt.Errorf("resultado da chave %s não encontrado", idempotencyKey)
+	}
+	return out, nil
+}
+
+// emitCertChanged publica o evento CertChanged (um por transação, como exige o Fabric)
+func emitCertChanged(ctx contractapi.TransactionContextInterface, action string, rec *CertRecord) error {
+	payload, err := json.Marshal(certChangedEvent{
+		ID:     rec.ID,
+		Source: rec.Source,
+		Action: action,
+		Hash:   rec.Hash,
+	})
+	if err != nil {
+		return err
+	}
+	return ctx.GetStub().SetEvent(CertChangedEventName, payload)
+}
+
+// indexChange grava a chave composta (changed, hora da transação, id): várias escritas do mesmo
+// registro na mesma hora ocupam uma única entrada. O valor lista as chaves de estado dos resultados
+// de idempotência gravados nessa hora, para PruneChanges removê-los junto com a entrada.
+func indexChange(ctx contractapi.TransactionContextInterface, id string, idempotencyStateKey string) error {
+	ts, err := ctx.GetStub().GetTxTimestamp()
+	if err != nil {
+		return err
+	}
+	bucket := time.Unix(ts.Seconds, int64(ts.Nanos)).UTC().Format(changeBucketLayout)
+	key, err := ctx.GetStub().CreateCompositeKey(ChangeObjectType, []string{bucket, id})
 	if err != nil {
 		return err
 	}
-	return ctx.GetStub().PutState(id, updated)
+	results, err := indexedResults(ctx, key)
+	if err != nil {
+		return err
+	}
+	if idempotencyStateKey != "" {
+		results = append(results, idempotencyStateKey)
+	}
+	// nunca vazio: PutState com valor vazio apaga a chave
+	value, err := json.Marshal(results)
+	if err != nil {
+		return err
+	}
+	return ctx.GetStub().PutState(key, value)
+}
+
+// indexedResults lê as chaves de idempotência listadas numa entrada do índice (vazia se não houver)
+func indexedResults(ctx contractapi.TransactionContextInterface, key string) ([]string, error) {
+	b, err := ctx.GetStub().GetState(key)
+	if err != nil {
+		return nil, fmt.Errorf("erro GetState: %v", err)
+	}
+	results := []string{}
+	if b != nil {
+		// entradas antigas (valor sem lista) não têm resultados associados
+		_ = json.Unmarshal(b, &results)
+	}
+	return results, nil
+}
+
+// pruneResult é o retorno de PruneChanges
+type pruneResult struct {
+	TxID   string `json:"txId"`
+	Pruned int32  `json:"pruned"`
+	More   bool   `json:"more"`
+}
+
+// PruneChanges remove até limit entradas do índice de alterações com hora anterior a before
+// (AAAAMMDDHH), junto com os resultados de idempotência gravados nelas. more indica que ainda
+// há entradas antigas; o chamador repete até more ser false.
+func (s *SmartContract) PruneChanges(ctx contractapi.TransactionContextInterface, before string, limit int32) (string, error) {
+	if len(before) != len(changeBucketLayout) {
+		return "", fmt.Errorf("hora inválida: %s", before)
+	}
+	if limit <= 0 {
+		return "", fmt.Errorf("limit deve ser positivo")
+	}
+	resultsIterator, err := ctx.GetStub().GetStateByPartialCompositeKey(ChangeObjectType, []string{})
+	if err != nil {
+		return "", err
+	}
+	defer resultsIterator.Close()
+
+	out := pruneResult{TxID: ctx.GetStub().GetTxID()}
+	// as chaves vêm em ordem (hora primeiro): para na primeira hora que deve ficar
+	for resultsIterator.HasNext() {
+		kv, err := resultsIterator.Next()
+		if err != nil {
+			return "", err
+		}
+		_, attrs, err := ctx.GetStub().SplitCompositeKey(kv.Key)
+		if err != nil {
+			return "", err
+		}
+		if len(attrs) == 0 || attrs[0] >= before {
+			break
+		}
+		if out.Pruned == limit {
+			out.More = true
+			break
+		}
+		var results []string
+		_ = json.Unmarshal(kv.Value, &results)
+		for _, resultKey := range results {
+			if err := ctx.GetStub().DelState(resultKey); err != nil {
+				return "", err
+			}
+		}
+		if err := ctx.GetStub().DelState(kv.Key); err != nil {
+			return "", err
+		}
+		out.Pruned++
+	}
+
+	b, err := json.Marshal(out)
+	if err != nil {
+		return "", err
+	}
+	return string(b), nil
+}
+
+// isPrivateRecord indica se o valor do estado público é de um registro off-ledger
+func isPrivateRecord(b []byte) bool {
+	var pub CertPublic
+	return json.Unmarshal(b, &pub) == nil && pub.Private
+}
+
+// computePrivateCertHash é o hash canônico com salt dos registros off-ledger
+func computePrivateCertHash(rec *CertRecord, salt string) string {
+	return computeCertHash(rec.Name, rec.DateOfBirth, rec.TimeOfBirth, rec.PlaceOfBirth, rec.FatherName, rec.MotherName, privateHashVersion+"|"+salt)
+}
+
+// txTimestamp é o horário da transação (igual em todos os endossantes, ao contrário de time.Now)
+func txTimestamp(ctx contractapi.TransactionContextInterface) (string, error) {
+	ts, err := ctx.GetStub().GetTxTimestamp()
+	if err != nil {
+		return "", err
+	}
+	return time.Unix(ts.Seconds, int64(ts.Nanos)).UTC().Format(time.RFC3339), nil
+}
+
+// transientField lê um campo do transient map (dados que não vão para a transação nem para a ledger)
+func transientField(ctx contractapi.TransactionContextInterface, key string) ([]byte, error) {
+	transient, err := ctx.GetStub().GetTransient()
+	if err != nil {
+		return nil, fmt.Errorf("erro GetTransient: %v", err)
+	}
+	value, ok := transient[key]
+	if !ok || len(value) == 0 {
+		return nil, fmt.Errorf("campo transiente %s ausente", key)
+	}
+	return value, nil
+}
+
+// loadPII completa o registro com os dados pessoais da coleção privada e devolve o salt
+func loadPII(ctx contractapi.TransactionContextInterface, rec *CertRecord) (string, error) {
+	b, err := ctx.GetStub().GetPrivateData(PIICollection, rec.ID)
+	if err != nil {
+		return "", fmt.Errorf("erro GetPrivateData: %v", err)
+	}
+	if b == nil {
+		return "", fmt.Errorf("dados pessoais de %s indisponíveis neste peer", rec.ID)
+	}
+	var pii CertPII
+	if err := json.Unmarshal(b, &pii); err != nil {
+		return "", err
+	}
+	rec.Name = pii.Name
+	rec.DateOfBirth = pii.DateOfBirth
+	rec.TimeOfBirth = pii.TimeOfBirth
+	rec.PlaceOfBirth = pii.PlaceOfBirth
+	rec.FatherName = pii.FatherName
+	rec.MotherName = pii.MotherName
+	rec.Metadata = pii.Metadata
+	return pii.Salt, nil
+}
+
+// putPrivateCert grava só id/hash/owner/source/timestamp no estado público e os dados pessoais na coleção
+func putPrivateCert(ctx contractapi.TransactionContextInterface, action string, rec *CertRecord, salt string) (string, error) {
+	rec.Hash = computePrivateCertHash(rec, salt)
+
+	pub, err := json.Marshal(CertPublic{
+		ID:        rec.ID,
+		Hash:      rec.Hash,
+		Owner:     rec.Owner,
+		Timestamp: rec.Timestamp,
+		Source:    rec.Source,
+		Private:   true,
+	})
+	if err != nil {
+		return "", err
+	}
+	pii, err := json.Marshal(CertPII{
+		Name:         rec.Name,
+		DateOfBirth:  rec.DateOfBirth,
+		TimeOfBirth:  rec.TimeOfBirth,
+		PlaceOfBirth: rec.PlaceOfBirth,
+		FatherName:   rec.FatherName,
+		MotherName:   rec.MotherName,
+		Metadata:     rec.Metadata,
+		Salt:         salt,
+	})
+	if err != nil {
+		return "", err
+	}
+
+	if err := ctx.GetStub().PutState(rec.ID, pub); err != nil {
+		return "", err
+	}
+	if err := ctx.GetStub().PutPrivateData(PIICollection, rec.ID, pii); err != nil {
+		return "", err
+	}
+	return finishWrite(ctx, action, rec)
+}
+
+// RegisterCertPrivate registra um certificado off-ledger.
+// args: id, owner, source
+// transient "pii": CertPII em JSON (dados pessoais + salt gerado pelo cliente)
+func (s *SmartContract) RegisterCertPrivate(ctx contractapi.TransactionContextInterface, id string, owner string, source string) (string, error) {
+	if out, found, err := replayWrite(ctx); err != nil || found {
+		return out, err
+	}
+
+	exists, err := ctx.GetStub().GetState(id)
+	if err != nil {
+		return "", fmt.Errorf("falha ao checar estado: %v", err)
+	}
+	if exists != nil {
+		return "", fmt.Errorf("registro com id %s já existe", id)
+	}
+
+	piiJSON, err := transientField(ctx, "pii")
+	if err != nil {
+		return "", err
+	}
+	var pii CertPII
+	if err := json.Unmarshal(piiJSON, &pii); err != nil {
+		return "", fmt.Errorf("pii JSON inválido: %v", err)
+	}
+	if pii.Salt == "" {
+		return "", fmt.Errorf("salt ausente nos dados pessoais")
+	}
+	if pii.Metadata == nil {
+		pii.Metadata = map[string]string{}
+	}
+
+	timestamp, err := txTimestamp(ctx)
+	if err != nil {
+		return "", err
+	}
+	rec := CertRecord{
+		ID:           id,
+		Name:         pii.Name,
+		DateOfBirth:  pii.DateOfBirth,
+		TimeOfBirth:  pii.TimeOfBirth,
+		PlaceOfBirth: pii.PlaceOfBirth,
+		FatherName:   pii.FatherName,
+		MotherName:   pii.MotherName,
+		Owner:        owner,
+		Timestamp:    timestamp,
+		Metadata:     pii.Metadata,
+		Source:       source,
+	}
+	return putPrivateCert(ctx, "register", &rec, pii.Salt)
+}
+
+// UpdateCertPrivate aplica alterações de campo a um registro off-ledger numa única transação.
+// Um registro público (legado) é migrado para off-ledger usando o salt enviado.
+// args: id
+// transient "updates": objeto {"fieldName": "newValue", ...}; "salt": usado só na migração
+func (s *SmartContract) UpdateCertPrivate(ctx contractapi.TransactionContextInterface, id string) (string, error) {
+	if out, found, err := replayWrite(ctx); err != nil || found {
+		return out, err
+	}
+
+	updatesJSON, err := transientField(ctx, "updates")
+	if err != nil {
+		return "", err
+	}
+	updates, err := parseUpdates(updatesJSON)
+	if err != nil {
+		return "", err
+	}
+
+	b, err := ctx.GetStub().GetState(id)
+	if err != nil {
+		return "", fmt.Errorf("erro GetState: %v", err)
+	}
+	if b == nil {
+		return "", fmt.Errorf("registro %s não encontrado", id)
+	}
+	var rec CertRecord
+	if err := json.Unmarshal(b, &rec); err != nil {
+		return "", err
+	}
+
+	var salt string
+	if isPrivateRecord(b) {
+		if salt, err = loadPII(ctx, &rec); err != nil {
+			return "", err
+		}
+	} else {
+		saltBytes, err := transientField(ctx, "salt")
+		if err != nil {
+			return "", err
+		}
+		salt = string(saltBytes)
+	}
+
+	for _, update := range updates {
+		if err := applyCertField(&rec, update.Field, update.Value); err != nil {
+			return "", err
+		}
+	}
+	if rec.Timestamp, err = txTimestamp(ctx); err != nil {
+		return "", err
+	}
+	return putPrivateCert(ctx, "update", &rec, salt)
+}
+
+// GetCertPII devolve o registro completo, com os dados pessoais.
+// A leitura da coleção só é permitida a membros dela (memberOnlyRead).
+func (s *SmartContract) GetCertPII(ctx contractapi.TransactionContextInterface, id string) (string, error) {
+	b, err := ctx.GetStub().GetState(id)
+	if err != nil {
+		return "", fmt.Errorf("erro GetState: %v", err)
+	}
+	if b == nil {
+		return "", fmt.Errorf("registro %s não encontrado", id)
+	}
+	var rec CertRecord
+	if err := json.Unmarshal(b, &rec); err != nil {
+		return "", err
+	}
+	if isPrivateRecord(b) {
+		if _, err := loadPII(ctx, &rec); err != nil {
+			return "", err
+		}
+	}
+	out, err := json.Marshal(rec)
+	if err != nil {
+		return "", err
+	}
+	return string(out), nil
+}
+
+// verifyPrivateCert confere um registro off-ledger recomputando o hash a partir da coleção
+// privada, mas devolve só os campos públicos
+func verifyPrivateCert(ctx contractapi.TransactionContextInterface, rec *CertRecord) (string, error) {
+	pub := CertPublic{ID: rec.ID, Hash: rec.Hash, Owner: rec.Owner, Timestamp: rec.Timestamp, Source: rec.Source, Private: true}
+	resp := map[string]interface{}{
+		"found":   true,
+		"record":  pub,
+		"private": true,
+	}
+
+	salt, err := loadPII(ctx, rec)
+	if err != nil {
+		resp["hashMatch"] = false
+		resp["hashCheckExplanation"] = fmt.Sprintf("Não foi possível recomputar o hash: %v", err)
+	} else {
+		expectedHash := computePrivateCertHash(rec, salt)
+		resp["hashMatch"] = expectedHash == rec.Hash
+		resp["hashCheckExplanation"] = fmt.Sprintf("Hash recomputado a partir dos dados pessoais da coleção %s: %s", PIICollection, expectedHash)
+	}
+
+	out, _ := json.Marshal(resp)
+	return string(out), nil
 }
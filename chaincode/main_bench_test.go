@@ -0,0 +1,291 @@
+﻿package main
+
+// Microbenchmarks das funções do certcc executadas a cada transação em cada peer endossante.
+//
+//	go test -run '^$' -bench . -benchmem -cpuprofile cpu.pprof -memprofile mem.pprof
+//
+// ou, para gravar um resumo comparável entre versões, python bench.py run --label <versão>.
+
+import (
+	"encoding/json"
+	"fmt"
+	"strings"
+	"testing"
+
+	"github.com/hyperledger/fabric-chaincode-go/shim"
+	"github.com/hyperledger/fabric-chaincode-go/shimtest"
+	"github.com/hyperledger/fabric-contract-api-go/contractapi"
+	"github.com/hyperledger/fabric-protos-go/ledger/queryresult"
+)
+
+// benchStub é o MockStub do shimtest com histórico por chave (GetHistoryForKey não é
+// implementado no mock) e sem o canal de eventos, que bloqueia depois de 100 eventos
+type benchStub struct {
+	*shimtest.MockStub
+	history map[string][]*queryresult.KeyModification
+	txSeq   int
+}
+
+func newBenchStub() *benchStub {
+	return &benchStub{
+		MockStub: shimtest.NewMockStub("certcc", nil),
+		history:  map[string][]*queryresult.KeyModification{},
+	}
+}
+
+// PutState grava direto no mapa: o PutState do mock mantém uma lista ordenada de chaves (O(n) por chave nova)
+func (s *benchStub) PutState(key string, value []byte) error {
+	s.State[key] = value
+	s.history[key] = append(s.history[key], &queryresult.KeyModification{
+		TxId:      s.TxID,
+		Value:     value,
+		Timestamp: s.TxTimestamp,
+	})
+	return nil
+}
+
+func (s *benchStub) SetEvent(name string, payload []byte) error {
+	return nil
+}
+
+func (s *benchStub) GetHistoryForKey(key string) (shim.HistoryQueryIteratorInterface, error) {
+	return &historyIterator{mods: s.history[key]}, nil
+}
+
+// begin/end delimitam uma transação simulada (txId e timestamp novos)
+func (s *benchStub) begin() {
+	s.txSeq++
+	s.MockTransactionStart(fmt.Sprintf("tx%d", s.txSeq))
+}
+
+func (s *benchStub) end() {
+	s.MockTransactionEnd(s.TxID)
+}
+
+// historyIterator devolve as modificações da mais recente para a mais antiga, como o peer
+type historyIterator struct {
+	mods []*queryresult.KeyModification
+	next int
+}
+
+func (it *historyIterator) HasNext() bool {
+	return it.next < len(it.mods)
+}
+
+func (it *historyIterator) Next() (*queryresult.KeyModification, error) {
+	mod := it.mods[len(it.mods)-1-it.next]
+	it.next++
+	return mod, nil
+}
+
+func (it *historyIterator) Close() error {
+	return nil
+}
+
+func newBenchContext(stub *benchStub) *contractapi.TransactionContext {
+	ctx := new(contractapi.TransactionContext)
+	ctx.SetStub(stub)
+	return ctx
+}
+
+// recordSize controla o tamanho do registro: nomes mais longos e mais entradas de metadata
+type recordSize struct {
+	name     string
+	repeat   int // repetições do texto base nos campos de nome/local
+	metadata int // entradas de metadata
+}
+
+var recordSizes = []recordSize{
+	{name: "small", repeat: 1, metadata: 0},
+	{name: "medium", repeat: 2, metadata: 8},
+	{name: "large", repeat: 4, metadata: 64},
+}
+
+var historyDepths = []int{1, 10, 100, 1000}
+
+// certArgs são os argumentos de RegisterCert para um registro do tamanho pedido
+type certArgs struct {
+	name, dateOfBirth, timeOfBirth, placeOfBirth, fatherName, motherName, owner, source, metadataJSON string
+}
+
+func newCertArgs(size recordSize) certArgs {
+	metadata := make(map[string]string, size.metadata)
+	for i := 0; i < size.metadata; i++ {
+		metadata[fmt.Sprintf("campo%02d", i)] = strings.Repeat("valor ", 10)
+	}
+	metadataJSON, _ := json.Marshal(metadata)
+	return certArgs{
+		name:         strings.Repeat("Maria  Aparecida dos Santos ", size.repeat),
+		dateOfBirth:  "2024-03-15",
+		timeOfBirth:  "14:32",
+		placeOfBirth: strings.Repeat("Hospital Santa Casa de Misericórdia ", size.repeat),
+		fatherName:   strings.Repeat("José Carlos de Oliveira ", size.repeat),
+		motherName:   strings.Repeat("Ana Paula dos Santos ", size.repeat),
+		owner:        "Cartório do 1º Ofício",
+		source:       "1234-5",
+		metadataJSON: string(metadataJSON),
+	}
+}
+
+func register(b *testing.B, cc *SmartContract, stub *benchStub, ctx *contractapi.TransactionContext, id string, args certArgs) {
+	stub.begin()
+	_, err := cc.RegisterCert(ctx, id, args.name, args.dateOfBirth, args.timeOfBirth, args.placeOfBirth,
+		args.fatherName, args.motherName, args.owner, args.source, args.metadataJSON)
+	stub.end()
+	if err != nil {
+		b.Fatal(err)
+	}
+}
+
+// seedCert registra um certificado e o atualiza até ter depth versões no histórico
+func seedCert(b *testing.B, cc *SmartContract, stub *benchStub, ctx *contractapi.TransactionContext, id string, size recordSize, depth int) {
+	register(b, cc, stub, ctx, id, newCertArgs(size))
+	for i := 1; i < depth; i++ {
+		stub.begin()
+		_, err := cc.UpdateCert(ctx, id, "owner", fmt.Sprintf("Cartório %d", i))
+		stub.end()
+		if err != nil {
+			b.Fatal(err)
+		}
+	}
+}
+
+func BenchmarkNormalize(b *testing.B) {
+	inputs := map[string]string{
+		"short": "Maria dos Santos",
+		"long":  strings.Repeat("  Maria   Aparecida\tdos  Santos ", 8),
+	}
+	for _, name := range []string{"short", "long"} {
+		input := inputs[name]
+		b.Run(name, func(b *testing.B) {
+			b.ReportAllocs()
+			for i := 0; i < b.N; i++ {
+				normalize(input)
+			}
+		})
+	}
+}
+
+func BenchmarkComputeCertHash(b *testing.B) {
+	for _, size := range recordSizes {
+		args := newCertArgs(size)
+		b.Run("size="+size.name, func(b *testing.B) {
+			b.ReportAllocs()
+			for i := 0; i < b.N; i++ {
+				computeCertHash(args.name, args.dateOfBirth, args.timeOfBirth, args.placeOfBirth, args.fatherName, args.motherName, "v1")
+			}
+		})
+	}
+}
+
+// BenchmarkTxOverhead mede só o begin/end do mock, incluído nos benchmarks de escrita
+func BenchmarkTxOverhead(b *testing.B) {
+	stub := newBenchStub()
+	b.ReportAllocs()
+	for i := 0; i < b.N; i++ {
+		stub.begin()
+		stub.end()
+	}
+}
+
+func BenchmarkRegisterCert(b *testing.B) {
+	for _, size := range recordSizes {
+		args := newCertArgs(size)
+		b.Run("size="+size.name, func(b *testing.B) {
+			cc := new(SmartContract)
+			stub := newBenchStub()
+			ctx := newBenchContext(stub)
+			b.ReportAllocs()
+			b.ResetTimer()
+			for i := 0; i < b.N; i++ {
+				register(b, cc, stub, ctx, fmt.Sprintf("CERT%09d", i), args)
+			}
+		})
+	}
+}
+
+func BenchmarkVerifyCert(b *testing.B) {
+	for _, size := range recordSizes {
+		b.Run("size="+size.name, func(b *testing.B) {
+			cc := new(SmartContract)
+			stub := newBenchStub()
+			ctx := newBenchContext(stub)
+			seedCert(b, cc, stub, ctx, "CERT001", size, 1)
+			b.SetBytes(int64(len(stub.State["CERT001"])))
+			b.ReportAllocs()
+			b.ResetTimer()
+			for i := 0; i < b.N; i++ {
+				if _, err := cc.VerifyCert(ctx, "CERT001"); err != nil {
+					b.Fatal(err)
+				}
+			}
+		})
+	}
+}
+
+func BenchmarkUpdateCert(b *testing.B) {
+	for _, size := range recordSizes {
+		b.Run("size="+size.name, func(b *testing.B) {
+			cc := new(SmartContract)
+			stub := newBenchStub()
+			ctx := newBenchContext(stub)
+			seedCert(b, cc, stub, ctx, "CERT001", size, 1)
+			values := []string{"Maria dos Santos", "Maria  dos Santos Oliveira"}
+			b.ReportAllocs()
+			b.ResetTimer()
+			for i := 0; i < b.N; i++ {
+				stub.begin()
+				_, err := cc.UpdateCert(ctx, "CERT001", "name", values[i%2])
+				stub.end()
+				if err != nil {
+					b.Fatal(err)
+				}
+			}
+		})
+	}
+}
+
+func BenchmarkUpdateCertBatch(b *testing.B) {
+	batches := []string{
+		`{"name": "Maria dos Santos", "fatherName": "José Oliveira", "placeOfBirth": "Hospital A"}`,
+		`{"name": "Maria S. Oliveira", "fatherName": "José C. Oliveira", "placeOfBirth": "Hospital B"}`,
+	}
+	for _, size := range recordSizes {
+		b.Run("size="+size.name, func(b *testing.B) {
+			cc := new(SmartContract)
+			stub := newBenchStub()
+			ctx := newBenchContext(stub)
+			seedCert(b, cc, stub, ctx, "CERT001", size, 1)
+			b.ReportAllocs()
+			b.ResetTimer()
+			for i := 0; i < b.N; i++ {
+				stub.begin()
+				_, err := cc.UpdateCertBatch(ctx, "CERT001", batches[i%2])
+				stub.end()
+				if err != nil {
+					b.Fatal(err)
+				}
+			}
+		})
+	}
+}
+
+func BenchmarkGetHistory(b *testing.B) {
+	for _, depth := range historyDepths {
+		for _, size := range []recordSize{recordSizes[0], recordSizes[len(recordSizes)-1]} {
+			b.Run(fmt.Sprintf("depth=%d/size=%s", depth, size.name), func(b *testing.B) {
+				cc := new(SmartContract)
+				stub := newBenchStub()
+				ctx := newBenchContext(stub)
+				seedCert(b, cc, stub, ctx, "CERT001", size, depth)
+				b.ReportAllocs()
+				b.ResetTimer()
+				for i := 0; i < b.N; i++ {
+					if _, err := cc.GetHistory(ctx, "CERT001"); err != nil {
+						b.Fatal(err)
+					}
+				}
+			})
+		}
+	}
+}
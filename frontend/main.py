@@ -1,8 +1,12 @@
 import streamlit as st
 import requests
 import json
+import math
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+from urllib.parse import quote
 from openai import OpenAI
 from dotenv import load_dotenv
 
@@ -10,8 +14,11 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # Configuração
-API_BASE_URL = "http://localhost:8000"  # URL do FastAPI backend
+API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8000")  # URL do FastAPI backend
+READ_CACHE_TTL = int(os.getenv("READ_CACHE_TTL", "30"))  # segundos que consultas ficam em cache
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))  # transações por página na linha do tempo
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+PII_API_KEY = os.getenv("PII_API_KEY")  # chave X-API-Key da área do cartório para ler dados pessoais off-ledger
 
 # Credenciais do cartório (em produção, use um banco de dados seguro)
 CARTORIO_USERS = {
@@ -116,15 +123,59 @@ Instruções:
         return None
 
 
+class UncachedResponse(Exception):
+    """Resposta de erro do backend que não deve ficar no cache de leitura"""
+
+    def __init__(self, payload: dict):
+        super().__init__(payload)
+        self.payload = payload
+
+
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    """Cria uma sessão HTTP keep-alive com pool de conexões, compartilhada entre reruns"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def post_api(path: str, payload: dict) -> dict:
+    """Envia um POST ao backend reaproveitando as conexões do pool"""
+    response = get_http_session().post(
+        f"{API_BASE_URL}{path}",
+        json=payload,
+        timeout=30
+    )
+    return response.json()
+
+
+def get_api(path: str, params: dict = None) -> dict:
+    """Envia um GET ao backend reaproveitando as conexões do pool"""
+    response = get_http_session().get(
+        f"{API_BASE_URL}{path}",
+        params=params,
+        timeout=30
+    )
+    return response.json()
+
+
+@st.cache_data(ttl=READ_CACHE_TTL, show_spinner=False)
+def cached_read(path: str, cert_id: str) -> dict:
+    """Consulta de leitura com cache curto; erros do backend não são armazenados"""
+    result = post_api(path, {"cert_id": cert_id})
+    if result.get("status") != "success":
+        raise UncachedResponse(result)
+    return result
+
+
 def verify_certificate(cert_id: str):
     """Chama a API para verificar uma certidão"""
     try:
-        response = requests.post(
-            f"{API_BASE_URL}/certidao/verify",
-            json={"cert_id": cert_id},
-            timeout=30
-        )
-        return response.json()
+        return cached_read("/certidao/verify", cert_id)
+    except UncachedResponse as e:
+        return e.payload
     except requests.exceptions.RequestException as e:
         return {"error": str(e)}
 
@@ -132,9 +183,20 @@ def verify_certificate(cert_id: str):
 def get_history(cert_id: str):
     """Chama a API para obter o histórico de uma certidão"""
     try:
-        response = requests.post(
-            f"{API_BASE_URL}/certidao/history",
+        return cached_read("/certidao/history", cert_id)
+    except UncachedResponse as e:
+        return e.payload
+    except requests.exceptions.RequestException as e:
+        return {"error": str(e)}
+
+
+def fetch_cert_pii(cert_id: str) -> dict:
+    """Dados pessoais de uma certidão off-ledger (nunca ficam no cache do Streamlit)"""
+    try:
+        response = get_http_session().post(
+            f"{API_BASE_URL}/certidao/pii",
             json={"cert_id": cert_id},
+            headers={"X-API-Key": PII_API_KEY},
             timeout=30
         )
         return response.json()
@@ -142,34 +204,165 @@ def get_history(cert_id: str):
         return {"error": str(e)}
 
 
+def fetch_history_page(cert_id: str, offset: int) -> dict:
+    """Busca no backend uma página do histórico (só o resumo de cada transação)"""
+    try:
+        return get_api(
+            f"/certidao/{quote(cert_id, safe='')}/history/page",
+            {"offset": offset, "limit": HISTORY_PAGE_SIZE}
+        )
+    except requests.exceptions.RequestException as e:
+        return {"error": str(e)}
+
+
+def get_history_page(cert_id: str, offset: int, fetched: dict = None) -> dict:
+    """Página do histórico; páginas já buscadas ficam no session_state"""
+    pages = st.session_state.setdefault("history_pages", {})
+    key = (cert_id, offset, HISTORY_PAGE_SIZE)
+    if key not in pages:
+        result = fetched if fetched is not None else fetch_history_page(cert_id, offset)
+        if result.get("status") != "success":
+            return result
+        pages[key] = result
+    return pages[key]
+
+
+def get_transaction_details(cert_id: str, tx_id: str) -> dict:
+    """Detalhes de uma transação do histórico, buscados só quando pedidos e guardados na sessão"""
+    details = st.session_state.setdefault("history_details", {})
+    key = (cert_id, tx_id)
+    if key not in details:
+        try:
+            result = get_api(f"/certidao/{quote(cert_id, safe='')}/history/tx/{quote(tx_id, safe='')}")
+        except requests.exceptions.RequestException as e:
+            return {"error": str(e)}
+        if result.get("status") != "success":
+            return result
+        details[key] = result
+    return details[key]
+
+
+def clear_history_session():
+    """Descarta páginas e detalhes de histórico guardados na sessão (após escritas)"""
+    st.session_state.pop("history_pages", None)
+    st.session_state.pop("history_details", None)
+    st.session_state.pop("history_explanations", None)
+
+
+def verify_with_history(cert_id: str):
+    """Busca verificação e a primeira página do histórico em paralelo"""
+    cached = (cert_id, 0, HISTORY_PAGE_SIZE) in st.session_state.get("history_pages", {})
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        verify_future = executor.submit(verify_certificate, cert_id)
+        # a thread só busca; o session_state é atualizado aqui, na thread do script
+        page_future = None if cached else executor.submit(fetch_history_page, cert_id, 0)
+        verify = verify_future.result()
+        fetched = page_future.result() if page_future else None
+    return verify, get_history_page(cert_id, 0, fetched)
+
+
+def _go_to_history_page(state_key: str, page: int):
+    st.session_state[state_key] = page
+
+
+def render_history_timeline(cert_id: str, key: str, first_page: dict = None):
+    """Linha do tempo paginada: renderiza só uma janela de transações e busca detalhes sob demanda.
+
+    O custo de cada rerun depende do tamanho da página, não do tamanho do histórico.
+    """
+    state_key = f"{key}_page_{cert_id}"
+    page_number = st.session_state.get(state_key, 0)
+    if page_number == 0 and first_page is not None:
+        page = first_page
+    else:
+        page = get_history_page(cert_id, page_number * HISTORY_PAGE_SIZE)
+
+    if "error" in page:
+        st.error(f"❌ Erro ao consultar histórico: {page['error']}")
+        return
+    if page.get("status") != "success":
+        st.error("❌ Erro ao consultar histórico. Tente novamente.")
+        return
+
+    total = page.get("total", 0)
+    if not total:
+        st.info("Nenhum histórico encontrado.")
+        return
+    page_count = max(1, math.ceil(total / HISTORY_PAGE_SIZE))
+
+    for entry in page.get("entries", []):
+        timestamp = entry.get("timestamp", "Data desconhecida")
+        tx_id = entry.get("txId") or "N/A"
+        if entry.get("isDelete", False):
+            st.markdown(f"🗑️ **{timestamp}** - Registro removido")
+        else:
+            st.markdown(f"📝 **{timestamp}** - Registro criado/atualizado")
+
+        # st.toggle em vez de st.expander: o conteúdo só é buscado/renderizado quando aberto
+        if st.toggle(f"Detalhes da transação {entry['index'] + 1}", key=f"{key}_tx_{cert_id}_{tx_id}"):
+            st.markdown(f"**ID da Transação:** `{tx_id}`")
+            details = get_transaction_details(cert_id, tx_id)
+            if "error" in details:
+                st.error(f"❌ Erro ao buscar detalhes: {details['error']}")
+            elif details.get("status") != "success":
+                st.error("❌ Transação não encontrada.")
+            elif details["entry"].get("value"):
+                st.json(details["entry"]["value"])
+
+    if page_count > 1:
+        col_prev, col_info, col_next = st.columns([1, 2, 1])
+        with col_prev:
+            st.button("⬅️ Anteriores", key=f"{key}_prev_{cert_id}", disabled=page_number == 0,
+                      on_click=_go_to_history_page, args=(state_key, page_number - 1), use_container_width=True)
+        with col_info:
+            first = page_number * HISTORY_PAGE_SIZE + 1
+            last = min(total, first + HISTORY_PAGE_SIZE - 1)
+            st.markdown(f"<div style='text-align: center;'>Transações {first}–{last} de {total} (página {page_number + 1}/{page_count})</div>",
+                        unsafe_allow_html=True)
+        with col_next:
+            st.button("Próximas ➡️", key=f"{key}_next_{cert_id}", disabled=page_number >= page_count - 1,
+                      on_click=_go_to_history_page, args=(state_key, page_number + 1), use_container_width=True)
+
+
 def register_certificate(cert_data: dict):
     """Chama a API para registrar uma nova certidão"""
     try:
-        response = requests.post(
-            f"{API_BASE_URL}/certidao/register",
-            json=cert_data,
-            timeout=30
-        )
-        return response.json()
+        result = post_api("/certidao/register", cert_data)
     except requests.exceptions.RequestException as e:
         return {"error": str(e)}
+    # Invalida leituras em cache que possam ter ficado desatualizadas
+    cached_read.clear()
+    clear_history_session()
+    return result
 
 
 def update_certificate(cert_id: str, field_name: str, new_value: str):
     """Chama a API para atualizar uma certidão"""
     try:
-        response = requests.post(
-            f"{API_BASE_URL}/certidao/update",
-            json={
-                "cert_id": cert_id,
-                "field_name": field_name,
-                "new_value": new_value
-            },
-            timeout=30
-        )
-        return response.json()
+        result = post_api("/certidao/update", {
+            "cert_id": cert_id,
+            "field_name": field_name,
+            "new_value": new_value
+        })
     except requests.exceptions.RequestException as e:
         return {"error": str(e)}
+    cached_read.clear()
+    clear_history_session()
+    return result
+
+
+def update_certificate_batch(cert_id: str, updates: dict):
+    """Chama a API para atualizar vários campos de uma certidão em uma única transação"""
+    try:
+        result = post_api("/certidao/update/batch", {
+            "cert_id": cert_id,
+            "updates": updates
+        })
+    except requests.exceptions.RequestException as e:
+        return {"error": str(e)}
+    cached_read.clear()
+    clear_history_session()
+    return result
 
 
 # ============== Interface Streamlit ==============
@@ -362,26 +555,42 @@ if pagina == "🏛️ Área do Cartório":
             
             st.warning("⚠️ **Atenção:** Todas as alterações são registradas permanentemente na blockchain.")
             
+            field_options = {
+                "Nome": "name",
+                "Data de Nascimento": "dateofbirth",
+                "Hora de Nascimento": "timeofbirth",
+                "Local de Nascimento": "placeofbirth",
+                "Nome do Pai": "fathername",
+                "Nome da Mãe": "mothername",
+                "Proprietário": "owner",
+                "Cartório": "source"
+            }
+            
+            modo_edicao = st.radio(
+                "Modo de edição",
+                ["Campo único", "Vários campos"],
+                horizontal=True,
+                key="edit_mode",
+                help="No modo 'Vários campos' todas as alterações são gravadas em uma única transação"
+            )
+            
             with st.form("edit_form"):
                 cert_id_edit = st.text_input("Código da Certidão *", placeholder="Ex: CERT001", key="edit_cert_id")
                 
-                field_options = {
-                    "Nome": "name",
-                    "Data de Nascimento": "dateofbirth",
-                    "Hora de Nascimento": "timeofbirth",
-                    "Local de Nascimento": "placeofbirth",
-                    "Nome do Pai": "fathername",
-                    "Nome da Mãe": "mothername",
-                    "Proprietário": "owner",
-                    "Cartório": "source"
-                }
-                
-                field_label = st.selectbox("Campo a ser alterado *", list(field_options.keys()))
-                new_value = st.text_input("Novo valor *", placeholder="Digite o novo valor")
+                if modo_edicao == "Campo único":
+                    field_label = st.selectbox("Campo a ser alterado *", list(field_options.keys()))
+                    new_value = st.text_input("Novo valor *", placeholder="Digite o novo valor")
+                else:
+                    st.markdown("Preencha apenas os campos que devem ser alterados:")
+                    batch_values = {}
+                    col1, col2 = st.columns(2)
+                    for i, label in enumerate(field_options):
+                        with (col1 if i % 2 == 0 else col2):
+                            batch_values[label] = st.text_input(label, key=f"batch_{field_options[label]}")
                 
                 submit_edit = st.form_submit_button("✏️ Atualizar Certidão", use_container_width=True)
                 
-                if submit_edit:
+                if submit_edit and modo_edicao == "Campo único":
                     if not all([cert_id_edit, new_value]):
                         st.error("❌ Preencha todos os campos!")
                     else:
@@ -396,6 +605,25 @@ if pagina == "🏛️ Área do Cartório":
                             st.success(f"✅ Campo **{field_label}** da certidão **{cert_id_edit}** atualizado com sucesso!")
                         else:
                             st.error("❌ Erro ao atualizar certidão.")
+                
+                elif submit_edit:
+                    updates = {
+                        field_options[label]: value
+                        for label, value in batch_values.items() if value
+                    }
+                    if not cert_id_edit or not updates:
+                        st.error("❌ Informe o código da certidão e ao menos um campo!")
+                    else:
+                        with st.spinner("Atualizando na blockchain..."):
+                            result = update_certificate_batch(cert_id_edit, updates)
+                        
+                        if "error" in result:
+                            st.error(f"❌ Erro ao atualizar: {result['error']}")
+                        elif result.get("status") == "success":
+                            alterados = ", ".join(label for label, value in batch_values.items() if value)
+                            st.success(f"✅ Campos **{alterados}** da certidão **{cert_id_edit}** atualizados em uma única transação!")
+                        else:
+                            st.error("❌ Erro ao atualizar certidão.")
         
         # Tab: Consultar Certidão
         with tab_consultar:
@@ -409,10 +637,14 @@ if pagina == "🏛️ Área do Cartório":
                 st.write("")
                 search_button = st.button("🔍 Buscar", use_container_width=True)
             
+            # A consulta ativa fica na sessão para sobreviver aos reruns da paginação do histórico
             if search_button and cert_id_search:
+                st.session_state["consulta_cert_id"] = cert_id_search
+            cert_id_search = st.session_state.get("consulta_cert_id")
+
+            if cert_id_search:
                 with st.spinner("Consultando blockchain..."):
-                    result = verify_certificate(cert_id_search)
-                    history_result = get_history(cert_id_search)
+                    result, first_history_page = verify_with_history(cert_id_search)
                 
                 if "error" in result:
                     st.error(f"❌ Erro ao consultar: {result['error']}")
@@ -429,6 +661,15 @@ if pagina == "🏛️ Área do Cartório":
                         else:
                             st.warning("⚠️ Certidão encontrada, mas há inconsistências no hash.")
                         
+                        # Registro off-ledger: dados pessoais vêm da coleção privada, com a chave do cartório
+                        if record.get("private"):
+                            pii = fetch_cert_pii(cert_id_search) if PII_API_KEY else {}
+                            if pii.get("status") == "success":
+                                record = dict(pii.get("data", {}), private=True)
+                            else:
+                                st.info("🔒 Dados pessoais guardados fora do estado público da blockchain. "
+                                        "Configure PII_API_KEY para exibi-los.")
+                        
                         # Dados
                         st.subheader("📋 Dados da Certidão")
                         col1, col2 = st.columns(2)
@@ -454,24 +695,7 @@ if pagina == "🏛️ Área do Cartório":
                         
                         # Histórico
                         st.subheader("📜 Histórico de Alterações")
-                        if history_result.get("status") == "success":
-                            history = history_result.get("history", [])
-                            if history:
-                                for i, item in enumerate(history):
-                                    timestamp = item.get("timestamp", "Data desconhecida")
-                                    is_delete = item.get("isDelete", False)
-                                    
-                                    if is_delete:
-                                        st.markdown(f"🗑️ **{timestamp}** - Registro removido")
-                                    else:
-                                        st.markdown(f"📝 **{timestamp}** - Registro criado/atualizado")
-                                    
-                                    with st.expander(f"Detalhes da transação {i+1}"):
-                                        st.markdown(f"**TX ID:** `{item.get('txId', 'N/A')}`")
-                                        if item.get("value"):
-                                            st.json(item["value"])
-                            else:
-                                st.info("Nenhum histórico encontrado.")
+                        render_history_timeline(cert_id_search, key="consulta", first_page=first_history_page)
                     else:
                         st.warning(f"⚠️ Certidão **{cert_id_search}** não encontrada.")
 
@@ -528,6 +752,9 @@ else:
                     
                     # Dados da certidão
                     st.subheader("📋 Dados da Certidão")
+                    if record.get("private"):
+                        st.info("🔒 Os dados pessoais desta certidão ficam protegidos fora da blockchain; "
+                                "a autenticidade foi conferida pelo hash. Solicite-os ao cartório.")
                     
                     col1, col2 = st.columns(2)
                     
@@ -586,25 +813,38 @@ else:
             st.write("")
             history_button = st.button("📜 Ver Histórico", type="primary", use_container_width=True)
         
+        # O certificado consultado fica na sessão para sobreviver aos reruns da paginação
         if history_button and hist_cert_id:
+            st.session_state["hist_active_cert_id"] = hist_cert_id
+        hist_cert_id = st.session_state.get("hist_active_cert_id")
+
+        if hist_cert_id:
             with st.spinner("Consultando histórico na blockchain..."):
-                result = get_history(hist_cert_id)
-            
-            if "error" in result:
-                st.error(f"❌ Erro ao consultar: {result['error']}")
-            elif result.get("status") == "success":
-                history = result.get("history", [])
-                
-                if history:
-                    st.success(f"📋 Encontrados {len(history)} registro(s) no histórico")
-                    
+                first_page = get_history_page(hist_cert_id, 0)
+
+            if "error" in first_page:
+                st.error(f"❌ Erro ao consultar: {first_page['error']}")
+            elif first_page.get("status") == "success":
+                total = first_page.get("total", 0)
+
+                if total:
+                    st.success(f"📋 Encontrados {total} registro(s) no histórico")
+
                     # Tradução para linguagem cidadã (primeiro, antes dos detalhes técnicos)
                     st.subheader("💬 Explicação do Histórico")
-                    
+
                     if OPENAI_API_KEY:
-                        with st.spinner("Gerando explicação..."):
-                            citizen_explanation = translate_history_to_citizen_language(history)
-                        
+                        # A explicação usa o histórico completo; é gerada uma vez por certidão na sessão
+                        explanations = st.session_state.setdefault("history_explanations", {})
+                        if hist_cert_id not in explanations:
+                            with st.spinner("Gerando explicação..."):
+                                history_result = get_history(hist_cert_id)
+                                explanations[hist_cert_id] = (
+                                    translate_history_to_citizen_language(history_result.get("history", []))
+                                    if history_result.get("status") == "success" else None
+                                )
+                        citizen_explanation = explanations[hist_cert_id]
+
                         if citizen_explanation:
                             st.markdown(f"""
                             <div class="info-box">
@@ -613,26 +853,12 @@ else:
                             """, unsafe_allow_html=True)
                     else:
                         st.info("💡 A tradução automática está desativada. Configure a variável OPENAI_API_KEY no arquivo .env")
-                    
+
                     st.markdown("---")
-                    
-                    # Timeline visual
+
+                    # Timeline visual (paginada)
                     st.subheader("📜 Detalhes Técnicos")
-                    for i, item in enumerate(history):
-                        with st.container():
-                            timestamp = item.get("timestamp", "Data desconhecida")
-                            tx_id = item.get("txId", "N/A")[:16] + "..."
-                            is_delete = item.get("isDelete", False)
-                            
-                            if is_delete:
-                                st.markdown(f"🗑️ **{timestamp}** - Registro removido")
-                            else:
-                                st.markdown(f"📝 **{timestamp}** - Registro atualizado")
-                            
-                            with st.expander(f"Ver detalhes da transação {i+1}"):
-                                st.markdown(f"**ID da Transação:** `{item.get('txId', 'N/A')}`")
-                                if item.get("value"):
-                                    st.json(item["value"])
+                    render_history_timeline(hist_cert_id, key="publico", first_page=first_page)
                 else:
                     st.info(f"ℹ️ Nenhum histórico encontrado para a certidão '{hist_cert_id}'.")
             else:
@@ -19,9 +19,10 @@ CC_PATH=${2:-}        # Caminho para o diretório do módulo Go (ex: ../../chain
 CC_VERSION=${3:-1.0}  # Versão (default = 1.0)
 CC_SEQUENCE=${4:-1}   # Sequência de deploy (default = 1)
 CHANNEL_NAME=${5:-certchannel} # Canal padrão (default = certchannel)
+CC_COLL_CONFIG=${6:-}  # Coleções de dados privados (ex: ../../chaincode/collections_config.json, para PII_MODE=private)
 
 if [ -z "$CC_NAME" ] || [ -z "$CC_PATH" ]; then
-    echo "Uso: ./deployCC.sh <cc_name> <cc_path> [cc_version] [cc_sequence] [channel]"
+    echo "Uso: ./deployCC.sh <cc_name> <cc_path> [cc_version] [cc_sequence] [channel] [collections_config]"
     exit 1
 fi
 
@@ -134,6 +135,13 @@ fi
 
 infoln "Package ID encontrado: ${PACKAGE_ID}"
 
+# Coleção certPII (dados pessoais fora do estado público), se informada
+COLL_ARGS=()
+if [ -n "$CC_COLL_CONFIG" ]; then
+    infoln "Usando coleções de dados privados: ${CC_COLL_CONFIG}"
+    COLL_ARGS=(--collections-config "${CC_COLL_CONFIG}")
+fi
+
 # ===============================
 # APROVAÇÃO DAS ORGANIZAÇÕES
 # ===============================
@@ -147,6 +155,7 @@ peer lifecycle chaincode approveformyorg \
     --version ${CC_VERSION} \
     --package-id ${PACKAGE_ID} \
     --sequence ${CC_SEQUENCE} \
+    ${COLL_ARGS[@]+"${COLL_ARGS[@]}"} \
     --tls --cafile ${ORDERER_CA}
 
 infoln "Aprovando chaincode para Org2..."
@@ -159,6 +168,7 @@ peer lifecycle chaincode approveformyorg \
     --version ${CC_VERSION} \
     --package-id ${PACKAGE_ID} \
     --sequence ${CC_SEQUENCE} \
+    ${COLL_ARGS[@]+"${COLL_ARGS[@]}"} \
     --tls --cafile ${ORDERER_CA}
 
 # ===============================
@@ -177,6 +187,7 @@ peer lifecycle chaincode commit \
     --tlsRootCertFiles ${PEER0_ORG1_CA} \
     --peerAddresses localhost:9051 \
     --tlsRootCertFiles ${PEER0_ORG2_CA} \
+    ${COLL_ARGS[@]+"${COLL_ARGS[@]}"} \
     --tls --cafile ${ORDERER_CA}
 
 
@@ -7,21 +7,32 @@ import base64
 import copy
 import json
 import math
-from typing import Any
+from typing import Any, List, NamedTuple
+
+
+class NewOrderer(NamedTuple):
+    address: str
+    identity_pem_path: str
+    server_pem_path: str
+    client_pem_path: str
 
 
 def parse_args():
     parser = argparse.ArgumentParser(
         prog='Config Update',
-        description='What the program does',
+        description='Adds one or more BFT orderers to a channel config in a single pass. '
+                    'Repeat -a/-i/-s/-c once per orderer, in the same order.',
         epilog='Text at the bottom of help')
     parser.add_argument('config_path', type=str)
     parser.add_argument('updated_config_path', type=str)
-    parser.add_argument('-a', '--address', type=str, required=True)
-    parser.add_argument('-i', '--identity', type=str, required=True)
-    parser.add_argument('-s', '--server-cert', type=str, required=True)
-    parser.add_argument('-c', '--client-cert', type=str, required=True)
-    return parser.parse_args()
+    parser.add_argument('-a', '--address', type=str, action='append', required=True)
+    parser.add_argument('-i', '--identity', type=str, action='append', required=True)
+    parser.add_argument('-s', '--server-cert', type=str, action='append', required=True)
+    parser.add_argument('-c', '--client-cert', type=str, action='append', required=True)
+    args = parser.parse_args()
+    if not len(args.address) == len(args.identity) == len(args.server_cert) == len(args.client_cert):
+        parser.error('-a, -i, -s and -c must be given the same number of times (once per orderer)')
+    return args
 
 
 def _pem_file_to_base64(path: str) -> str:
@@ -31,13 +42,21 @@ def _pem_file_to_base64(path: str) -> str:
         return base64_encoded_data.decode('utf-8')
 
 
-def _log_update(name: str, old: Any, new: Any) -> None:
-    print('=' * 50)
-    print(f'Updating {name}:')
-    print(f'{old}')
-    print(">" * 25)
-    print(f'{new}')
-    print('=' * 50)
+def _short(value: Any) -> Any:
+    """Abbreviates base64 certificates so the diff stays readable"""
+    if isinstance(value, dict):
+        return {k: _short(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_short(v) for v in value]
+    if isinstance(value, str) and len(value) > 48:
+        return f'{value[:16]}...({len(value)} chars)'
+    return value
+
+
+def _log_update(name: str, added: List[Any], changed: str = '') -> None:
+    print(f'{name}: +{len(added)}{" " + changed if changed else ""}')
+    for item in added:
+        print(f'  + {json.dumps(_short(item))}')
 
 
 def _calculate_bft_quorum(n: int) -> int:
@@ -45,47 +64,54 @@ def _calculate_bft_quorum(n: int) -> int:
     return int(math.ceil((n + f + 1) / 2))
 
 
-def update_config(config_path: str, updated_config_path: str, address: str, identity_pem_path: str, server_pem_path: str, client_pem_path: str):
+def update_config(config_path: str, updated_config_path: str, new_orderers: List[NewOrderer]):
     with open(config_path, 'r') as f:
         config = json.load(f)
-    identity = _pem_file_to_base64(identity_pem_path)
-    client_cert = _pem_file_to_base64(client_pem_path)
-    server_cert = _pem_file_to_base64(server_pem_path)
-    host, port = address.split(':')
-
-    addresses = config['channel_group']['groups']['Orderer']['groups']['OrdererOrg']['values']['Endpoints']['value']['addresses']
-    addresses_before_update = copy.deepcopy(addresses)
-    original_orderers_count = len(addresses_before_update)
-    addresses.append(f'{addresses[0].split(":")[0]}:{port}')
-    new_orderers_count = len(addresses)
-    _log_update('addresses', addresses_before_update, addresses)
-
-    identities = config['channel_group']['groups']['Orderer']['policies']['BlockValidation']['policy']['value']['identities']
-    identities_before_update = copy.deepcopy(identities)
-    new_identity = copy.deepcopy(identities[0])
-    new_identity['principal']['id_bytes'] = identity
-    identities.append(new_identity)
-    _log_update('block validation identities', identities_before_update, identities)
-
-    rule = config['channel_group']['groups']['Orderer']['policies']['BlockValidation']['policy']['value'][
-        'rule']
-    rule_before_update = copy.deepcopy(rule)
-    rule['n_out_of']['n'] = _calculate_bft_quorum(new_orderers_count)
-    rule['n_out_of']['rules'].append({'signed_by': new_orderers_count - 1})
-    _log_update('block validation rules', rule_before_update, rule)
-
-    consenter_mapping = config['channel_group']['groups']['Orderer']['values']['Orderers']['value']['consenter_mapping']
-    consenter_mapping_before_update = copy.deepcopy(consenter_mapping)
-    consenter_mapping.append({
-        'client_tls_cert': client_cert,
-        'host': host,
-        'id': new_orderers_count,
-        'identity': identity,
-        'msp_id': consenter_mapping[0]['msp_id'],
-        'port': port,
-        'server_tls_cert': server_cert
-    })
-    _log_update('consenter_mapping', consenter_mapping_before_update, consenter_mapping)
+
+    orderer_group = config['channel_group']['groups']['Orderer']
+    addresses = orderer_group['groups']['OrdererOrg']['values']['Endpoints']['value']['addresses']
+    block_validation = orderer_group['policies']['BlockValidation']['policy']['value']
+    identities = block_validation['identities']
+    rule = block_validation['rule']
+    consenter_mapping = orderer_group['values']['Orderers']['value']['consenter_mapping']
+
+    added_addresses, added_identities, added_rules, added_consenters = [], [], [], []
+    next_consenter_id = max(consenter['id'] for consenter in consenter_mapping) + 1
+    for orderer in new_orderers:
+        identity = _pem_file_to_base64(orderer.identity_pem_path)
+        host, port = orderer.address.split(':')
+
+        added_addresses.append(f'{addresses[0].split(":")[0]}:{port}')
+
+        new_identity = copy.deepcopy(identities[0])
+        new_identity['principal']['id_bytes'] = identity
+        added_identities.append(new_identity)
+        added_rules.append({'signed_by': len(identities) + len(added_identities) - 1})
+
+        added_consenters.append({
+            'client_tls_cert': _pem_file_to_base64(orderer.client_pem_path),
+            'host': host,
+            'id': next_consenter_id,
+            'identity': identity,
+            'msp_id': consenter_mapping[0]['msp_id'],
+            'port': port,
+            'server_tls_cert': _pem_file_to_base64(orderer.server_pem_path)
+        })
+        next_consenter_id += 1
+
+    addresses.extend(added_addresses)
+    identities.extend(added_identities)
+    rule['n_out_of']['rules'].extend(added_rules)
+    consenter_mapping.extend(added_consenters)
+
+    # Quorum recomputed once, for the final number of consenters
+    old_quorum = rule['n_out_of']['n']
+    rule['n_out_of']['n'] = _calculate_bft_quorum(len(consenter_mapping))
+
+    _log_update('addresses', added_addresses)
+    _log_update('block validation identities', added_identities)
+    _log_update('block validation rules', added_rules, f'(n_out_of.n: {old_quorum} -> {rule["n_out_of"]["n"]})')
+    _log_update('consenter_mapping', added_consenters)
 
     with open(updated_config_path, 'w') as f:
         json.dump(config, f)
@@ -93,6 +119,9 @@ def update_config(config_path: str, updated_config_path: str, address: str, iden
 # Press the green button in the gutter to run the script.
 if __name__ == '__main__':
     args = parse_args()
-    update_config(args.config_path, args.updated_config_path, args.address, args.identity, args.server_cert, args.client_cert)
+    update_config(args.config_path, args.updated_config_path, [
+        NewOrderer(*orderer)
+        for orderer in zip(args.address, args.identity, args.server_cert, args.client_cert)
+    ])
 
 # See PyCharm help at https://www.jetbrains.com/help/pycharm/